@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import MozillaCookieJar
+
+from coloredlogs import ColoredFormatter
+from dotenv import load_dotenv
+
+from constants import *
+from jobstore import JobStore
+from runner import run
+from transcode import NVENC_MAX_WORKERS, X265_THREADS_PER_ENCODE
+
+logger = logging.getLogger("udemy-downloader.batch")
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+COURSE_NAME_RE = re.compile(r"(?i)//(?P<portal_name>.+?)\.udemy\.com/(?:course(?:/draft)*/)?(?P<name_or_id>[a-zA-Z0-9_-]+)")
+# set by the batch for every course, passing them through would break the per-course logs and budgets
+RESERVED_ARGS = ("-c", "--course-url", "-cd", "--concurrent-downloads", "--job-manifest", "--log-file", "--cookies")
+
+
+def read_course_list(path, portal="www"):
+    """
+    Course URLs from a file, one per line. Bare ids or slugs are turned into URLs of `portal`,
+    blank lines and # comments are skipped, duplicates are dropped.
+    """
+    courses = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if "/" not in line:
+                line = f"https://{portal}.udemy.com/course/{line}/"
+            courses.append(line)
+    return list(dict.fromkeys(courses))
+
+
+def course_slug(url):
+    match = COURSE_NAME_RE.search(url)
+    name = f"{match.group('portal_name')}-{match.group('name_or_id')}" if match else url
+    return re.sub(r"[^\w-]+", "_", name).strip("_")[:100]
+
+
+def export_browser_cookies(browser, path):
+    """
+    Reads the Udemy cookies of a browser once, into a cookies file every course process loads
+    """
+    import browser_cookie3
+
+    jar = MozillaCookieJar(path)
+    for cookie in getattr(browser_cookie3, browser)(domain_name="udemy.com"):
+        jar.set_cookie(cookie)
+    jar.save(ignore_discard=True, ignore_expires=True)
+    os.chmod(path, 0o600)
+    return len(jar)
+
+
+def transcode_workers_per_course(jobs, use_nvenc):
+    """
+    The encode workers one course would get alone (see TranscodeQueue), shared between `jobs` courses
+    """
+    if use_nvenc:
+        return max(1, NVENC_MAX_WORKERS // jobs)
+    return max(1, (os.cpu_count() or 1) // X265_THREADS_PER_ENCODE // jobs)
+
+
+def read_course_dir(manifest_path):
+    """
+    The output directory of a course, from the first record of its run's manifest
+    """
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("kind") == "course_dir":
+                return record.get("path")
+    return None
+
+
+class BatchRunner(object):
+    """
+    Runs main.py for many courses, `jobs` at a time. Every course is its own process (main.py keeps its state in
+    module globals and changes directories while downloading), sharing the session resolved once by the batch.
+    """
+
+    def __init__(self, courses, jobs, batch_dir, child_args, env):
+        self.courses = courses
+        self.jobs = max(1, min(jobs, len(courses)))
+        self.batch_dir = batch_dir
+        self.child_args = child_args
+        self.env = env
+        self.stop_event = threading.Event()
+        self.summaries = []
+        self._lock = threading.Lock()
+
+    def run_course(self, index, url):
+        if self.stop_event.is_set():
+            return None
+        slug = course_slug(url)
+        log_path = os.path.join(self.batch_dir, "logs", f"{slug}.log")
+        manifest_path = os.path.join(self.batch_dir, "manifests", f"{slug}.jsonl")
+        argv = [
+            sys.executable,
+            MAIN_SCRIPT,
+            "-c",
+            url,
+            "--job-manifest",
+            manifest_path,
+            "--log-file",
+            log_path,
+            *self.child_args,
+        ]
+        logger.info(f"> [{index}/{len(self.courses)}] Starting {url}")
+        result = run(argv, name=slug, stop_event=self.stop_event, cwd=HOME_DIR, env=self.env)
+
+        summary = {
+            "course_url": url,
+            "ok": result.ok,
+            "returncode": result.returncode,
+            "elapsed": round(result.elapsed, 1),
+            "log": log_path,
+            "manifest": manifest_path,
+            "course_dir": read_course_dir(manifest_path),
+            "items": {},
+        }
+        if not result.ok:
+            summary["error"] = result.describe()
+        store = JobStore.for_course(summary["course_dir"], create=False) if summary["course_dir"] else None
+        if store:
+            summary["items"] = store.summary()
+            store.close()
+
+        counts = "; ".join(
+            f"{kind}s: " + ", ".join(f"{n} {status}" for status, n in sorted(statuses.items()))
+            for kind, statuses in sorted(summary["items"].items())
+        )
+        if result.ok:
+            logger.info(f"> [{index}/{len(self.courses)}] Finished {url} in {summary['elapsed']}s ({counts or 'nothing recorded'})")
+        else:
+            logger.error(f"> [{index}/{len(self.courses)}] {url} failed: {summary['error']}, see {log_path}")
+        with self._lock:
+            self.summaries.append(summary)
+            self.write_summary()
+        return summary
+
+    def write_summary(self):
+        path = os.path.join(self.batch_dir, "summary.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summaries, f, indent=2, ensure_ascii=False)
+        return path
+
+    def run(self):
+        os.makedirs(os.path.join(self.batch_dir, "logs"), exist_ok=True)
+        os.makedirs(os.path.join(self.batch_dir, "manifests"), exist_ok=True)
+        executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="course")
+        futures = [executor.submit(self.run_course, i + 1, url) for i, url in enumerate(self.courses)]
+        try:
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            logger.warning("> Interrupted, stopping the running courses...")
+            self.stop_event.set()
+            for future in futures:
+                future.cancel()
+        executor.shutdown(wait=True)
+        failed = [s for s in self.summaries if not s["ok"]]
+        logger.info(
+            f"> {len(self.summaries) - len(failed)} of {len(self.courses)} course(s) finished, {len(failed)} failed. "
+            f"Summary saved to {self.write_summary()}"
+        )
+        return not failed and len(self.summaries) == len(self.courses)
+
+
+def setup_logging(batch_dir, log_level):
+    logging.root.setLevel(log_level)
+    stream = logging.StreamHandler()
+    stream.setLevel(log_level)
+    stream.setFormatter(ColoredFormatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    file_handler = logging.FileHandler(os.path.join(batch_dir, "batch.log"))
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    root = logging.getLogger("udemy-downloader")
+    root.setLevel(log_level)
+    root.addHandler(stream)
+    root.addHandler(file_handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Udemy Downloader batch mode: downloads every course listed in a file, several at a time. "
+        "Arguments not listed here are passed to main.py for every course.",
+    )
+    parser.add_argument("-f", "--courses", dest="courses", required=True, help="File with one course URL or id per line")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=2, help="Courses to download at the same time (Default is 2)")
+    parser.add_argument(
+        "--download-budget",
+        dest="download_budget",
+        type=int,
+        default=30,
+        help="Concurrent segment downloads shared by all running courses (Default is 30)",
+    )
+    parser.add_argument("--portal", dest="portal", default="www", help="Portal of the courses given by id (Default is www)")
+    parser.add_argument("-b", "--bearer", dest="bearer_token", type=str, help="The Bearer token to use")
+    parser.add_argument(
+        "--browser",
+        dest="browser",
+        help="The browser to extract cookies from, once for all courses",
+        choices=["chrome", "firefox", "opera", "edge", "brave", "chromium", "vivaldi", "safari", "file"],
+    )
+    parser.add_argument("--batch-dir", dest="batch_dir", type=str, help="Directory for the logs and summary of this batch")
+    parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", help="Logging level of the batch itself")
+    args, child_args = parser.parse_known_args()
+
+    reserved = [arg for arg in child_args if arg.split("=", 1)[0] in RESERVED_ARGS]
+    if reserved:
+        parser.error(f"{', '.join(reserved)} can't be passed to the courses of a batch")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    batch_dir = os.path.abspath(args.batch_dir or os.path.join(LOG_DIR_PATH, f"batch-{time.strftime('%Y-%m-%d-%H-%M-%S')}"))
+    os.makedirs(batch_dir, exist_ok=True)
+    setup_logging(batch_dir, getattr(logging, args.log_level.upper(), logging.INFO))
+
+    courses = read_course_list(args.courses, args.portal)
+    if not courses:
+        logger.error(f"> No courses found in {args.courses}")
+        sys.exit(1)
+
+    # authenticate once: every course process gets the same token or cookies
+    load_dotenv()
+    env = dict(os.environ)
+    bearer_token = args.bearer_token or os.getenv("UDEMY_BEARER")
+    if bearer_token:
+        # through the environment, so the token doesn't show up in process listings
+        env["UDEMY_BEARER"] = bearer_token
+    elif args.browser == "file":
+        child_args += ["--browser", "file", "--cookies", COOKIE_FILE_PATH]
+    elif args.browser:
+        cookie_path = os.path.join(batch_dir, "cookies.txt")
+        count = export_browser_cookies(args.browser, cookie_path)
+        logger.info(f"> Read {count} Udemy cookie(s) from {args.browser}")
+        child_args += ["--browser", "file", "--cookies", cookie_path]
+    else:
+        logger.error("> No bearer token was provided, and no browser for cookie extraction was specified.")
+        sys.exit(1)
+
+    jobs = max(1, min(args.jobs, len(courses)))
+    child_args += ["--concurrent-downloads", str(max(1, min(30, args.download_budget // jobs)))]
+    if "--use-h265" in child_args and "--transcode-workers" not in child_args:
+        child_args += ["--transcode-workers", str(transcode_workers_per_course(jobs, "--use-nvenc" in child_args))]
+    if "--sync" not in child_args and "--info" not in child_args:
+        # nobody is there to pick lectures in a window
+        child_args.append("--all-lectures")
+
+    logger.info(f"> Downloading {len(courses)} course(s), {jobs} at a time. Logs and summary in {batch_dir}")
+    ok = BatchRunner(courses, jobs, batch_dir, child_args, env).run()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
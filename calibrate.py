@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import tempfile
+import time
+
+from runner import run
+from transcode import PROBE_TIMEOUT, probe_video
+
+logger = logging.getLogger("udemy-downloader.calibrate")
+
+X265_PRESETS = ["veryfast", "fast", "medium", "slow"]
+NVENC_PRESETS = ["p1", "p4", "p7"]
+CALIBRATION_CRFS = [24, 28, 32]
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 20
+# settings below this average PSNR (dB) against the source are visibly worse, recommended only when all are
+MIN_PSNR = 38.0
+
+PSNR_RE = re.compile(r"average:([0-9.]+|inf)")
+
+
+def pick_samples(video_dir, count=SAMPLE_COUNT):
+    """
+    Picks videos spread evenly over a course directory, in lecture order
+    """
+    videos = []
+    for root, _, files in os.walk(video_dir):
+        for name in files:
+            if name.endswith(".mp4") and ".encrypted" not in name:
+                videos.append(os.path.join(root, name))
+    videos.sort()
+    if len(videos) <= count:
+        return videos
+    step = len(videos) / count
+    return [videos[int(i * step + step / 2)] for i in range(count)]
+
+
+def cut_sample(ffmpeg, video_path, sample_path, seconds=SAMPLE_SECONDS, ffprobe="ffprobe"):
+    """
+    Copies a short piece from the middle of a video (no re-encode, so it starts on a keyframe)
+    """
+    _, _, duration = probe_video(video_path, ffprobe=ffprobe)
+    start = max(0.0, (duration or 0.0) / 2 - seconds / 2)
+    cmd = [
+        ffmpeg,
+        "-nostdin",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-ss",
+        f"{start:.2f}",
+        "-i",
+        video_path,
+        "-t",
+        str(seconds),
+        "-map",
+        "0:v:0",
+        "-c",
+        "copy",
+        sample_path,
+    ]
+    return run(cmd, name="ffmpeg").ok
+
+
+def measure_psnr(ffmpeg, encoded_path, reference_path):
+    """
+    Average PSNR of an encode against its source, a cheap stand-in for perceptual quality metrics
+    """
+    cmd = [
+        ffmpeg,
+        "-nostdin",
+        "-hide_banner",
+        "-i",
+        encoded_path,
+        "-i",
+        reference_path,
+        "-lavfi",
+        "[0:v][1:v]psnr",
+        "-f",
+        "null",
+        "-",
+    ]
+    result = run(cmd, name="ffmpeg")
+    match = next((m for m in map(PSNR_RE.search, reversed(result.output)) if m), None)
+    if not result.ok or not match:
+        return None
+    return 100.0 if match.group(1) == "inf" else float(match.group(1))
+
+
+def calibrate(transcode_queue, video_dir, min_fps=None, presets=None, crfs=None):
+    """
+    Encodes samples of the videos in video_dir with every preset/CRF combination and measures
+    host throughput (fps across all transcode workers), output size and PSNR.
+    Returns (results, recommendation), where recommendation is the smallest output that reaches
+    min_fps (default: real time) at acceptable quality, or the fastest acceptable setting if none does.
+    """
+    presets = presets or (NVENC_PRESETS if transcode_queue.use_nvenc else X265_PRESETS)
+    crfs = crfs or CALIBRATION_CRFS
+    videos = pick_samples(video_dir)
+    if not videos:
+        logger.error("> No downloaded videos found in %s to calibrate with", video_dir)
+        return [], None
+
+    work_dir = tempfile.mkdtemp(prefix="h265-calibration-")
+    try:
+        samples = []
+        for i, video in enumerate(videos):
+            sample_path = os.path.join(work_dir, f"sample_{i}.mp4")
+            if cut_sample(transcode_queue.ffmpeg, video, sample_path, ffprobe=transcode_queue.ffprobe):
+                samples.append(sample_path)
+        if not samples:
+            logger.error("> Couldn't cut any samples for calibration")
+            return [], None
+        source_size = sum(os.path.getsize(sample) for sample in samples)
+        logger.info("> Calibrating with %d sample(s) of %ds from %s", len(samples), SAMPLE_SECONDS, video_dir)
+
+        results = []
+        for preset in presets:
+            for crf in crfs:
+                frames = 0
+                elapsed = 0.0
+                size = 0
+                psnr_values = []
+                for i, sample in enumerate(samples):
+                    encoded_path = os.path.join(work_dir, f"encoded_{i}.mp4")
+                    start = time.time()
+                    sample_frames = transcode_queue.encode_file(
+                        sample, encoded_path, f"calibration {preset}/{crf}", audio=False, crf=crf, preset=preset
+                    )
+                    elapsed += time.time() - start
+                    if sample_frames is None:
+                        break
+                    frames += sample_frames
+                    size += os.path.getsize(encoded_path)
+                    psnr = measure_psnr(transcode_queue.ffmpeg, encoded_path, sample)
+                    if psnr is not None:
+                        psnr_values.append(psnr)
+                else:
+                    fps = frames / elapsed if elapsed else 0.0
+                    result = {
+                        "preset": preset,
+                        "crf": crf,
+                        "fps": round(fps, 1),
+                        # every transcode worker runs one encode at a time
+                        "host_fps": round(fps * transcode_queue.workers, 1),
+                        "size_ratio": round(size / source_size, 3) if source_size else None,
+                        "psnr": round(sum(psnr_values) / len(psnr_values), 2) if psnr_values else None,
+                    }
+                    results.append(result)
+                    logger.info(
+                        "  > %-9s crf %2d: %6.1f fps (%6.1f host), %5.1f%% of source size, PSNR %s dB",
+                        preset,
+                        crf,
+                        result["fps"],
+                        result["host_fps"],
+                        (result["size_ratio"] or 0) * 100,
+                        result["psnr"],
+                    )
+                    continue
+                logger.warning("  > %s crf %d failed to encode, skipping", preset, crf)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if min_fps is None:
+        # keep up with playback: one second of video encoded per second
+        min_fps = max((source_fps(sample, transcode_queue.ffprobe) for sample in videos), default=30.0)
+    return results, recommend(results, min_fps)
+
+
+def source_fps(video_path, ffprobe="ffprobe"):
+    cmd = [
+        ffprobe,
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=avg_frame_rate",
+        "-of",
+        "default=noprint_wrappers=1:nokey=1",
+        video_path,
+    ]
+    result = run(cmd, timeout=PROBE_TIMEOUT, capture_stdout=True)
+    num, _, den = (result.stdout or "").strip().partition("/")
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 30.0
+
+
+def recommend(results, min_fps):
+    acceptable = [r for r in results if r["psnr"] is None or r["psnr"] >= MIN_PSNR]
+    fast_enough = [r for r in acceptable if r["host_fps"] >= min_fps]
+    if fast_enough:
+        return min(fast_enough, key=lambda r: (r["size_ratio"] or 0, -r["host_fps"]))
+    # too slow everywhere: the fastest setting that still looks right, any setting only if none does
+    candidates = acceptable or results
+    if candidates:
+        return max(candidates, key=lambda r: r["host_fps"])
+    return None
+
+
+def calibration_path(saved_dir):
+    return os.path.join(saved_dir, "h265_calibration.json")
+
+
+def save_calibration(saved_dir, recommendation, encoder):
+    """
+    Stores the recommended settings for this host, next to the ones of other hosts sharing the directory
+    """
+    path = calibration_path(saved_dir)
+    data = {}
+    if os.path.isfile(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    data[platform.node()] = {**recommendation, "encoder": encoder, "calibrated_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    return path
+
+
+def load_calibration(saved_dir, encoder):
+    """
+    Returns the stored settings for this host and encoder, or None if it hasn't been calibrated
+    """
+    path = calibration_path(saved_dir)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            settings = json.load(f).get(platform.node())
+    except ValueError:
+        return None
+    if settings and settings.get("encoder") == encoder:
+        return settings
+    return None
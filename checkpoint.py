@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import time
+
+# pages hold signed media URLs that expire, older checkpoints are fetched again
+CHECKPOINT_MAX_AGE = 6 * 60 * 60
+
+
+class CurriculumCheckpoint(object):
+    """
+    Curriculum pages of a course, saved one file per page as they arrive (saved/curriculum/<course_id>/),
+    so an interrupted fetch resumes from the first missing page instead of starting over
+    """
+
+    def __init__(self, saved_dir, course_id, max_age=CHECKPOINT_MAX_AGE):
+        self.path = os.path.join(saved_dir, "curriculum", str(course_id))
+        self.max_age = max_age
+        self.meta = None
+
+    def _page_path(self, page):
+        return os.path.join(self.path, f"page_{page:04d}.json")
+
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def _write(self, path, data):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        # a page is either fully there or not at all
+        os.replace(tmp_path, path)
+
+    def _read(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def open(self, count, page_size):
+        """
+        Starts or resumes a fetch of `count` items. Pages saved by an older fetch, one that is too old,
+        or one of a curriculum that has changed size since are discarded. Returns the page count.
+        """
+        meta = self._read(self._meta_path())
+        if (
+            not meta
+            or meta.get("count") != count
+            or meta.get("page_size") != page_size
+            or time.time() - meta.get("started_at", 0) > self.max_age
+        ):
+            self.clear()
+            meta = {"count": count, "page_size": page_size, "started_at": time.time()}
+            self._write(self._meta_path(), meta)
+        self.meta = meta
+        return max(1, -(-count // page_size))
+
+    def page_count(self):
+        return max(1, -(-self.meta["count"] // self.meta["page_size"]))
+
+    def saved_pages(self):
+        return [page for page in range(1, self.page_count() + 1) if os.path.isfile(self._page_path(page))]
+
+    def load(self, page):
+        """
+        Returns a saved page, None if it hasn't been fetched (or the fetch being resumed is stale)
+        """
+        if self.meta is None:
+            meta = self._read(self._meta_path())
+            if not meta or time.time() - meta.get("started_at", 0) > self.max_age:
+                return None
+        return self._read(self._page_path(page))
+
+    def save(self, page, data):
+        self._write(self._page_path(page), data)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.meta = None
@@ -26,11 +26,19 @@ CURRICULUM_ITEMS_PARAMS = {
     "fields[quiz]": "title,object_index,type",
     "fields[practice]": "title,object_index",
     "fields[chapter]": "title,object_index",
-    "fields[asset]": "title,filename,asset_type,status,is_external,media_license_token,course_is_drmed,media_sources,captions,slides,slide_urls,download_urls,external_url,stream_urls,@min,status,delayed_asset_message,processing_errors,body",
+    "fields[asset]": "title,filename,asset_type,status,is_external,media_license_token,course_is_drmed,media_sources,captions,slides,slide_urls,download_urls,external_url,stream_urls,@min,status,delayed_asset_message,processing_errors,body,time_estimation",
     "caching_intent": True,
     "page_size": "200",
 }
 
+# attempts per curriculum page, waiting 1, 2, 4... seconds (at most CURRICULUM_BACKOFF_MAX) in between
+CURRICULUM_PAGE_RETRIES = 8
+CURRICULUM_BACKOFF_MAX = 60
+# lectures whose playlists/manifests --info and --estimate fetch at the same time
+RESOLVE_WORKERS = 8
+# how long --info and --estimate reuse the playlists/manifests saved in temp/, their signed URLs expire
+MANIFEST_CACHE_MAX_AGE = 30 * 60
+
 COURSE_URL_PARAMS = {"fields[course]": "title", "use_remote_version": True, "caching_intent": True}
 
 HOME_DIR = os.getcwd()
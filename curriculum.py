@@ -0,0 +1,375 @@
+import logging
+
+from pathvalidate import sanitize_filename
+
+logger = logging.getLogger("udemy-downloader.curriculum")
+
+# asset type of a lecture -> (type of the downloaded asset, key of its download_urls)
+LECTURE_FILE_ASSETS = {
+    "e-book": ("ebook", "E-Book"),
+    "file": ("file", "File"),
+    "presentation": ("presentation", "Presentation"),
+    "audio": ("audio", "Audio"),
+}
+# asset type of a supplementary asset -> (type of the downloaded asset, key of its download_urls)
+SUPPLEMENTARY_ASSETS = {
+    "file": ("file", "File"),
+    "sourcecode": ("source_code", "SourceCode"),
+    "externallink": ("external_link", None),
+}
+
+
+def _download_url(download_urls, key):
+    if not download_urls or not isinstance(download_urls, dict):
+        return None
+    files = download_urls.get(key) or []
+    return files[0].get("file") if files else None
+
+
+def _extension(filename):
+    return filename.rsplit(".", 1)[-1] if filename and "." in filename else ""
+
+
+class Record(object):
+    """
+    A compact curriculum record: only the fields in __slots__, saved and loaded as plain dicts
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        unknown = set(fields) - set(self.__slots__)
+        if unknown:
+            raise TypeError(f"unknown {type(self).__name__} field(s): {', '.join(sorted(unknown))}")
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__[:3])})"
+
+
+class Source(Record):
+    """
+    A video stream as the curriculum lists it (stream_urls, or media_sources for DRM lectures), resolved into
+    renditions only when the lecture is downloaded since their playlists/manifests expire
+    """
+
+    __slots__ = ("type", "label", "url")
+
+
+class Caption(Record):
+    __slots__ = ("id", "language", "locale", "extension", "url", "created")
+
+    @classmethod
+    def from_track(cls, track):
+        url = track.get("url") if isinstance(track.get("url"), str) else None
+        return cls(
+            id=track.get("id"),
+            language=(
+                track.get("language")
+                or track.get("srclang")
+                or track.get("label")
+                or (track.get("locale_id") or "").split("_")[0]
+            ),
+            locale=track.get("locale_id") or track.get("srclang"),
+            extension="vtt" if url and "vtt" in url.rsplit(".", 1)[-1] else "srt",
+            url=url,
+            created=track.get("created"),
+        )
+
+
+class Asset(Record):
+    """
+    A downloadable part of a lecture: the file of a file/e-book/presentation/audio lecture, or a supplementary
+    asset. type is what download_lecture saves it as (None for the ones it doesn't), asset_type and filename
+    are as Udemy gives them.
+    """
+
+    __slots__ = ("id", "type", "asset_type", "title", "filename", "url", "created", "supplementary")
+
+    @classmethod
+    def from_lecture_asset(cls, asset):
+        asset_type = (asset.get("asset_type") or asset.get("assetType") or "").lower()
+        saved_type, url_key = LECTURE_FILE_ASSETS.get(asset_type, (None, None))
+        return cls(
+            id=asset.get("id"),
+            type=saved_type,
+            asset_type=asset_type,
+            filename=asset.get("filename"),
+            url=_download_url(asset.get("download_urls"), url_key) if url_key else None,
+            created=asset.get("created"),
+            supplementary=False,
+        )
+
+    @classmethod
+    def from_supplementary(cls, entry):
+        saved_type, url_key = SUPPLEMENTARY_ASSETS.get((entry.get("asset_type") or "").lower(), (None, None))
+        return cls(
+            id=entry.get("id"),
+            type=saved_type,
+            asset_type=entry.get("asset_type"),
+            title=sanitize_filename(entry.get("title") or ""),
+            filename=entry.get("filename"),
+            url=_download_url(entry.get("download_urls"), url_key) if url_key else entry.get("external_url"),
+            created=entry.get("created"),
+            supplementary=True,
+        )
+
+
+class Lecture(Record):
+    """
+    A lecture or quiz of the curriculum, with what downloading, selecting and syncing it needs and nothing else
+    of its API entry. media is "stream" (stream_urls, no DRM), "drm" (media_sources), "html" (the body is the
+    lecture, articles) or None (no asset: quizzes and practice tests). clazz is the entry's _class.
+    """
+
+    __slots__ = (
+        "id",
+        "index",
+        "lecture_index",
+        "lecture_title",
+        "title",
+        "clazz",
+        "type",
+        "created",
+        "description",
+        "pass_percent",
+        "asset_id",
+        "asset_type",
+        "asset_created",
+        "asset_filename",
+        "duration",
+        "thumbnail_url",
+        "media",
+        "body",
+        "sources",
+        "captions",
+        "assets",
+    )
+
+    @classmethod
+    def from_entry(cls, entry, index, lecture_title):
+        """
+        The record of a curriculum entry; index is the lecture number used in file names
+        """
+        lecture = cls(
+            id=entry.get("id"),
+            index=index,
+            lecture_index=entry.get("object_index"),
+            lecture_title=lecture_title,
+            title=entry.get("title"),
+            clazz=entry.get("_class"),
+            type=entry.get("type"),
+            created=entry.get("created"),
+            description=entry.get("description") if entry.get("_class") == "quiz" else None,
+            pass_percent=entry.get("pass_percent"),
+            sources=[],
+            captions=[],
+            assets=[],
+        )
+        asset = entry.get("asset")
+        if isinstance(asset, dict):
+            lecture.asset_id = asset.get("id")
+            lecture.asset_type = asset.get("asset_type") or asset.get("assetType")
+            lecture.asset_created = asset.get("created")
+            lecture.asset_filename = asset.get("filename")
+            lecture.thumbnail_url = asset.get("thumbnail_url")
+            duration = asset.get("time_estimation") or asset.get("length")
+            lecture.duration = duration if isinstance(duration, (int, float)) and duration > 0 else None
+
+            asset_type = (lecture.asset_type or "").lower()
+            if asset_type in LECTURE_FILE_ASSETS:
+                lecture.assets.append(Asset.from_lecture_asset(asset))
+            elif asset_type == "article":
+                lecture.assets.append(Asset(id=asset.get("id"), type="article", asset_type=asset_type, supplementary=False))
+            elif asset_type != "video":
+                logger.warning(f"Unknown asset type: {asset_type}")
+            for supp_asset in entry.get("supplementary_assets") or []:
+                if isinstance(supp_asset, dict):
+                    lecture.assets.append(Asset.from_supplementary(supp_asset))
+            lecture.captions = [
+                Caption.from_track(track)
+                for track in asset.get("captions") or []
+                if isinstance(track, dict) and track.get("_class") == "caption"
+            ]
+
+            stream_urls = asset.get("stream_urls")
+            media_sources = asset.get("media_sources")
+            if stream_urls and isinstance(stream_urls, dict):
+                lecture.media = "stream"
+                lecture.sources = [
+                    Source(type=source.get("type"), label=source.get("label"), url=source.get("file"))
+                    for source in stream_urls.get("Video") or []
+                    if isinstance(source, dict)
+                ]
+            elif stream_urls is None and media_sources and isinstance(media_sources, list):
+                lecture.media = "drm"
+                lecture.sources = [
+                    Source(type=source.get("type"), url=source.get("src"))
+                    for source in media_sources
+                    if isinstance(source, dict)
+                ]
+            else:
+                lecture.media = "html"
+            if lecture.media == "html" or asset_type == "article":
+                lecture.body = asset.get("body")
+        return lecture
+
+    def download_assets(self):
+        """
+        The assets as download_lecture takes them
+        """
+        assets = []
+        for asset in self.assets:
+            if asset.type == "article":
+                assets.append({"type": "article", "body": self.body, "extension": "html", "id": self.index})
+            elif asset.type and asset.url:
+                item = {
+                    "type": asset.type,
+                    "filename": "{0:03d} ".format(self.index) + (asset.filename or ""),
+                    "extension": "txt" if asset.type == "external_link" else _extension(asset.filename),
+                    "download_url": asset.url,
+                    "id": asset.id,
+                }
+                if asset.supplementary:
+                    item["title"] = asset.title
+                assets.append(item)
+        return assets
+
+    def to_dict(self):
+        data = super().to_dict()
+        for name in ("sources", "captions", "assets"):
+            data[name] = [record.to_dict() for record in data[name] or []]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        if "data" in data:
+            # saved by a version that kept the raw entry
+            return cls.from_entry(data["data"], data.get("index"), data.get("lecture_title"))
+        lecture = super().from_dict(data)
+        lecture.sources = [Source.from_dict(item) for item in lecture.sources or []]
+        lecture.captions = [Caption.from_dict(item) for item in lecture.captions or []]
+        lecture.assets = [Asset.from_dict(item) for item in lecture.assets or []]
+        return lecture
+
+
+class Chapter(Record):
+    __slots__ = ("id", "index", "title", "lectures")
+
+    @property
+    def lecture_count(self):
+        return len(self.lectures)
+
+    def to_dict(self):
+        return {**super().to_dict(), "lectures": [lecture.to_dict() for lecture in self.lectures]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            id=data.get("id", data.get("chapter_id")),
+            index=data.get("index", data.get("chapter_index")),
+            title=data.get("title", data.get("chapter_title")),
+            lectures=[Lecture.from_dict(lecture) for lecture in data.get("lectures") or []],
+        )
+
+
+class CurriculumIndex(object):
+    """
+    Lookups into the chapters of a course, built in one pass: the lectures of a chapter index, the lectures of a
+    lecture number (the one in file names, repeated in every chapter unless numbering is continuous) and the
+    sanitized base file name of every lecture, the one its combined video gets. A course loaded in part passes
+    the file names of the whole course, id_to_title.json is for every lecture.
+    """
+
+    def __init__(self, chapters, file_names=None):
+        self.chapters = chapters
+        self.entries = []
+        # positions in entries
+        self._by_chapter = {}
+        self._by_number = {}
+        self._file_names = {}
+        for chapter in chapters:
+            positions = self._by_chapter.setdefault(int(chapter.index), [])
+            for lecture in chapter.lectures:
+                positions.append(len(self.entries))
+                self._by_number.setdefault(int(lecture.index), []).append(len(self.entries))
+                self.entries.append((chapter, lecture))
+                if file_names is None and lecture.lecture_title:
+                    self._file_names[str(lecture.id)] = sanitize_filename(lecture.lecture_title)
+        if file_names is not None:
+            self._file_names = dict(file_names)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lecture_ids(self):
+        return [lecture.id for _, lecture in self.entries]
+
+    def filtered(self, chapter_filter=None, lecture_filter=None):
+        """
+        (chapter, lecture) in course order, in the chapters and with the numbers of the filters that are set
+        """
+        if chapter_filter is None and lecture_filter is None:
+            return list(self.entries)
+        positions = None
+        if chapter_filter is not None:
+            positions = {p for index in chapter_filter for p in self._by_chapter.get(int(index), [])}
+        if lecture_filter is not None:
+            numbered = {p for number in lecture_filter for p in self._by_number.get(int(number), [])}
+            positions = numbered if positions is None else positions & numbered
+        return [self.entries[p] for p in sorted(positions)]
+
+    def id_to_title(self):
+        """
+        {lecture id: base file name}, saved as id_to_title.json for the GUI to name the combined videos.
+        The names are already sanitized, sanitizing them again (as the GUI does) leaves them unchanged.
+        """
+        return dict(self._file_names)
+
+    def selection_chapters(self):
+        """
+        The chapters and video lectures as the selection window takes them
+        """
+        return [
+            {
+                "id": chapter.index,
+                "title": chapter.title,
+                "videos": [
+                    {
+                        "id": lecture.id,
+                        "title": lecture.lecture_title,
+                        "thumbnail_url": lecture.thumbnail_url,
+                        "file_name": self._file_names.get(str(lecture.id)),
+                    }
+                    for lecture in chapter.lectures
+                    if lecture.clazz == "lecture"
+                ],
+            }
+            for chapter in self.chapters
+        ]
+
+
+def course_index(udemy_object):
+    """
+    The index of a parsed course, built on first use
+    """
+    if udemy_object.get("index") is None:
+        udemy_object["index"] = CurriculumIndex(udemy_object.get("chapters", []))
+    return udemy_object["index"]
+
+
+def load_course(data):
+    """
+    A parsed course from the json --save-to-file wrote before courses were saved per course (saved/_udemy.json),
+    with its chapters as plain dicts or as the raw entries of an older version
+    """
+    chapters = [Chapter.from_dict(chapter) for chapter in data.get("chapters", [])]
+    return {**data, "chapters": chapters, "index": CurriculumIndex(chapters)}
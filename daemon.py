@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+import main as downloader
+from constants import *
+
+logger = logging.getLogger("udemy-downloader.daemon")
+
+DAEMON_DB_PATH = os.path.join(SAVED_DIR, "daemon.sqlite3")
+DAEMON_LOG_DIR = os.path.join(LOG_DIR_PATH, "daemon")
+DEFAULT_PORT = 8765
+# set by the daemon itself, or would block it
+FORBIDDEN_JOB_ARGS = ("bearer_token", "browser", "cookie_file", "log_file", "calibrate_h265", "log_level")
+# files and directories a job reads or writes; any local process can submit jobs, so they have to stay under
+# the daemon's own output and saved directories
+JOB_PATH_ARGS = ("out", "job_manifest", "export_plan", "run_plan", "estimate", "select_rules")
+JOB_PATH_ROOTS = (downloader.DOWNLOAD_DIR, SAVED_DIR)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    course_url TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT,
+    error TEXT,
+    log_path TEXT,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+"""
+
+
+class JobArgumentParser(argparse.ArgumentParser):
+    """
+    main.py's parser, raising ValueError instead of exiting on bad job arguments
+    """
+
+    def error(self, message):
+        raise ValueError(message)
+
+    def exit(self, status=0, message=None):
+        raise ValueError(message or "arguments not accepted")
+
+
+def parse_job_args(course_url, args):
+    """
+    Parses the main.py arguments of a job, raises ValueError for the ones a daemon job can't use
+    """
+    if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+        raise ValueError("args must be a list of strings")
+    parser = downloader.build_arg_parser(JobArgumentParser)
+    parsed = parser.parse_args(["-c", course_url, *args])
+    flags = {action.dest: max(action.option_strings, key=len) for action in parser._actions if action.option_strings}
+    forbidden = [flags.get(name, name) for name in FORBIDDEN_JOB_ARGS if getattr(parsed, name, None)]
+    if forbidden:
+        raise ValueError(f"not accepted in a daemon job: {', '.join(forbidden)}")
+    outside = [
+        flags.get(name, name)
+        for name in JOB_PATH_ARGS
+        if getattr(parsed, name, None) and not is_under(getattr(parsed, name), JOB_PATH_ROOTS)
+    ]
+    if outside:
+        raise ValueError(
+            f"paths outside {' and '.join(JOB_PATH_ROOTS)} not accepted in a daemon job: {', '.join(outside)}"
+        )
+    return parser, parsed
+
+
+def is_under(path, roots):
+    """
+    True if path, with links resolved, is one of roots or inside one
+    """
+    path = os.path.realpath(path)
+    for root in roots:
+        root = os.path.realpath(root)
+        try:
+            if os.path.commonpath([path, root]) == root:
+                return True
+        except ValueError:
+            # another drive
+            continue
+    return False
+
+
+class JobQueue(object):
+    """
+    Persistent queue of daemon jobs (SQLite), so queued and interrupted jobs survive a restart
+    """
+
+    def __init__(self, path=DAEMON_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def _row(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["args"] = json.loads(job["args"])
+        job["progress"] = json.loads(job["progress"]) if job["progress"] else {}
+        return job
+
+    def submit(self, course_url, args):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (course_url, args, status, submitted_at) VALUES (?, ?, 'queued', ?)",
+                (course_url, json.dumps(args), time.time()),
+            )
+        return self.get(cursor.lastrowid)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._row(self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, status=None, limit=100):
+        query = "SELECT * FROM jobs"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+        return [self._row(row) for row in rows]
+
+    def claim_next(self):
+        """
+        Marks the oldest queued job as running and returns it, None if the queue is empty
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, error = NULL WHERE id = ?", (time.time(), row["id"])
+            )
+        return self.get(row["id"])
+
+    def update(self, job_id, **fields):
+        if "progress" in fields:
+            fields["progress"] = json.dumps(fields["progress"])
+        if fields.get("status") in ("done", "failed", "cancelled"):
+            fields["finished_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+
+    def cancel_queued(self, job_id):
+        """
+        Cancels a job that hasn't started, returns False if it isn't queued
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+        return cursor.rowcount > 0
+
+    def recover(self):
+        """
+        Queues again the jobs that were running when the daemon stopped; they resume from the course's job store
+        """
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class Daemon(object):
+    """
+    Runs queued jobs one at a time in this process, keeping the authenticated session and the transcode pool
+    between them. One at a time because main.py keeps the options and state of a course in module globals.
+    """
+
+    def __init__(self, queue, bearer_token=None, browser=None, cookie_file=None):
+        self.queue = queue
+        self.bearer_token = bearer_token
+        self.browser = browser
+        self.cookie_file = cookie_file
+        self.udemy = None
+        self._auth_header = None
+        self.current_job = None
+        self.cancel_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self._thread = None
+
+    def session(self):
+        """
+        The warm Udemy object, authenticated again when a job terminated its session
+        """
+        if self.udemy is not None and self.udemy.session._headers.get("Authorization") == self._auth_header:
+            return self.udemy
+        downloader.browser = self.browser
+        downloader.cookie_file = self.cookie_file
+        logger.info("> Authenticating...")
+        self.udemy = downloader.Udemy(self.bearer_token)
+        self._auth_header = self.udemy.session._headers.get("Authorization")
+        return self.udemy
+
+    def start(self):
+        recovered = self.queue.recover()
+        if recovered:
+            logger.info(f"> Resuming {recovered} job(s) interrupted by the last shutdown")
+        self._thread = threading.Thread(target=self._work, name="daemon-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.cancel_event.set()
+        self.wake_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def submit(self, course_url, args):
+        parse_job_args(course_url, args)
+        job = self.queue.submit(course_url, args)
+        logger.info(f"> Job {job['id']} queued: {course_url}")
+        self.wake_event.set()
+        return job
+
+    def cancel(self, job_id):
+        if self.queue.cancel_queued(job_id):
+            return True
+        if self.current_job == job_id:
+            self.cancel_event.set()
+            return True
+        return False
+
+    def job_details(self, job_id):
+        job = self.queue.get(job_id)
+        store = downloader.job_store
+        if job and job["id"] == self.current_job and store:
+            try:
+                job["items"] = store.summary()
+            except sqlite3.ProgrammingError:
+                # closed by the job finishing meanwhile
+                pass
+        return job
+
+    def _work(self):
+        while not self.stop_event.is_set():
+            job = self.queue.claim_next()
+            if job is None:
+                self.wake_event.wait(5)
+                self.wake_event.clear()
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        job_id = job["id"]
+        log_path = os.path.join(DAEMON_LOG_DIR, f"job-{job_id}.log")
+        handler = logging.FileHandler(log_path)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+        logging.getLogger("udemy-downloader").addHandler(handler)
+        progress = {"total_lectures": None, "current_lecture": None, "lectures_started": 0, "lectures_ready": 0}
+
+        def on_progress(event, *values):
+            if event == "TOTAL_LECTURES":
+                progress["total_lectures"] = int(values[0])
+            elif event == "COMPLETED_LECTURE":
+                progress["current_lecture"] = int(values[0])
+                progress["lectures_started"] += 1
+            elif event == "LECTURE_READY":
+                progress["lectures_ready"] += 1
+            self.queue.update(job_id, progress=progress)
+
+        self.current_job = job_id
+        self.cancel_event.clear()
+        self.queue.update(job_id, log_path=log_path, progress=progress)
+        logger.info(f"> Job {job_id} started: {job['course_url']}")
+        status, error = "done", None
+        try:
+            parser, args = parse_job_args(job["course_url"], job["args"])
+            downloader.apply_args(args, parser)
+            if not (downloader.sync_mode or downloader.selection_rules):
+                # nobody is there to pick lectures in a window
+                downloader.select_all = True
+            downloader.cancel_event = self.cancel_event
+            downloader.progress_listener = on_progress
+            self.udemy = downloader.main(self.session(), keep_warm=True)
+        except downloader.DownloadCancelled:
+            status, error = "cancelled", None
+        except SystemExit as e:
+            status, error = "failed", f"exited with code {e.code}"
+        except Exception as e:
+            logger.exception(f"> Job {job_id} failed")
+            status, error = "failed", str(e)
+        finally:
+            # a failed job doesn't get to finish_run, its store would stay open for good
+            downloader.close_job_store()
+            downloader.cancel_event = None
+            downloader.progress_listener = None
+            logging.getLogger("udemy-downloader").removeHandler(handler)
+            handler.close()
+            self.current_job = None
+        if self.stop_event.is_set() and status != "done":
+            # stopped by a shutdown, not by a user
+            status, error = "queued", None
+        elif status == "done" and self.cancel_event.is_set():
+            status = "cancelled"
+        self.queue.update(job_id, status=status, error=error)
+        logger.info(f"> Job {job_id} {status}" + (f": {error}" if error else ""))
+
+
+JOB_PATH_RE = re.compile(r"^/jobs/(\d+)/?$")
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs {"course_url": ..., "args": [...]}, GET /jobs, GET /jobs/<id>, DELETE /jobs/<id>, GET /health
+    """
+
+    daemon: Daemon = None
+    api_token = None
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if self.api_token and self.headers.get("Authorization") != f"Bearer {self.api_token}":
+            self.send_json(401, {"error": "unauthorized"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path.rstrip("/") == "/health":
+            self.send_json(200, {"ok": True, "running": self.daemon.current_job, "jobs": self.daemon.queue.counts()})
+            return
+        if self.path.split("?", 1)[0].rstrip("/") == "/jobs":
+            self.send_json(200, self.daemon.queue.list())
+            return
+        match = JOB_PATH_RE.match(self.path)
+        job = self.daemon.job_details(int(match.group(1))) if match else None
+        if job is None:
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, job)
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if self.path.rstrip("/") != "/jobs":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            data = json.loads(self.rfile.read(length) or b"{}")
+            course_url = data.get("course_url")
+            if not course_url or not isinstance(course_url, str):
+                raise ValueError("course_url is required")
+            job = self.daemon.submit(course_url, data.get("args") or [])
+        except (ValueError, AttributeError) as error:
+            self.send_json(400, {"error": str(error)})
+            return
+        self.send_json(201, job)
+
+    def do_DELETE(self):
+        if not self.authorized():
+            return
+        match = JOB_PATH_RE.match(self.path)
+        if not match or self.daemon.queue.get(int(match.group(1))) is None:
+            self.send_json(404, {"error": "not found"})
+            return
+        job_id = int(match.group(1))
+        if not self.daemon.cancel(job_id):
+            self.send_json(409, {"error": "job already finished"})
+            return
+        self.send_json(202, self.daemon.job_details(job_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Udemy Downloader daemon: a job queue behind a loopback HTTP API")
+    parser.add_argument("--port", dest="port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (Default is {DEFAULT_PORT})")
+    parser.add_argument("--api-token", dest="api_token", type=str, help="Require 'Authorization: Bearer <token>' on every request")
+    parser.add_argument("-b", "--bearer", dest="bearer_token", type=str, help="The Bearer token to use")
+    parser.add_argument(
+        "--browser",
+        dest="browser",
+        help="The browser to extract cookies from",
+        choices=["chrome", "firefox", "opera", "edge", "brave", "chromium", "vivaldi", "safari", "file"],
+    )
+    parser.add_argument("--cookies", dest="cookie_file", type=str, help="Netscape cookies file to use with '--browser file'")
+    parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", help="Logging level (Default is INFO)")
+    args = parser.parse_args()
+
+    os.makedirs(DAEMON_LOG_DIR, exist_ok=True)
+    os.makedirs(SAVED_DIR, exist_ok=True)
+    downloader.LOG_LEVEL = getattr(logging, args.log_level.upper(), logging.INFO)
+    downloader.setup_logging(os.path.join(DAEMON_LOG_DIR, "daemon.log"))
+
+    load_dotenv()
+    daemon = Daemon(
+        JobQueue(),
+        bearer_token=args.bearer_token or os.getenv("UDEMY_BEARER"),
+        browser=args.browser,
+        cookie_file=os.path.abspath(args.cookie_file) if args.cookie_file else None,
+    )
+    # authenticate up front, a bad token should fail here and not in the first job
+    daemon.session()
+    daemon.start()
+
+    ApiHandler.daemon = daemon
+    ApiHandler.api_token = args.api_token
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), ApiHandler)
+    logger.info(f"> Listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("> Shutting down, the running job will resume on the next start...")
+    finally:
+        server.server_close()
+        daemon.stop()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
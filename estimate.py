@@ -0,0 +1,245 @@
+import csv
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import m3u8
+import requests
+
+from jobstore import JobStore
+
+HEAD_TIMEOUT = 15
+# used until this host has downloaded enough to measure its own throughput
+DEFAULT_THROUGHPUT = 5 * 1024 * 1024
+MIN_THROUGHPUT_SAMPLE = 50 * 1024 * 1024
+# assets main.py downloads as files, the others are written from the curriculum
+FILE_ASSET_TYPES = ("audio", "e-book", "ebook", "file", "presentation", "source_code")
+CSV_FIELDS = (
+    "chapter",
+    "lectures",
+    "on_disk",
+    "unknown_size",
+    "media_bytes",
+    "caption_bytes",
+    "asset_bytes",
+    "total_bytes",
+    "estimated_seconds",
+)
+ISO_DURATION_RE = re.compile(r"^P(?:(?P<d>[\d.]+)D)?(?:T(?:(?P<h>[\d.]+)H)?(?:(?P<m>[\d.]+)M)?(?:(?P<s>[\d.]+)S)?)?$")
+
+
+def local_path(url):
+    return url2pathname(urlparse(url).path)
+
+
+def iso_duration(text):
+    """
+    "PT1H2M3.5S" -> 3723.5, None for anything else
+    """
+    match = ISO_DURATION_RE.match((text or "").strip())
+    if not match:
+        return None
+    parts = {key: float(value) for key, value in match.groupdict().items() if value}
+    return parts.get("d", 0) * 86400 + parts.get("h", 0) * 3600 + parts.get("m", 0) * 60 + parts.get("s", 0)
+
+
+def content_length(url):
+    """
+    Size of a download from a HEAD request, None when the server doesn't say
+    """
+    try:
+        r = requests.head(url, allow_redirects=True, timeout=HEAD_TIMEOUT)
+        r.raise_for_status()
+        size = int(r.headers.get("Content-Length", ""))
+    except (requests.RequestException, ValueError):
+        return None
+    return size if size > 0 else None
+
+
+def playlist_duration(url):
+    """
+    Duration of an HLS media playlist saved by _extract_m3u8, None if it can't be read
+    """
+    try:
+        with open(local_path(url), "r", encoding="utf-8") as f:
+            playlist = m3u8.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    duration = sum(segment.duration or 0.0 for segment in playlist.segments)
+    return duration or None
+
+
+def mpd_estimate(url, format_id, duration=None):
+    """
+    (bytes, duration) of the selected representations of an MPD saved by _extract_mpd, from their bitrates.
+    Without a match for format_id ("video_id,audio_id") the best video and audio representations are used.
+    """
+    try:
+        root = ET.parse(local_path(url)).getroot()
+    except (OSError, ET.ParseError):
+        return None, duration
+    duration = iso_duration(root.get("mediaPresentationDuration")) or duration
+
+    bitrates = {}
+    best = {}
+    for adaptation in root.iter():
+        if not adaptation.tag.endswith("AdaptationSet"):
+            continue
+        for representation in adaptation:
+            if not representation.tag.endswith("Representation") or not representation.get("bandwidth"):
+                continue
+            bandwidth = int(representation.get("bandwidth"))
+            bitrates[representation.get("id")] = bandwidth
+            mime_type = representation.get("mimeType") or adaptation.get("mimeType") or adaptation.get("contentType") or ""
+            kind = "audio" if "audio" in mime_type else "video"
+            best[kind] = max(best.get(kind, 0), bandwidth)
+
+    wanted = [part.split("dash-", 1)[-1] for part in (format_id or "").split(",") if part]
+    if wanted and all(part in bitrates for part in wanted):
+        bandwidth = sum(bitrates[part] for part in wanted)
+    else:
+        bandwidth = sum(best.values())
+    if not bandwidth or not duration:
+        return None, duration
+    return int(bandwidth * duration / 8), duration
+
+
+def pick_source(sources, quality=None):
+    """
+    The rendition main.py downloads: the highest, or the one closest to the requested height
+    """
+    sources = [source for source in sources or [] if str(source.get("height") or "").isdigit()]
+    if not sources:
+        return None
+    if isinstance(quality, int):
+        return min(sources, key=lambda x: abs(int(x.get("height")) - quality))
+    return max(sources, key=lambda x: int(x.get("height")))
+
+
+def estimate_media(source, duration=None):
+    """
+    (bytes, method) of a rendition: HLS bandwidth x playlist duration, MPD bitrates x duration,
+    or the Content-Length of a plain file
+    """
+    source_type = source.get("type")
+    if source_type == "hls":
+        duration = playlist_duration(source.get("download_url")) or duration
+        if source.get("bandwidth") and duration:
+            return int(source["bandwidth"] * duration / 8), "hls_bandwidth"
+        return None, "unknown"
+    if source_type == "dash":
+        size, _ = mpd_estimate(source.get("download_url"), source.get("format_id"), duration)
+        return size, "mpd_bitrate" if size else "unknown"
+    size = content_length(source.get("download_url"))
+    return size, "content_length" if size else "unknown"
+
+
+def estimate_lecture(lecture, duration=None, quality=None, captions=None, assets=False):
+    """
+    Estimate of a parsed lecture: the media that would be downloaded, the captions in `captions`
+    (a language, "all", or None for none) and, with assets, its downloadable assets
+    """
+    estimate = {"type": lecture.get("type"), "rendition": None, "method": None, "media_bytes": None}
+    if lecture.get("extension") == "html":
+        estimate.update(method="html", media_bytes=len((lecture.get("html_content") or "").encode("utf8")))
+    else:
+        source = pick_source(lecture.get("video_sources") if lecture.get("is_encrypted") else lecture.get("sources"), quality)
+        if source:
+            estimate["rendition"] = f"{source.get('type')} {source.get('height')}p"
+            estimate["media_bytes"], estimate["method"] = estimate_media(source, duration)
+        elif lecture.get("sources") is not None or lecture.get("video_sources") is not None:
+            estimate["method"] = "unknown"
+
+    caption_bytes = 0
+    if captions and lecture.get("extension") is None:
+        for caption in lecture.get("subtitles") or []:
+            if captions == "all" or caption.get("language") == captions:
+                caption_bytes += content_length(caption.get("download_url")) or 0
+    asset_bytes = 0
+    if assets:
+        for asset in lecture.get("assets") or []:
+            if asset.get("type") == "article":
+                asset_bytes += len((asset.get("body") or "").encode("utf8"))
+            elif asset.get("type") in FILE_ASSET_TYPES:
+                asset_bytes += content_length(asset.get("download_url")) or 0
+    estimate.update(caption_bytes=caption_bytes, asset_bytes=asset_bytes)
+    return estimate
+
+
+def measured_throughput(download_dir):
+    """
+    (bytes per second, bytes measured) of this host's downloads, from the job stores of the courses in
+    download_dir. None when they haven't recorded MIN_THROUGHPUT_SAMPLE bytes yet.
+    """
+    total_bytes = total_seconds = 0
+    try:
+        course_dirs = [entry.path for entry in os.scandir(download_dir) if entry.is_dir()]
+    except OSError:
+        return None
+    for course_dir in course_dirs:
+        store = JobStore.for_course(course_dir, create=False)
+        if not store:
+            continue
+        try:
+            size, seconds = store.throughput()
+        finally:
+            store.close()
+        total_bytes += size
+        total_seconds += seconds
+    if total_bytes < MIN_THROUGHPUT_SAMPLE or total_seconds <= 0:
+        return None
+    return total_bytes / total_seconds, total_bytes
+
+
+def build_report(course, entries, throughput, measured, free_bytes):
+    """
+    Totals per chapter and for the course of the lecture estimates (in course order). Lectures already on disk
+    aren't estimated; lectures whose size couldn't be told count as unknown_size.
+    """
+    chapters = {}
+    for entry in entries:
+        chapter = chapters.setdefault(
+            entry["chapter"], {"chapter": entry["chapter"], **{field: 0 for field in CSV_FIELDS[1:]}}
+        )
+        chapter["lectures"] += 1
+        if entry.get("on_disk"):
+            chapter["on_disk"] += 1
+            continue
+        if entry.get("media_bytes") is None and entry.get("method") is not None:
+            chapter["unknown_size"] += 1
+        for field in ("media_bytes", "caption_bytes", "asset_bytes"):
+            chapter[field] += entry.get(field) or 0
+    for chapter in chapters.values():
+        chapter["total_bytes"] = chapter["media_bytes"] + chapter["caption_bytes"] + chapter["asset_bytes"]
+        chapter["estimated_seconds"] = round(chapter["total_bytes"] / throughput)
+
+    totals = {"chapter": "TOTAL", **{field: sum(c[field] for c in chapters.values()) for field in CSV_FIELDS[1:]}}
+    return {
+        "course": course,
+        "throughput": {"bytes_per_second": round(throughput), "measured": measured is not None, "sample_bytes": measured},
+        "disk": {"free_bytes": free_bytes, "needed_bytes": totals["total_bytes"], "fits": totals["total_bytes"] < free_bytes},
+        "totals": totals,
+        "chapters": list(chapters.values()),
+        "lectures": entries,
+    }
+
+
+def write_report(path, report):
+    """
+    Writes a report as CSV (one row per chapter and a TOTAL row) when path ends in .csv, JSON otherwise
+    """
+    tmp_path = path + ".tmp"
+    if path.lower().endswith(".csv"):
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(report["chapters"])
+            writer.writerow(report["totals"])
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
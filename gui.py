@@ -88,7 +88,8 @@ def show_video_selection_window(chapters, course_out_dir="", id_to_title_map={})
             if course_out_dir and id_to_title_map:
                 chapter_directory_name = sanitize_filename(chapter.get('title', ''))
                 
-                lecture_title_from_map = id_to_title_map.get(str(vid_id))
+                # the curriculum index names the file already, older callers only pass the map
+                lecture_title_from_map = video.get('file_name') or id_to_title_map.get(str(vid_id))
                 
                 if lecture_title_from_map:
                     sanitized_video_filename = sanitize_filename(lecture_title_from_map) + ".mp4"
@@ -156,10 +157,26 @@ import subprocess
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog, ttk
 import json
+import queue
 import re
 import shutil
+import sqlite3
 from pathvalidate import sanitize_filename
 import os
+import time
+from jobstore import JobStore
+from manifest import ManifestReader, read_manifest
+from runner import run_with_retries
+
+# Bounded queues between the download and post-processing stages in pipelined mode.
+# When post-processing falls behind, the queues fill up and the downloader blocks on its output.
+POSTPROCESS_QUEUE_SIZE = 4
+OUTPUT_QUEUE_SIZE = 256
+# <lecture title>_<lang>.srt, e.g. "001 Intro_en.srt" or "001 Intro_en_US.srt"
+CAPTION_LANG_RE = re.compile(r'(_[a-z]{2,3}(?:_[A-Z]{2,3})?)\.srt$')
+# ffmpeg runs whose output file stops growing for this many seconds are killed and restarted
+STALL_TIMEOUT = 300
+STALL_RETRIES = 2
 
 
 class UdemyDownloaderGUI:
@@ -168,6 +185,9 @@ class UdemyDownloaderGUI:
         self.root.title("Udemy Course Downloader & Combiner - CopyRight : Eng. Mohamed Gomaa")
         self.config_path = "config.json"
         self.ffmpeg_processes = []
+        self.caption_index = {}
+        self.job_stores = {}
+        self.postprocessed = set()
         self.create_widgets()
         self.ffmpeg_path = "ffmpeg"  # Assume ffmpeg is in PATH
         self.load_config()
@@ -380,6 +400,8 @@ class UdemyDownloaderGUI:
         self.save_to_file = tk.BooleanVar()
         self.load_from_file = tk.BooleanVar()
         self.continue_lecture_numbers = tk.BooleanVar()
+        self.single_pass_decrypt = tk.BooleanVar()
+        self.pipelined = tk.BooleanVar()
 
         flag_row = 0
         tk.Checkbutton(flags_frame, text="Use H265", variable=self.use_h265, **check_style).grid(row=flag_row, column=0, sticky="w", padx=4, pady=2)
@@ -399,6 +421,8 @@ class UdemyDownloaderGUI:
         flag_row += 1
         tk.Checkbutton(flags_frame, text="Load from File", variable=self.load_from_file, **check_style).grid(row=flag_row, column=0, sticky="w", padx=4, pady=2)
         tk.Checkbutton(flags_frame, text="Continue Lecture Numbers", variable=self.continue_lecture_numbers, **check_style).grid(row=flag_row, column=1, sticky="w", padx=4, pady=2)
+        tk.Checkbutton(flags_frame, text="Single-Pass Decrypt", variable=self.single_pass_decrypt, **check_style).grid(row=flag_row, column=2, sticky="w", padx=4, pady=2)
+        tk.Checkbutton(flags_frame, text="Pipelined Processing", variable=self.pipelined, **check_style).grid(row=flag_row, column=3, sticky="w", padx=4, pady=2)
 
         # Separator
         sep2 = tk.Frame(self.root, height=2, bd=0, bg=accent2)
@@ -552,6 +576,13 @@ class UdemyDownloaderGUI:
         self.completed_lectures = 0
 
     def _run_full_process(self):
+        try:
+            self._download_and_process()
+        finally:
+            # a later run opens them again, and finds the stores of courses that had none yet
+            self.close_job_stores()
+
+    def _download_and_process(self):
         self.save_config()
         course_url = self.course_url_entry.get().strip()
         token = self.token_entry.get().strip()
@@ -565,7 +596,7 @@ class UdemyDownloaderGUI:
         browser = self.browser_entry.get().strip()
         h265_crf = self.h265_crf_entry.get().strip()
         h265_preset = self.h265_preset_entry.get().strip()
-        import threading, queue
+        import threading
         self.save_config()
         course_url = self.course_url_entry.get().strip()
         token = self.token_entry.get().strip()
@@ -610,124 +641,196 @@ class UdemyDownloaderGUI:
             chapters = [None]  # Download all if not specified
 
         search_base = out_dir if out_dir else os.path.join(os.getcwd(), "out_dir")
+        # every chapter run writes a manifest of what it produced, post-processing works from those
+        manifest_dir = os.path.join(os.getcwd(), "saved", "manifests")
+        run_id = time.strftime('%Y-%m-%d-%I-%M-%S')
+        run_manifest = []
+
+        postprocess_queue = None
+        # (chapter dir, lecture id) the pipelined worker finished, the final pass leaves them alone
+        self.postprocessed = set()
+        if self.pipelined.get():
+            postprocess_queue = queue.Queue(maxsize=POSTPROCESS_QUEUE_SIZE)
+            postprocess_thread = threading.Thread(target=self.postprocess_worker, args=(decryption_key, postprocess_queue), daemon=True)
+            postprocess_thread.start()
+            self.log("Pipelined mode: lectures will be post-processed while downloads continue.")
 
-        for chap in chapters:
-            if self.stop_event.is_set():
-                self.log("Stopped before chapter download.")
-                return
-            self.log(f"Starting download for chapter: {chap if chap else 'ALL'}...")
-            download_cmd = [sys.executable, "main.py", "--course-url", course_url, "--bearer", token]
-            if chap:
-                download_cmd += ["--chapter", str(chap)]
-            if lecture:
-                download_cmd += ["--lecture", lecture]
-            if quality:
-                download_cmd += ["--quality", quality]
-            # Only add --download-captions and -l <lang> if Download Captions is checked
-            if self.download_captions.get():
-                download_cmd.append("--download-captions")
-                if lang:
-                    download_cmd += ["-l", lang]
-            if concurrent:
-                download_cmd += ["--concurrent-downloads", concurrent]
-            if out_dir:
-                download_cmd += ["--out", out_dir]
-            if loglevel:
-                download_cmd += ["--log-level", loglevel]
-            if browser:
-                download_cmd += ["--browser", browser]
-            if self.use_h265.get():
-                download_cmd.append("--use-h265")
-            if self.use_nvenc.get():
-                download_cmd.append("--use-nvenc")
-            if self.download_captions.get():
-                download_cmd.append("--download-captions")
-            if self.download_assets.get():
-                download_cmd.append("--download-assets")
-            if self.download_quizzes.get():
-                download_cmd.append("--download-quizzes")
-            if self.keep_vtt.get():
-                download_cmd.append("--keep-vtt")
-            if self.skip_lectures.get():
-                download_cmd.append("--skip-lectures")
-            if self.skip_hls.get():
-                download_cmd.append("--skip-hls")
-            if self.info.get():
-                download_cmd.append("--info")
-            if self.id_as_course_name.get():
-                download_cmd.append("--id-as-course-name")
-            if self.subscription_course.get():
-                download_cmd.append("--subscription-course")
-            if self.save_to_file.get():
-                download_cmd.append("--save-to-file")
-            if self.load_from_file.get():
-                download_cmd.append("--load-from-file")
-            if self.continue_lecture_numbers.get():
-                download_cmd.append("--continue-lecture-numbers")
-            if h265_crf:
-                download_cmd += ["--h265-crf", h265_crf]
-            if h265_preset:
-                download_cmd += ["--h265-preset", h265_preset]
-
-            self.log(f"Running: {' '.join(download_cmd)}")
-            try:
-                proc = subprocess.Popen(download_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                def enqueue_output(pipe, q, label):
-                    for line in iter(pipe.readline, ''):
-                        q.put((label, line))
-                    pipe.close()
-
-                q = queue.Queue()
-                t_out = threading.Thread(target=enqueue_output, args=(proc.stdout, q, 'STDOUT'))
-                t_err = threading.Thread(target=enqueue_output, args=(proc.stderr, q, 'STDERR'))
-                t_out.start()
-                t_err.start()
-
-                while True:
-                    if self.stop_event.is_set():
-                        proc.terminate()
-                        self.log("Process terminated by user.")
-                        break
-                    try:
-                        label, line = q.get(timeout=0.1)
-                        if line:
-                            self.log(line.strip())
-                    except queue.Empty:
-                        if proc.poll() is not None:
+        try:
+            for chap in chapters:
+                if self.stop_event.is_set():
+                    self.log("Stopped before chapter download.")
+                    return
+                self.log(f"Starting download for chapter: {chap if chap else 'ALL'}...")
+                download_cmd = [sys.executable, "main.py", "--course-url", course_url, "--bearer", token]
+                if chap:
+                    download_cmd += ["--chapter", str(chap)]
+                if lecture:
+                    download_cmd += ["--lecture", lecture]
+                if quality:
+                    download_cmd += ["--quality", quality]
+                # Only add --download-captions and -l <lang> if Download Captions is checked
+                if self.download_captions.get():
+                    download_cmd.append("--download-captions")
+                    if lang:
+                        download_cmd += ["-l", lang]
+                if concurrent:
+                    download_cmd += ["--concurrent-downloads", concurrent]
+                if out_dir:
+                    download_cmd += ["--out", out_dir]
+                if loglevel:
+                    download_cmd += ["--log-level", loglevel]
+                if browser:
+                    download_cmd += ["--browser", browser]
+                if self.use_h265.get():
+                    download_cmd.append("--use-h265")
+                if self.use_nvenc.get():
+                    download_cmd.append("--use-nvenc")
+                if self.download_captions.get():
+                    download_cmd.append("--download-captions")
+                if self.download_assets.get():
+                    download_cmd.append("--download-assets")
+                if self.download_quizzes.get():
+                    download_cmd.append("--download-quizzes")
+                if self.keep_vtt.get():
+                    download_cmd.append("--keep-vtt")
+                if self.skip_lectures.get():
+                    download_cmd.append("--skip-lectures")
+                if self.skip_hls.get():
+                    download_cmd.append("--skip-hls")
+                if self.info.get():
+                    download_cmd.append("--info")
+                if self.id_as_course_name.get():
+                    download_cmd.append("--id-as-course-name")
+                if self.subscription_course.get():
+                    download_cmd.append("--subscription-course")
+                if self.save_to_file.get():
+                    download_cmd.append("--save-to-file")
+                if self.load_from_file.get():
+                    download_cmd.append("--load-from-file")
+                if self.continue_lecture_numbers.get():
+                    download_cmd.append("--continue-lecture-numbers")
+                if h265_crf:
+                    download_cmd += ["--h265-crf", h265_crf]
+                if h265_preset:
+                    download_cmd += ["--h265-preset", h265_preset]
+                manifest_path = os.path.join(manifest_dir, f"{run_id}-chapter-{chap if chap else 'all'}.jsonl")
+                download_cmd += ["--job-manifest", manifest_path]
+
+                self.log(f"Running: {' '.join(download_cmd)}")
+                try:
+                    proc = subprocess.Popen(download_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                    def enqueue_output(pipe, q, label):
+                        for line in iter(pipe.readline, ''):
+                            q.put((label, line))
+                        pipe.close()
+
+                    q = queue.Queue(maxsize=OUTPUT_QUEUE_SIZE if postprocess_queue is not None else 0)
+                    t_out = threading.Thread(target=enqueue_output, args=(proc.stdout, q, 'STDOUT'))
+                    t_err = threading.Thread(target=enqueue_output, args=(proc.stderr, q, 'STDERR'))
+                    t_out.start()
+                    t_err.start()
+
+                    while True:
+                        if self.stop_event.is_set():
+                            proc.terminate()
+                            self.log("Process terminated by user.")
                             break
-                t_out.join()
-                t_err.join()
-                if proc.returncode != 0:
-                    self.log(f"Process exited with errors for chapter {chap}.")
-                    messagebox.showerror("Download Error", f"Download failed for chapter {chap}. See log.")
+                        try:
+                            label, line = q.get(timeout=0.1)
+                            self.handle_output_line(line, postprocess_queue, manifest_path)
+                        except queue.Empty:
+                            if proc.poll() is not None:
+                                break
+                    while t_out.is_alive() or t_err.is_alive():
+                        # Keep draining so the reader threads can't block on a full queue
+                        try:
+                            label, line = q.get(timeout=0.1)
+                            self.handle_output_line(line, postprocess_queue, manifest_path)
+                        except queue.Empty:
+                            pass
+                    t_out.join()
+                    t_err.join()
+                    # the last lines (a chapter's last LECTURE_READY, the final errors) may still be queued
+                    while not q.empty():
+                        label, line = q.get_nowait()
+                        self.handle_output_line(line, postprocess_queue, manifest_path)
+                    if proc.returncode != 0:
+                        self.log(f"Process exited with errors for chapter {chap}.")
+                        messagebox.showerror("Download Error", f"Download failed for chapter {chap}. See log.")
+                        return
+                except Exception as e:
+                    self.log(f"Error running download for chapter {chap}: {e}")
                     return
-            except Exception as e:
-                self.log(f"Error running download for chapter {chap}: {e}")
-                return
 
-            # Step 2: Decrypt
-            if self.stop_event.is_set():
-                self.log("Stopped before decryption.")
-                return
-            self.log(f"Starting decryption for chapter {chap if chap else 'ALL'}...")
-            self.decrypt_files(decryption_key, search_base)
+                manifest = read_manifest(manifest_path)
+                run_manifest.extend(manifest)
 
-            # Step 3: Combine
-            if self.stop_event.is_set():
-                self.log("Stopped before combining.")
-                return
-            self.log(f"Combining audio and video for chapter {chap if chap else 'ALL'}...")
-            self.combine_files(search_base)
+                if postprocess_queue is not None:
+                    # Lectures of this chapter are already being post-processed by the worker
+                    continue
 
-            # Step 4: Clean up temp folders
-            if self.stop_event.is_set():
-                self.log("Stopped before final cleanup.")
-                return
-            self.log(f"Cleaning up temporary directories for chapter {chap if chap else 'ALL'}...")
-            self.cleanup_temp_folders(search_base)
+                if self.single_pass_decrypt.get():
+                    # Step 2+3: Decrypt both tracks and mux them in one ffmpeg pass
+                    if self.stop_event.is_set():
+                        self.log("Stopped before decryption.")
+                        return
+                    self.log(f"Decrypting and combining for chapter {chap if chap else 'ALL'}...")
+                    self.decrypt_and_combine_files(decryption_key, manifest)
+                else:
+                    # Step 2: Decrypt
+                    if self.stop_event.is_set():
+                        self.log("Stopped before decryption.")
+                        return
+                    self.log(f"Starting decryption for chapter {chap if chap else 'ALL'}...")
+                    self.decrypt_files(decryption_key, manifest)
+
+                    # Step 3: Combine
+                    if self.stop_event.is_set():
+                        self.log("Stopped before combining.")
+                        return
+                    self.log(f"Combining audio and video for chapter {chap if chap else 'ALL'}...")
+                    self.combine_files(manifest)
+
+                # Step 4: Clean up temp folders
+                if self.stop_event.is_set():
+                    self.log("Stopped before final cleanup.")
+                    return
+                self.log(f"Cleaning up temporary directories for chapter {chap if chap else 'ALL'}...")
+                self.cleanup_temp_folders(manifest, search_base)
+
+        finally:
+            if postprocess_queue is not None:
+                # the queue is bounded: waits for room only while the worker is there to make it. A worker busy
+                # with a hung ffmpeg gets it back from the stall watchdog.
+                while postprocess_thread.is_alive():
+                    try:
+                        postprocess_queue.put(None, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+                else:
+                    self.log("The post-processing worker had stopped, remaining lectures are processed below.")
+                postprocess_thread.join()
+
+        if postprocess_queue is not None and not self.stop_event.is_set():
+            # Pick up anything the worker didn't see or couldn't finish; the parts of the lectures it combined
+            # are gone, running those again would only log them as missing
+            remaining = [
+                record
+                for record in run_manifest
+                if record.get("kind") != "encrypted_track"
+                or (os.path.dirname(record["path"]), str(record.get("lecture_id"))) not in self.postprocessed
+            ]
+            if self.manifest_lectures(remaining):
+                self.log("Post-processing any remaining lectures...")
+                if self.single_pass_decrypt.get():
+                    self.decrypt_and_combine_files(decryption_key, remaining)
+                else:
+                    self.decrypt_files(decryption_key, remaining)
+                    self.combine_files(remaining)
 
         self.log("All chapters processed.")
-        self.cleanup_temp_folders(search_base)
+        self.cleanup_temp_folders(run_manifest, search_base)
         
         self.log("All steps completed.")
     def save_config(self):
@@ -761,6 +864,8 @@ class UdemyDownloaderGUI:
             "save_to_file": self.save_to_file.get(),
             "load_from_file": self.load_from_file.get(),
             "continue_lecture_numbers": self.continue_lecture_numbers.get(),
+            "single_pass_decrypt": self.single_pass_decrypt.get(),
+            "pipelined": self.pipelined.get(),
         }
         try:
             with open(self.config_path, "w") as f:
@@ -803,148 +908,370 @@ class UdemyDownloaderGUI:
             self.save_to_file.set(config.get("save_to_file", False))
             self.load_from_file.set(config.get("load_from_file", False))
             self.continue_lecture_numbers.set(config.get("continue_lecture_numbers", False))
+            self.single_pass_decrypt.set(config.get("single_pass_decrypt", False))
+            self.pipelined.set(config.get("pipelined", False))
         except Exception as e:
             self.log(f"Error loading config: {e}")
         # Do NOT auto-run process on config load
 
-    def decrypt_files(self, decryption_key, search_dir):
-        # Find all encrypted files and decrypt with correct output naming
-        self.log(f"Starting decryption in directory: {search_dir}")
-        for root, dirs, files in os.walk(search_dir):
-            for file in files:
-                if file.endswith(".encrypted.mp4") or file.endswith(".encrypted.m4a"):
-                    if self.stop_event.is_set():
-                        self.log("Stopped during decryption.")
-                        return
-                    in_path = os.path.join(root, file)
-                    base_name = file.replace(".encrypted", "")
-                    out_path = os.path.join(root, base_name)
-                    if os.path.exists(out_path):
-                        self.log(f"Skipping already decrypted: {base_name}")
-                        continue
-                    cmd = [self.ffmpeg_path, "-nostdin", "-loglevel", "error", "-decryption_key", decryption_key, "-i", in_path, "-c", "copy", out_path]
-                    self.log(f"Decrypting: {file} -> {base_name}")
-                    try:
-                        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                        self.ffmpeg_processes.append(proc)
-                        stdout, stderr = proc.communicate()
-                        if stdout:
-                            for line in stdout.splitlines():
-                                self.log(line)
-                        if stderr:
-                            for line in stderr.splitlines():
-                                self.log(f"[ffmpeg] {line}")
-                        if self.stop_event.is_set():
-                            self.log("Terminated ffmpeg during decryption.")
-                            return
-                        if proc.returncode != 0:
-                            self.log(f"Error decrypting {file}: ffmpeg exited with code {proc.returncode}")
-                        elif not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
-                            self.log(f"Decryption failed: Output file not created or empty for {file}")
-                        else:
-                            self.log(f"Decrypted: {out_path}")
-                    except Exception as e:
-                        self.log(f"Error running ffmpeg: {e}")
+    def decrypt_files(self, decryption_key, manifest):
+        # Decrypt the encrypted tracks listed in the run manifest with correct output naming
+        tracks = [r["path"] for r in manifest if r.get("kind") == "encrypted_track"]
+        self.log(f"Starting decryption of {len(tracks)} track(s)")
+        for path in tracks:
+            if self.stop_event.is_set():
+                self.log("Stopped during decryption.")
+                return
+            if os.path.exists(path):
+                self.decrypt_file(decryption_key, os.path.dirname(path), os.path.basename(path))
 
-    def combine_files(self, search_dir):
-        from pathvalidate import sanitize_filename
-        final_suffix = ""
-        id_to_title_map = {}
+    def job_store_for(self, root):
+        # Job store of the course a chapter directory belongs to, None for courses downloaded before it existed
+        course_dir = os.path.dirname(os.path.abspath(root))
+        if course_dir not in self.job_stores:
+            try:
+                self.job_stores[course_dir] = JobStore.for_course(course_dir, create=False)
+            except sqlite3.Error as e:
+                self.log(f"Couldn't open the job store of {course_dir}: {e}")
+                self.job_stores[course_dir] = None
+        return self.job_stores[course_dir]
+
+    def close_job_stores(self):
+        # Closes the job stores opened by a run, as main.close_job_store does for the downloader's
+        for store in self.job_stores.values():
+            if store is not None:
+                store.close()
+        self.job_stores.clear()
+
+    def update_job(self, root, lecture_id, status, **fields):
+        # Records a post-processing step of a lecture in its course's job store
+        store = self.job_store_for(root)
+        if store is None:
+            return
+        try:
+            store.update("lecture", lecture_id, status, **fields)
+        except sqlite3.Error as e:
+            self.log(f"Couldn't update the job store for lecture {lecture_id}: {e}")
+
+    def run_ffmpeg(self, cmd, out_path):
+        # Runs ffmpeg under the stall watchdog, restarting it from scratch when out_path stops growing
+        def on_stall(result, attempt):
+            self.log(f"[ffmpeg] {result.describe()} writing {os.path.basename(out_path)} (attempt {attempt + 1})")
+            if os.path.exists(out_path):
+                os.remove(out_path)
+
+        return run_with_retries(
+            cmd, name="ffmpeg", retries=STALL_RETRIES, on_stall=on_stall, stall_timeout=STALL_TIMEOUT,
+            watch_path=out_path, on_start=self.ffmpeg_processes.append, stop_event=self.stop_event,
+        )
 
-        # Find and load the ID-to-title map
-        for dirpath, _, filenames in os.walk(search_dir):
-            if "id_to_title.json" in filenames:
-                map_file_path = os.path.join(dirpath, "id_to_title.json")
-                try:
-                    with open(map_file_path, "r", encoding="utf-8") as f:
-                        id_to_title_map = json.load(f)
-                    self.log(f"Loaded title mapping from {map_file_path}")
-                except Exception as e:
-                    self.log(f"Error loading title map: {e}")
-                break # Assume one map per run
-
-        self.log(f"Starting combination in directory: {search_dir}")
-        for root, dirs, files in os.walk(search_dir):
-            for file in files:
-                # Ensure we only process decrypted .mp4 files that are not still in their original encrypted form
-                # and have not yet been combined (checked later by os.path.exists(final_output_path)).
-                # This fixes the logical error when final_suffix is empty.
-                if file.endswith(".mp4") and ".encrypted" not in file:
-                    file_id = file[:-4]
-                    mp4_path = os.path.join(root, file)
-                    m4a_path = os.path.join(root, f"{file_id}.m4a")
-
-                    # Determine final name
-                    lecture_title = id_to_title_map.get(file_id)
-                    if lecture_title:
-                        final_base_name = sanitize_filename(lecture_title)
-                        self.log(f"Found title for ID {file_id}: '{lecture_title}'")
-                    else:
-                        final_base_name = file_id
-                        self.log(f"No title found for ID {file_id}, using ID as name.")
-
-                    final_output_name = f"{final_base_name}{final_suffix}.mp4"
-                    final_output_path = os.path.join(root, final_output_name)
-
-                    if os.path.exists(mp4_path) and os.path.exists(m4a_path):
-                        if os.path.exists(final_output_path):
-                            self.log(f"Skipping already combined file: {final_output_name}")
-                            continue
-
-                        self.log(f"Combining and fixing sync for: {file}")
-                        cmd = [self.ffmpeg_path, "-nostdin", "-loglevel", "error", "-i", mp4_path, "-i", m4a_path, "-copyts", "-start_at_zero", "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "copy", "-shortest", final_output_path]
+    def decrypt_file(self, decryption_key, root, file):
+        in_path = os.path.join(root, file)
+        base_name = file.replace(".encrypted", "")
+        out_path = os.path.join(root, base_name)
+        lecture_id = file.split(".", 1)[0]
+        if os.path.exists(out_path):
+            self.log(f"Skipping already decrypted: {base_name}")
+            return True
+        cmd = [self.ffmpeg_path, "-nostdin", "-loglevel", "error", "-decryption_key", decryption_key, "-i", in_path, "-c", "copy", out_path]
+        self.log(f"Decrypting: {file} -> {base_name}")
+        try:
+            result = self.run_ffmpeg(cmd, out_path)
+            for line in result.output:
+                self.log(f"[ffmpeg] {line}")
+            if result.cancelled:
+                self.log("Terminated ffmpeg during decryption.")
+                return False
+            if not result.ok:
+                self.log(f"Error decrypting {file}: {result.describe()}")
+                self.update_job(root, lecture_id, "failed", error=f"decrypt {file}: {result.describe()}")
+            elif not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
+                self.log(f"Decryption failed: Output file not created or empty for {file}")
+                self.update_job(root, lecture_id, "failed", error=f"decrypt {file}: empty output")
+            else:
+                self.log(f"Decrypted: {out_path}")
+                self.update_job(root, lecture_id, "decrypted")
+                return True
+        except Exception as e:
+            self.log(f"Error running ffmpeg: {e}")
+        return False
+
+    def combine_files(self, manifest):
+        id_to_title_map = self.load_id_to_title_map(manifest)
+        self.caption_index = {}
+
+        lectures = self.manifest_lectures(manifest)
+        self.log(f"Starting combination of {len(lectures)} lecture(s)")
+        for root, file_id in lectures:
+            if self.stop_event.is_set():
+                self.log("Stopped during combining.")
+                return
+            self.combine_lecture(root, file_id, id_to_title_map)
+
+    def final_output_name(self, file_id, id_to_title_map, final_suffix=""):
+        # Determine final name
+        lecture_title = id_to_title_map.get(file_id)
+        if lecture_title:
+            final_base_name = sanitize_filename(lecture_title)
+            self.log(f"Found title for ID {file_id}: '{lecture_title}'")
+        else:
+            final_base_name = file_id
+            self.log(f"No title found for ID {file_id}, using ID as name.")
+        return final_base_name, f"{final_base_name}{final_suffix}.mp4"
+
+    def combine_lecture(self, root, file_id, id_to_title_map, final_suffix=""):
+        file = f"{file_id}.mp4"
+        mp4_path = os.path.join(root, file)
+        m4a_path = os.path.join(root, f"{file_id}.m4a")
+
+        final_base_name, final_output_name = self.final_output_name(file_id, id_to_title_map, final_suffix)
+        final_output_path = os.path.join(root, final_output_name)
+
+        if not (os.path.exists(mp4_path) and os.path.exists(m4a_path)):
+            self.log(f"Skipping combine for {file} - missing video or audio part.")
+            return False
+        if os.path.exists(final_output_path):
+            self.log(f"Skipping already combined file: {final_output_name}")
+            return True
+
+        self.log(f"Combining and fixing sync for: {file}")
+        cmd = [self.ffmpeg_path, "-nostdin", "-loglevel", "error", "-i", mp4_path, "-i", m4a_path, "-copyts", "-start_at_zero", "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "copy", "-shortest", final_output_path]
+        try:
+            result = self.run_ffmpeg(cmd, final_output_path)
+            if result.ok and os.path.exists(final_output_path) and os.path.getsize(final_output_path) > 0:
+                self.log(f"  > Success! Cleaning up temporary files.")
+                # Clean up decrypted and encrypted files
+                encrypted_mp4_path = os.path.join(root, f"{file_id}.encrypted.mp4")
+                encrypted_m4a_path = os.path.join(root, f"{file_id}.encrypted.m4a")
+                for f_path in [mp4_path, m4a_path, encrypted_mp4_path, encrypted_m4a_path]:
+                    if os.path.exists(f_path):
                         try:
-                            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                            self.ffmpeg_processes.append(proc)
-                            stdout, stderr = proc.communicate()
-                            if proc.returncode == 0 and os.path.exists(final_output_path) and os.path.getsize(final_output_path) > 0:
-                                self.log(f"  > Success! Cleaning up temporary files.")
-                                # Clean up decrypted and encrypted files
-                                encrypted_mp4_path = os.path.join(root, f"{file_id}.encrypted.mp4")
-                                encrypted_m4a_path = os.path.join(root, f"{file_id}.encrypted.m4a")
-                                for f_path in [mp4_path, m4a_path, encrypted_mp4_path, encrypted_m4a_path]:
-                                    if os.path.exists(f_path):
-                                        try:
-                                            os.remove(f_path)
-                                        except Exception as e:
-                                            self.log(f"Error deleting {f_path}: {e}")
-                                self.log(f"Combined: {final_output_path}")
-
-                                # Rename associated subtitle files
-                                srt_files = [f for f in os.listdir(root) if f.startswith(final_base_name) and f.endswith(".srt")]
-                                for srt_file in srt_files:
-                                    lang_part_match = re.search(r'(_[a-z]{2,3}(?:_[A-Z]{2,3})?).srt$', srt_file)
-                                    if lang_part_match:
-                                        lang_part = lang_part_match.group(1)
-                                        old_srt_path = os.path.join(root, srt_file)
-                                        new_srt_name = f"{final_base_name}{final_suffix}{lang_part}.srt"
-                                        new_srt_path = os.path.join(root, new_srt_name)
-                                        try:
-                                            if os.path.exists(old_srt_path):
-                                                os.rename(old_srt_path, new_srt_path)
-                                                self.log(f"Renamed caption to: {new_srt_name}")
-                                        except Exception as e:
-                                            self.log(f"Error renaming caption {srt_file}: {e}")
-                            else:
-                                self.log(f"  > ERROR: ffmpeg failed to combine {file}. Temporary files were NOT deleted.")
-                                if stderr:
-                                    for line in stderr.splitlines():
-                                        self.log(f"[ffmpeg] {line}")
+                            os.remove(f_path)
                         except Exception as e:
-                            self.log(f"Error running ffmpeg: {e}")
-                    else:
-                        self.log(f"Skipping combine for {file} - missing video or audio part.")
-
-    def cleanup_temp_folders(self, search_dir):
-        self.log(f"Scanning for 'temp' folders in {search_dir}...")
-        for root, dirs, files in os.walk(search_dir):
-            if 'temp' in dirs:
-                temp_path = os.path.join(root, 'temp')
+                            self.log(f"Error deleting {f_path}: {e}")
+                self.log(f"Combined: {final_output_path}")
+                self.update_job(root, file_id, "complete", path=final_output_path)
+
+                # Rename associated subtitle files
+                self.rename_captions(root, final_base_name, final_suffix)
+                return True
+            self.log(f"  > ERROR: ffmpeg failed to combine {file} ({result.describe()}). Temporary files were NOT deleted.")
+            self.update_job(root, file_id, "failed", error=f"combine: {result.describe()}")
+            for line in result.output:
+                self.log(f"[ffmpeg] {line}")
+        except Exception as e:
+            self.log(f"Error running ffmpeg: {e}")
+        return False
+
+    def manifest_lectures(self, manifest):
+        # (directory, lecture id) of every DRM lecture whose tracks were downloaded, in download order
+        lectures = []
+        for record in manifest:
+            if record.get("kind") != "encrypted_track":
+                continue
+            lecture = (os.path.dirname(record["path"]), str(record.get("lecture_id")))
+            if lecture not in lectures:
+                lectures.append(lecture)
+        return lectures
+
+    def load_id_to_title_map(self, manifest):
+        # Load the ID-to-title map(s) written by the downloader
+        id_to_title_map = {}
+        for record in manifest:
+            if record.get("kind") == "id_to_title" and os.path.exists(record["path"]):
+                id_to_title_map.update(self.read_id_to_title_map(record["path"]))
+        return id_to_title_map
+
+    def read_id_to_title_map(self, map_file_path):
+        try:
+            with open(map_file_path, "r", encoding="utf-8") as f:
+                id_to_title_map = json.load(f)
+            self.log(f"Loaded title mapping from {map_file_path}")
+            return id_to_title_map
+        except Exception as e:
+            self.log(f"Error loading title map: {e}")
+        return {}
+
+    def caption_files(self, root, base_name):
+        # Each directory is listed once, its captions are grouped by lecture base name
+        if root not in self.caption_index:
+            index = {}
+            for name in os.listdir(root):
+                self._add_caption(index, name)
+            self.caption_index[root] = index
+        return list(self.caption_index[root].get(base_name, ()))
+
+    def index_caption(self, path):
+        # Adds a caption written after its directory was indexed
+        root, name = os.path.split(path)
+        if root in self.caption_index:
+            self._add_caption(self.caption_index[root], name)
+
+    def _add_caption(self, index, name):
+        lang_part_match = CAPTION_LANG_RE.search(name)
+        if lang_part_match:
+            names = index.setdefault(name[:lang_part_match.start()], [])
+            if name not in names:
+                names.append(name)
+
+    def rename_captions(self, root, final_base_name, final_suffix=""):
+        for srt_file in self.caption_files(root, final_base_name):
+            lang_part = CAPTION_LANG_RE.search(srt_file).group(1)
+            old_srt_path = os.path.join(root, srt_file)
+            new_srt_name = f"{final_base_name}{final_suffix}{lang_part}.srt"
+            new_srt_path = os.path.join(root, new_srt_name)
+            if new_srt_name == srt_file:
+                continue
+            try:
+                if os.path.exists(old_srt_path):
+                    os.rename(old_srt_path, new_srt_path)
+                    self.caption_index[root][final_base_name].remove(srt_file)
+                    self._add_caption(self.caption_index[root], new_srt_name)
+                    self.log(f"Renamed caption to: {new_srt_name}")
+            except Exception as e:
+                self.log(f"Error renaming caption {srt_file}: {e}")
+
+    def decrypt_and_combine_files(self, decryption_key, manifest):
+        # Decrypt the video and audio tracks and mux them straight into the titled output,
+        # skipping the intermediate decrypted <id>.mp4/<id>.m4a files
+        id_to_title_map = self.load_id_to_title_map(manifest)
+        self.caption_index = {}
+
+        lectures = self.manifest_lectures(manifest)
+        self.log(f"Starting single-pass decrypt and combine of {len(lectures)} lecture(s)")
+        for root, file_id in lectures:
+            if self.stop_event.is_set():
+                self.log("Stopped during decryption.")
+                return
+            self.decrypt_and_combine_lecture(decryption_key, root, file_id, id_to_title_map)
+
+    def decrypt_and_combine_lecture(self, decryption_key, root, file_id, id_to_title_map, final_suffix=""):
+        file = f"{file_id}.encrypted.mp4"
+        enc_mp4_path = os.path.join(root, file)
+        enc_m4a_path = os.path.join(root, f"{file_id}.encrypted.m4a")
+        if not (os.path.exists(enc_mp4_path) and os.path.exists(enc_m4a_path)):
+            self.log(f"Skipping combine for {file} - missing video or audio part.")
+            return False
+
+        final_base_name, final_output_name = self.final_output_name(file_id, id_to_title_map, final_suffix)
+        final_output_path = os.path.join(root, final_output_name)
+        if os.path.exists(final_output_path):
+            self.log(f"Skipping already combined file: {final_output_name}")
+            return True
+
+        self.log(f"Decrypting and combining: {file_id} -> {final_output_name}")
+        cmd = [
+            self.ffmpeg_path, "-nostdin", "-loglevel", "error",
+            "-decryption_key", decryption_key, "-i", enc_mp4_path,
+            "-decryption_key", decryption_key, "-i", enc_m4a_path,
+            "-copyts", "-start_at_zero", "-map", "0:v:0", "-map", "1:a:0",
+            "-c:v", "copy", "-c:a", "copy", "-shortest", final_output_path,
+        ]
+        try:
+            result = self.run_ffmpeg(cmd, final_output_path)
+            if result.cancelled:
+                self.log("Terminated ffmpeg during decryption.")
+                return False
+            if result.ok and os.path.exists(final_output_path) and os.path.getsize(final_output_path) > 0:
+                self.log(f"  > Success! Cleaning up encrypted files.")
+                for f_path in [enc_mp4_path, enc_m4a_path]:
+                    try:
+                        os.remove(f_path)
+                    except Exception as e:
+                        self.log(f"Error deleting {f_path}: {e}")
+                self.log(f"Combined: {final_output_path}")
+                self.update_job(root, file_id, "complete", path=final_output_path)
+                self.rename_captions(root, final_base_name, final_suffix)
+                return True
+            self.log(f"  > ERROR: ffmpeg failed to decrypt/combine {file} ({result.describe()}). Encrypted files were NOT deleted.")
+            self.update_job(root, file_id, "failed", error=f"decrypt/combine: {result.describe()}")
+            for line in result.output:
+                self.log(f"[ffmpeg] {line}")
+            # don't leave a partial output behind, it would be skipped as "already combined" next run
+            if os.path.exists(final_output_path):
                 try:
-                    shutil.rmtree(temp_path)
-                    self.log(f"Removed temporary directory: {temp_path}")
+                    os.remove(final_output_path)
                 except Exception as e:
-                    self.log(f"Error removing temp directory {temp_path}: {e}")
+                    self.log(f"Error deleting {final_output_path}: {e}")
+        except Exception as e:
+            self.log(f"Error running ffmpeg: {e}")
+        return False
+
+    def postprocess_lecture(self, decryption_key, root, file_id, id_to_title_map):
+        # Run the post-processing stages for a single downloaded lecture
+        if self.single_pass_decrypt.get():
+            return self.decrypt_and_combine_lecture(decryption_key, root, file_id, id_to_title_map)
+        for ext in ("mp4", "m4a"):
+            if not self.decrypt_file(decryption_key, root, f"{file_id}.encrypted.{ext}"):
+                return False
+        return self.combine_lecture(root, file_id, id_to_title_map)
+
+    def handle_output_line(self, line, postprocess_queue, manifest_path):
+        # Logs a line of the downloader's output, handing the lectures it reports as ready to the worker
+        if not line:
+            return
+        if postprocess_queue is not None and line.startswith("GUI_PROGRESS:LECTURE_READY:"):
+            # GUI_PROGRESS:LECTURE_READY:<lecture id>:<chapter dir>
+            _, _, file_id, chapter_dir = line.strip().split(":", 3)
+            self.enqueue_postprocess(postprocess_queue, (chapter_dir, file_id, manifest_path))
+        self.log(line.strip())
+
+    def enqueue_postprocess(self, work_queue, item):
+        # Blocks while the post-processing queue is full, which in turn stops us reading the downloader's output
+        while not self.stop_event.is_set():
+            try:
+                work_queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def postprocess_worker(self, decryption_key, work_queue):
+        # Consumes lectures reported as ready by the downloader while it keeps downloading the next ones
+        id_to_title_maps = {}
+        manifest_readers = {}
+        while True:
+            item = work_queue.get()
+            try:
+                if item is None:
+                    return
+                if self.stop_event.is_set():
+                    continue
+                root, file_id, manifest_path = item
+                # captions written since the chapter directory was indexed are in the run manifest
+                if manifest_path not in manifest_readers:
+                    manifest_readers[manifest_path] = ManifestReader(manifest_path)
+                for record in manifest_readers[manifest_path].read_new():
+                    if record.get("kind") == "caption" and record["path"].endswith(".srt"):
+                        self.index_caption(record["path"])
+                course_dir = os.path.dirname(root)
+                if course_dir not in id_to_title_maps:
+                    id_to_title_maps[course_dir] = self.read_id_to_title_map(os.path.join(course_dir, "id_to_title.json"))
+                self.log(f"Post-processing lecture {file_id} ({work_queue.qsize()} queued)")
+                if self.postprocess_lecture(decryption_key, root, file_id, id_to_title_maps[course_dir]):
+                    # paths as the run manifest records them
+                    self.postprocessed.add((os.path.abspath(root), str(file_id)))
+            except Exception as e:
+                self.log(f"Error post-processing lecture: {e}")
+            finally:
+                work_queue.task_done()
+
+    def cleanup_temp_folders(self, manifest, search_dir):
+        # Only remove the 'temp' folders the downloader created inside the output directory
+        search_dir = os.path.abspath(search_dir)
+        temp_dirs = [r["path"] for r in manifest if r.get("kind") == "temp_dir"]
+        self.log(f"Removing temporary folders in {search_dir}...")
+        for temp_path in temp_dirs:
+            try:
+                inside_out_dir = os.path.commonpath([temp_path, search_dir]) == search_dir
+            except ValueError:  # different drives on Windows
+                inside_out_dir = False
+            if not inside_out_dir or not os.path.isdir(temp_path):
+                continue
+            try:
+                shutil.rmtree(temp_path)
+                self.log(f"Removed temporary directory: {temp_path}")
+            except Exception as e:
+                self.log(f"Error removing temp directory {temp_path}: {e}")
 
 def main():
     root = tk.Tk()
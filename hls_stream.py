@@ -0,0 +1,114 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import m3u8
+import requests
+
+logger = logging.getLogger("udemy-downloader.hls")
+
+SEGMENT_RETRIES = 3
+SEGMENT_TIMEOUT = 30
+
+
+class StreamUnsupported(Exception):
+    """
+    The playlist can't be fed to the encoder segment by segment, download it normally instead
+    """
+
+
+def load_media_playlist(playlist_uri, base_url=None):
+    """
+    Reads a media playlist saved by _extract_m3u8 (file:// URI) or fetches it, and returns
+    (init_url, segment_urls, duration). Raises StreamUnsupported for playlists ffmpeg couldn't
+    read from a pipe: encrypted segments, byte ranges or a changing init section.
+    """
+    if playlist_uri.startswith("file:"):
+        with open(url2pathname(urlparse(playlist_uri).path), "r", encoding="utf-8") as f:
+            playlist = m3u8.loads(f.read(), uri=base_url)
+    else:
+        playlist = m3u8.load(playlist_uri)
+
+    if playlist.is_variant:
+        raise StreamUnsupported("master playlist")
+    if any(key and key.method and key.method.upper() != "NONE" for key in playlist.keys):
+        raise StreamUnsupported("encrypted segments")
+    if not playlist.segments:
+        raise StreamUnsupported("no segments")
+
+    init_urls = set()
+    segment_urls = []
+    for segment in playlist.segments:
+        if segment.byterange:
+            raise StreamUnsupported("byte range segments")
+        if segment.init_section:
+            init_urls.add(segment.init_section.absolute_uri)
+        segment_urls.append(segment.absolute_uri)
+    if len(init_urls) > 1:
+        raise StreamUnsupported("more than one init section")
+    if any(not urlparse(url).scheme for url in segment_urls + list(init_urls)):
+        raise StreamUnsupported("relative segment URLs without a base URL")
+
+    duration = sum(segment.duration or 0.0 for segment in playlist.segments)
+    return (init_urls.pop() if init_urls else None), segment_urls, duration
+
+
+def fetch_segment(session, url):
+    for attempt in range(SEGMENT_RETRIES):
+        try:
+            r = session.get(url, timeout=SEGMENT_TIMEOUT)
+            r.raise_for_status()
+            return r.content
+        except requests.RequestException as error:
+            if attempt == SEGMENT_RETRIES - 1:
+                raise
+            logger.warning("      > Segment download failed (%s), retrying...", error)
+            time.sleep(1 + attempt)
+
+
+def iter_segments(urls, workers=10):
+    """
+    Yields the content of urls in playlist order, fetching up to `workers` segments ahead.
+    Only the prefetch window is kept in memory, nothing is written to disk.
+    """
+    session = requests.Session()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hls-segment") as executor:
+        pending = []
+        urls = iter(urls)
+        try:
+            for url in urls:
+                pending.append(executor.submit(fetch_segment, session, url))
+                if len(pending) >= workers:
+                    break
+            while pending:
+                data = pending.pop(0).result()
+                next_url = next(urls, None)
+                if next_url:
+                    pending.append(executor.submit(fetch_segment, session, next_url))
+                yield data
+        finally:
+            for future in pending:
+                future.cancel()
+            session.close()
+
+
+def input_format(init_url):
+    """
+    ffmpeg demuxer for the concatenated segments: fMP4 (EXT-X-MAP) is read as mp4, everything else is MPEG-TS
+    """
+    return "mov" if init_url else "mpegts"
+
+
+def stream_chunks(init_url, segment_urls, workers=10):
+    """
+    Byte chunks of the whole lecture as one stream: the init section (if any) followed by every segment
+    """
+    if init_url:
+        session = requests.Session()
+        try:
+            yield fetch_segment(session, init_url)
+        finally:
+            session.close()
+    yield from iter_segments(segment_urls, workers)
@@ -0,0 +1,211 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+JOB_STORE_NAME = ".jobs.sqlite3"
+
+# lecture: pending -> downloading -> (downloaded -> decrypted, DRM lectures) -> complete, or failed
+# track/caption/asset: pending -> downloading -> complete, or failed
+STATUSES = ("pending", "downloading", "downloaded", "decrypted", "complete", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    kind TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    lecture_id TEXT,
+    status TEXT NOT NULL,
+    path TEXT,
+    bytes INTEGER,
+    checksum TEXT,
+    rendition TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    completed_at REAL,
+    PRIMARY KEY (kind, item_id)
+);
+CREATE INDEX IF NOT EXISTS items_lecture ON items (lecture_id);
+CREATE INDEX IF NOT EXISTS items_status ON items (kind, status);
+"""
+
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    """
+    blake2b of a file's contents, read in chunks
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JobStore(object):
+    """
+    SQLite record of every lecture, caption, asset and encrypted track of a course: status, size, checksum,
+    rendition and timestamps. Lives in the course directory, so main.py and the GUI (separate processes)
+    both update it; every update is its own transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            # WAL lets the GUI read while main.py writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    @classmethod
+    def for_course(cls, course_dir, create=True):
+        """
+        Opens the store of a course directory, None if it doesn't have one and create is False
+        """
+        path = os.path.join(course_dir, JOB_STORE_NAME)
+        if not create and not os.path.isfile(path):
+            return None
+        return cls(path)
+
+    def update(self, kind, item_id, status, path=None, lecture_id=None, rendition=None, error=None, checksum=False):
+        """
+        Sets the status of an item, creating its row if needed. The size of path is recorded when it exists,
+        and its checksum when asked to (complete files).
+        """
+        assert status in STATUSES, status
+        now = time.time()
+        size = digest = None
+        if path and os.path.isfile(path):
+            size = os.path.getsize(path)
+            if checksum:
+                digest = file_checksum(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO items (kind, item_id, lecture_id, status, path, bytes, checksum, rendition, error,
+                                   attempts, created_at, updated_at, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, item_id) DO UPDATE SET
+                    lecture_id = COALESCE(excluded.lecture_id, items.lecture_id),
+                    status = excluded.status,
+                    path = COALESCE(excluded.path, items.path),
+                    bytes = COALESCE(excluded.bytes, items.bytes),
+                    checksum = CASE WHEN excluded.bytes IS NOT NULL THEN excluded.checksum ELSE items.checksum END,
+                    rendition = COALESCE(excluded.rendition, items.rendition),
+                    error = excluded.error,
+                    attempts = items.attempts + excluded.attempts,
+                    updated_at = excluded.updated_at,
+                    completed_at = CASE WHEN excluded.status = 'complete' THEN excluded.updated_at
+                                        ELSE items.completed_at END
+                """,
+                (
+                    kind,
+                    str(item_id),
+                    str(lecture_id) if lecture_id is not None else None,
+                    status,
+                    os.path.abspath(path) if path else None,
+                    size,
+                    digest,
+                    rendition,
+                    error,
+                    1 if status == "downloading" else 0,
+                    now,
+                    now,
+                    now if status == "complete" else None,
+                ),
+            )
+
+    def get(self, kind, item_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM items WHERE kind = ? AND item_id = ?", (kind, str(item_id))
+            ).fetchone()
+        return dict(row) if row else None
+
+    def items(self, kind=None, status=None):
+        query = "SELECT * FROM items WHERE 1 = 1"
+        params = []
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query + " ORDER BY created_at", params)]
+
+    def is_complete(self, kind, item_id, path=None):
+        """
+        True if the item finished and its file is still there with the recorded size, False if it didn't
+        (or the file changed since), None if the store has never seen it
+        """
+        row = self.get(kind, item_id)
+        if row is None:
+            return None
+        return row["status"] == "complete" and self.file_matches(row, path)
+
+    def file_matches(self, row, path=None):
+        path = path or row["path"]
+        if not path or not os.path.isfile(path):
+            return False
+        return row["bytes"] is None or os.path.getsize(path) == row["bytes"]
+
+    def reset(self, lecture_id, kinds):
+        """
+        Sets the items of a lecture back to pending (so they're downloaded again), returns their recorded paths
+        """
+        lecture_id = str(lecture_id)
+        where = " WHERE (lecture_id = ? OR (kind = 'lecture' AND item_id = ?)) AND kind IN ({})".format(
+            ", ".join("?" for _ in kinds)
+        )
+        params = [lecture_id, lecture_id, *kinds]
+        with self._lock, self._conn:
+            paths = [row["path"] for row in self._conn.execute("SELECT path FROM items" + where, params) if row["path"]]
+            self._conn.execute(
+                "UPDATE items SET status = 'pending', error = NULL, updated_at = ?" + where, [time.time(), *params]
+            )
+        return paths
+
+    def failed_lectures(self):
+        """
+        Ids of the lectures with a failed item
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT COALESCE(lecture_id, item_id) FROM items WHERE status = 'failed'"
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def throughput(self):
+        """
+        (bytes, seconds) of the lectures downloaded in a single attempt, from starting to completing them.
+        DRM lectures are left out, their completion waits for the decryption in the GUI.
+        """
+        with self._lock:
+            size, seconds = self._conn.execute(
+                """
+                SELECT COALESCE(SUM(bytes), 0), COALESCE(SUM(completed_at - created_at), 0) FROM items
+                WHERE kind = 'lecture' AND status = 'complete' AND attempts = 1 AND bytes IS NOT NULL
+                      AND completed_at > created_at AND rendition NOT LIKE 'dash%'
+                """
+            ).fetchone()
+        return size, seconds
+
+    def summary(self):
+        """
+        {kind: {status: count}}
+        """
+        counts = {}
+        with self._lock:
+            for kind, status, count in self._conn.execute(
+                "SELECT kind, status, COUNT(*) FROM items GROUP BY kind, status"
+            ):
+                counts.setdefault(kind, {})[status] = count
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
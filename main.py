@@ -1,17 +1,19 @@
-from gui import show_video_selection_window
 # -*- coding: utf-8 -*-
 import argparse
+import functools
 import json
 import logging
-import math
 import os
 import re
-import subprocess
+import shutil
+import sqlite3
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from http.cookiejar import MozillaCookieJar
 from pathlib import Path
-from typing import IO, Union
+from typing import Union
 
 import browser_cookie3
 import demoji
@@ -25,8 +27,21 @@ from pathvalidate import sanitize_filename
 from requests.exceptions import ConnectionError as conn_error
 from tqdm import tqdm
 
+from calibrate import calibrate, load_calibration, save_calibration
+from checkpoint import CHECKPOINT_MAX_AGE, CurriculumCheckpoint
 from constants import *
+from curriculum import Chapter, CurriculumIndex, Lecture, course_index
+from estimate import DEFAULT_THROUGHPUT, build_report, estimate_lecture, measured_throughput, write_report
+from hls_stream import StreamUnsupported, input_format, load_media_playlist, stream_chunks
+from jobstore import JobStore
+from manifest import JobManifest
+from plan import HEARTBEAT_SECONDS, PLAN_OPTIONS, ShardClaims, embed_manifests, load_plan, restore_manifests, write_plan
+from runner import CombinedProgress, DownloadProgressParser, ProgressEvent, run, run_with_retries
+from savedcourse import SavedCourse, load_legacy
+from selection import SelectionRules
+from sync import build_snapshot, diff_snapshots, load_snapshot, merge_snapshot, retire_files, save_snapshot
 from tls import SSLCiphers
+from transcode import TranscodeQueue, nvenc_available
 from vtt_to_srt import convert
 
 DOWNLOAD_DIR = os.path.join(os.getcwd(), "out_dir")
@@ -54,26 +69,199 @@ info = None
 id_as_course_name = False
 is_subscription_course = False
 use_h265 = False
-h265_crf = 28
-h265_preset = "medium"
+h265_crf = None
+h265_preset = None
 use_nvenc = False
+transcode_workers = None
+h265_chunk_seconds = None
+h265_min_bitrate = 500
+h265_stream = False
+stall_timeout = 300
+stall_retries = 2
+stall_count = 0
+calibrate_dir = None
+calibrate_min_fps = None
+transcode_queue: TranscodeQueue = None
 browser = None
 cj = None
 use_continuous_lecture_numbers = False
 chapter_filter = None
 lecture_filter = None
+job_manifest_path = None
+job_manifest: JobManifest = None
+job_store: JobStore = None
+sync_mode = False
+select_all = False
+selection_rules: SelectionRules = None
+cookie_file = None
+transcode_settings = None
+# set by the daemon: cancels the running job, and receives the GUI_PROGRESS events
+cancel_event: threading.Event = None
+progress_listener = None
+export_plan_path = None
+plan_shard_size = 1
+run_plan_path = None
+worker_id = None
+retry_failed_shards = False
+estimate_path = None
+
+# the options apply_args sets, and their defaults
+OPTION_DEFAULTS = {
+    name: globals()[name]
+    for name in (
+        "dl_assets",
+        "dl_captions",
+        "dl_quizzes",
+        "skip_lectures",
+        "caption_locale",
+        "quality",
+        "bearer_token",
+        "course_name",
+        "keep_vtt",
+        "skip_hls",
+        "concurrent_downloads",
+        "load_from_file",
+        "save_to_file",
+        "course_url",
+        "info",
+        "id_as_course_name",
+        "use_h265",
+        "h265_crf",
+        "h265_preset",
+        "use_nvenc",
+        "browser",
+        "is_subscription_course",
+        "DOWNLOAD_DIR",
+        "use_continuous_lecture_numbers",
+        "chapter_filter",
+        "lecture_filter",
+        "job_manifest_path",
+        "transcode_workers",
+        "h265_chunk_seconds",
+        "h265_min_bitrate",
+        "h265_stream",
+        "calibrate_dir",
+        "calibrate_min_fps",
+        "stall_timeout",
+        "stall_retries",
+        "sync_mode",
+        "select_all",
+        "cookie_file",
+        "selection_rules",
+        "export_plan_path",
+        "plan_shard_size",
+        "run_plan_path",
+        "worker_id",
+        "retry_failed_shards",
+        "estimate_path",
+    )
+}
+
+
+class DownloadCancelled(Exception):
+    """
+    The daemon cancelled the running job
+    """
+
+
+def gui_progress(*fields):
+    """
+    Reports progress to the GUI (a GUI_PROGRESS line on stdout) and to the daemon
+    """
+    print("GUI_PROGRESS:" + ":".join(str(field) for field in fields), flush=True)
+    if progress_listener:
+        progress_listener(*fields)
+
+
+def check_cancelled():
+    if cancel_event is not None and cancel_event.is_set():
+        raise DownloadCancelled()
 
 
 def deEmojify(inputStr: str):
     return demoji.replace(inputStr, "")
 
 
-# from https://stackoverflow.com/a/21978778/9785713
-def log_subprocess_output(prefix: str, pipe: IO[bytes]):
-    if pipe:
-        for line in iter(lambda: pipe.read(1), ""):
-            logger.debug("[%s]: %r", prefix, line.decode("utf8").strip())
-        pipe.flush()
+def log_progress(label: str, interval: float = 5.0):
+    """
+    Returns an on_progress callback for runner.run that logs a tool's progress at most every `interval` seconds
+    """
+    last_logged = [0.0]
+
+    def on_progress(event: ProgressEvent):
+        now = time.time()
+        if now - last_logged[0] < interval and (event.percent or 0) < 100:
+            return
+        last_logged[0] = now
+        parts = [f"{event.percent:.1f}%"] if event.percent is not None else []
+        if event.total:
+            parts.append(f"of {event.total / 1024 / 1024:.1f} MiB")
+        if event.speed:
+            parts.append(f"at {event.speed / 1024 / 1024:.2f} MiB/s")
+        if event.eta is not None:
+            parts.append(f"ETA {event.eta}s")
+        logger.info("      > %s: %s", label, " ".join(parts))
+
+    return on_progress
+
+
+def stall_recorder(tool: str, target: str):
+    """
+    Returns an on_stall callback for runner.run_with_retries that logs and records stalls of the tool working on target
+    """
+
+    def on_stall(result, attempt: int):
+        global stall_count
+        stall_count += 1
+        logger.warning(f"      > {tool} {result.describe()} while working on {os.path.basename(target)}")
+        record_output(
+            "stall",
+            target,
+            unique=False,
+            tool=tool,
+            attempt=attempt + 1,
+            idle_seconds=round(result.stalled),
+            elapsed=round(result.elapsed, 1),
+            progress=result.progress._asdict() if result.progress else None,
+        )
+
+    return on_stall
+
+
+def watched(tool: str, target: str, watch_path: str = None):
+    """
+    Keyword arguments for runner.run_with_retries that put a process under the stall watchdog
+    """
+    return {
+        "name": tool,
+        "stall_timeout": stall_timeout or None,
+        "retries": stall_retries if stall_timeout else 0,
+        "on_stall": stall_recorder(tool, target),
+        "watch_path": watch_path,
+        "stop_event": cancel_event,
+    }
+
+
+def job_update(kind: str, item_id, status: str, store: JobStore = None, **fields):
+    """
+    Updates an item in the course's job store (if any), see JobStore.update. Work finishing after the run
+    (background encodes) passes the store of its own course.
+    """
+    store = store or job_store
+    if not store:
+        return
+    try:
+        store.update(kind, item_id, status, **fields)
+    except sqlite3.Error:
+        logger.exception(f"> Couldn't update the job store for {kind} {item_id}")
+
+
+def record_output(kind: str, path: str, **fields):
+    """
+    Records a produced file in the job manifest of the current run (if any)
+    """
+    if job_manifest:
+        job_manifest.add(kind, path, **fields)
 
 
 def parse_chapter_filter(chapter_str: str):
@@ -121,16 +309,10 @@ def parse_lecture_filter(lecture_str: str):
 
 
 # this is the first function that is called, we parse the arguments, setup the logger, and ensure that required directories exist
-def pre_run():
-    global dl_assets, dl_captions, dl_quizzes, skip_lectures, caption_locale, quality, bearer_token, course_name, keep_vtt, skip_hls, concurrent_downloads, load_from_file, save_to_file, bearer_token, course_url, info, logger, id_as_course_name, LOG_LEVEL, use_h265, h265_crf, h265_preset, use_nvenc, browser, is_subscription_course, DOWNLOAD_DIR, use_continuous_lecture_numbers, chapter_filter, lecture_filter
-
-    # make sure the logs directory exists
-    if not os.path.exists(LOG_DIR_PATH):
-        os.makedirs(LOG_DIR_PATH, exist_ok=True)
-
-    parser = argparse.ArgumentParser(description="Udemy Downloader")
+def build_arg_parser(parser_class=argparse.ArgumentParser):
+    parser = parser_class(description="Udemy Downloader")
     parser.add_argument(
-        "-c", "--course-url", dest="course_url", type=str, help="The URL of the course to download", required=True
+        "-c", "--course-url", dest="course_url", type=str, help="The URL of the course to download"
     )
     parser.add_argument(
         "-b",
@@ -199,8 +381,10 @@ def pre_run():
     parser.add_argument(
         "--info",
         dest="info",
-        action="store_true",
-        help="If specified, only course information will be printed, nothing will be downloaded",
+        nargs="?",
+        const="full",
+        choices=["full", "metadata"],
+        help="If specified, only course information will be printed, nothing will be downloaded. 'metadata' prints only what the curriculum says, without resolving the qualities of every lecture (Default is full)",
     )
     parser.add_argument(
         "--id-as-course-name",
@@ -219,13 +403,13 @@ def pre_run():
         "--save-to-file",
         dest="save_to_file",
         action="store_true",
-        help="If specified, course content will be saved to a file that can be loaded later with --load-from-file, this can reduce processing time (Note that asset links expire after a certain amount of time)",
+        help="If specified, course content will be saved to a file of its own in saved/courses that can be loaded later with --load-from-file, this can reduce processing time (Note that asset links expire after a certain amount of time)",
     )
     parser.add_argument(
         "--load-from-file",
         dest="load_from_file",
         action="store_true",
-        help="If specified, course content will be loaded from a previously saved file with --save-to-file, this can reduce processing time (Note that asset links expire after a certain amount of time)",
+        help="If specified, course content will be loaded from the file --save-to-file saved for the course (only the chapters of --chapter are read), this can reduce processing time (Note that asset links expire after a certain amount of time)",
     )
     parser.add_argument(
         "--log-level",
@@ -249,15 +433,13 @@ def pre_run():
         "--h265-crf",
         dest="h265_crf",
         type=int,
-        default=28,
-        help="Set a custom CRF value for H.265 encoding. FFMPEG default is 28",
+        help="Set a custom CRF value for H.265 encoding. Default is the calibrated value for this host, or 28",
     )
     parser.add_argument(
         "--h265-preset",
         dest="h265_preset",
         type=str,
-        default="medium",
-        help="Set a custom preset value for H.265 encoding. FFMPEG default is medium",
+        help="Set a custom preset value for H.265 encoding. Default is the calibrated value for this host, or medium",
     )
     parser.add_argument(
         "--use-nvenc",
@@ -265,6 +447,55 @@ def pre_run():
         action="store_true",
         help="Whether to use the NVIDIA hardware transcoding for H.265. Only works if you have a supported NVIDIA GPU and ffmpeg with nvenc support",
     )
+    parser.add_argument(
+        "--transcode-workers",
+        dest="transcode_workers",
+        type=int,
+        help="Number of H.265 encodes to run in parallel while downloads continue (Default is based on the number of CPU cores)",
+    )
+    parser.add_argument(
+        "--h265-chunk-seconds",
+        dest="h265_chunk_seconds",
+        type=int,
+        help="Split long videos into chunks of about this many seconds (cut at keyframes) and encode the chunks in parallel",
+    )
+    parser.add_argument(
+        "--h265-min-bitrate",
+        dest="h265_min_bitrate",
+        type=int,
+        help="Don't re-encode videos whose bitrate is already below this many kbps, 0 to always re-encode (Default is 500)",
+    )
+    parser.add_argument(
+        "--h265-stream",
+        dest="h265_stream",
+        action="store_true",
+        help="Feed HLS segments straight into the H.265 encoder while they download, so only the encoded file is written to disk",
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        dest="stall_timeout",
+        type=int,
+        help="Kill and restart a download or ffmpeg process that makes no progress for this many seconds, 0 to never (Default is 300)",
+    )
+    parser.add_argument(
+        "--stall-retries",
+        dest="stall_retries",
+        type=int,
+        help="How many times a stalled process is restarted before the lecture is given up on (Default is 2)",
+    )
+    parser.add_argument(
+        "--calibrate-h265",
+        dest="calibrate_h265",
+        type=str,
+        metavar="DIR",
+        help="Encode samples of the videos in DIR with several H.265 presets and CRF values, and save the best settings for this host as the new defaults",
+    )
+    parser.add_argument(
+        "--calibrate-min-fps",
+        dest="calibrate_min_fps",
+        type=float,
+        help="Encoding speed (frames per second, all transcode workers combined) the calibrated settings must reach (Default is the frame rate of the samples)",
+    )
     parser.add_argument(
         "--out",
         "-o",
@@ -291,9 +522,123 @@ def pre_run():
         type=str,
         help="Download specific lectures within chapters. Use comma separated values and ranges (e.g., '1,3-5,7,9-11').",
     )
+    parser.add_argument(
+        "--job-manifest",
+        dest="job_manifest",
+        type=str,
+        help="Path of the JSON Lines manifest listing the files produced by this run (Default is none, only the GUI reads it)",
+    )
+    parser.add_argument(
+        "--sync",
+        dest="sync",
+        action="store_true",
+        help="Only download the lectures that were added or changed since the last --sync of this course (without the selection window) and report the removed ones. The first sync downloads the whole course",
+    )
+    parser.add_argument(
+        "--all-lectures",
+        dest="select_all",
+        action="store_true",
+        help="Download every lecture without showing the selection window (the --chapter and --lecture filters still apply)",
+    )
+    parser.add_argument(
+        "--select-title",
+        dest="select_title",
+        type=str,
+        metavar="REGEX",
+        help="Download only the lectures whose title matches this regular expression, without showing the selection window",
+    )
+    parser.add_argument(
+        "--exclude-title",
+        dest="exclude_title",
+        type=str,
+        metavar="REGEX",
+        help="Skip the lectures whose title matches this regular expression, without showing the selection window",
+    )
+    parser.add_argument(
+        "--select-type",
+        dest="select_type",
+        type=str,
+        help="Download only these lecture types, comma separated (video, article, file, ebook, audio, presentation, quiz, ...), without showing the selection window",
+    )
+    parser.add_argument(
+        "--max-duration",
+        dest="max_duration",
+        type=float,
+        metavar="MINUTES",
+        help="Skip video lectures longer than this many minutes, without showing the selection window",
+    )
+    parser.add_argument(
+        "--select-rules",
+        dest="select_rules",
+        type=str,
+        metavar="FILE",
+        help="JSON file with selection rules (chapters, lectures, title, exclude_title, types, max_duration), used instead of the selection window. Command line options override it",
+    )
+    parser.add_argument(
+        "--export-plan",
+        dest="export_plan",
+        type=str,
+        metavar="FILE",
+        help="Don't download, write the selected lectures (renditions, captions, assets and target paths) to a download plan that workers on several hosts can run with --run-plan",
+    )
+    parser.add_argument(
+        "--plan-shard-size",
+        dest="plan_shard_size",
+        type=int,
+        help="Lectures per shard of an exported plan, the unit workers claim (Default is 1)",
+    )
+    parser.add_argument(
+        "--run-plan",
+        dest="run_plan",
+        type=str,
+        metavar="FILE",
+        help="Work on a download plan: claim its shards one at a time (through <FILE>.claims/ next to it) and download them until none are left",
+    )
+    parser.add_argument(
+        "--worker-id",
+        dest="worker_id",
+        type=str,
+        help="Name of this worker in the shard claims of a plan (Default is <host>-<pid>)",
+    )
+    parser.add_argument(
+        "--retry-failed-shards",
+        dest="retry_failed_shards",
+        action="store_true",
+        help="With --run-plan, also claim shards that failed on a worker before",
+    )
+    parser.add_argument(
+        "--estimate",
+        dest="estimate",
+        type=str,
+        metavar="FILE",
+        help="Don't download, resolve the renditions of the selected lectures (selection rules, or every lecture) and write the estimated download size per chapter, the free disk space and the time it would take to FILE (.json or .csv)",
+    )
+    parser.add_argument(
+        "--cookies",
+        dest="cookie_file",
+        type=str,
+        help="Netscape cookies file to use with '--browser file' (Default is cookies.txt)",
+    )
+    parser.add_argument(
+        "--log-file",
+        dest="log_file",
+        type=str,
+        help="Path of the log file (Default is a new file in logs/)",
+    )
     # parser.add_argument("-v", "--version", action="version", version="You are running version {version}".format(version=__version__))
 
-    args = parser.parse_args()
+    return parser
+
+
+def apply_args(args, parser):
+    """
+    Sets the options from parsed arguments, starting from the defaults (the daemon applies one set per job)
+    """
+    global dl_assets, dl_captions, dl_quizzes, skip_lectures, caption_locale, quality, bearer_token, course_name, keep_vtt, skip_hls, concurrent_downloads, load_from_file, save_to_file, course_url, info, id_as_course_name, use_h265, h265_crf, h265_preset, use_nvenc, browser, is_subscription_course, DOWNLOAD_DIR, use_continuous_lecture_numbers, chapter_filter, lecture_filter, job_manifest_path, transcode_workers, h265_chunk_seconds, h265_min_bitrate, h265_stream, calibrate_dir, calibrate_min_fps, stall_timeout, stall_retries, sync_mode, select_all, cookie_file, selection_rules, export_plan_path, plan_shard_size, run_plan_path, worker_id, retry_failed_shards, estimate_path
+
+    globals().update(OPTION_DEFAULTS)
+    if not args.course_url and not args.calibrate_h265 and not args.run_plan:
+        parser.error("the following arguments are required: -c/--course-url")
     if args.download_assets:
         dl_assets = True
     if args.lang:
@@ -337,20 +682,22 @@ def pre_run():
         h265_preset = args.h265_preset
     if args.use_nvenc:
         use_nvenc = True
-    if args.log_level:
-        if args.log_level.upper() == "DEBUG":
-            LOG_LEVEL = logging.DEBUG
-        elif args.log_level.upper() == "INFO":
-            LOG_LEVEL = logging.INFO
-        elif args.log_level.upper() == "ERROR":
-            LOG_LEVEL = logging.ERROR
-        elif args.log_level.upper() == "WARNING":
-            LOG_LEVEL = logging.WARNING
-        elif args.log_level.upper() == "CRITICAL":
-            LOG_LEVEL = logging.CRITICAL
-        else:
-            print(f"Invalid log level: {args.log_level}; Using INFO")
-            LOG_LEVEL = logging.INFO
+    if args.transcode_workers and args.transcode_workers > 0:
+        transcode_workers = args.transcode_workers
+    if args.h265_chunk_seconds and args.h265_chunk_seconds > 0:
+        h265_chunk_seconds = args.h265_chunk_seconds
+    if args.h265_min_bitrate is not None:
+        h265_min_bitrate = max(0, args.h265_min_bitrate)
+    if args.h265_stream:
+        h265_stream = True
+    if args.stall_timeout is not None:
+        stall_timeout = max(0, args.stall_timeout)
+    if args.stall_retries is not None:
+        stall_retries = max(0, args.stall_retries)
+    if args.calibrate_h265:
+        calibrate_dir = os.path.abspath(args.calibrate_h265)
+    if args.calibrate_min_fps and args.calibrate_min_fps > 0:
+        calibrate_min_fps = args.calibrate_min_fps
     if args.id_as_course_name:
         id_as_course_name = args.id_as_course_name
     if args.is_subscription_course:
@@ -361,6 +708,60 @@ def pre_run():
         DOWNLOAD_DIR = os.path.abspath(args.out)
     if args.use_continuous_lecture_numbers:
         use_continuous_lecture_numbers = args.use_continuous_lecture_numbers
+    if args.job_manifest:
+        job_manifest_path = os.path.abspath(args.job_manifest)
+    if args.sync:
+        sync_mode = True
+    if args.select_all:
+        select_all = True
+    if args.cookie_file:
+        cookie_file = os.path.abspath(args.cookie_file)
+    if args.export_plan:
+        export_plan_path = os.path.abspath(args.export_plan)
+    if args.plan_shard_size and args.plan_shard_size > 0:
+        plan_shard_size = args.plan_shard_size
+    if args.run_plan:
+        run_plan_path = os.path.abspath(args.run_plan)
+    if args.worker_id:
+        worker_id = args.worker_id
+    if args.retry_failed_shards:
+        retry_failed_shards = True
+    if args.estimate:
+        estimate_path = os.path.abspath(args.estimate)
+    rules = {
+        "chapters": args.chapter_filter_raw,
+        "lectures": args.lecture_filter_raw,
+        "title": args.select_title,
+        "exclude_title": args.exclude_title,
+        "types": args.select_type,
+        "max_duration": args.max_duration,
+    }
+    if args.select_rules or any(rules[key] is not None for key in ("title", "exclude_title", "types", "max_duration")):
+        try:
+            if args.select_rules:
+                selection_rules = SelectionRules.from_file(args.select_rules, rules)
+            else:
+                selection_rules = SelectionRules.from_dict(rules)
+        except (OSError, ValueError, re.error) as error:
+            parser.error(f"invalid selection rules: {error}")
+
+    Path(DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
+    Path(SAVED_DIR).mkdir(parents=True, exist_ok=True)
+
+    # Note: Decryption keys are now handled by the GUI interface
+
+    # Process the chapter filter
+    if args.chapter_filter_raw:
+        chapter_filter = parse_chapter_filter(args.chapter_filter_raw)
+        logger.info("Chapter filter applied: %s", sorted(chapter_filter))
+
+    if args.lecture_filter_raw:
+        lecture_filter = parse_lecture_filter(args.lecture_filter_raw)
+        logger.info("Lecture filter applied: %s", sorted(lecture_filter))
+
+
+def setup_logging(log_file: str = None):
+    global logger
 
     # setup a logger
     logger = logging.getLogger(__name__)
@@ -377,7 +778,7 @@ def pre_run():
     stream.setFormatter(console_formatter)
 
     # create a handler for file logging
-    file_handler = logging.FileHandler(LOG_FILE_PATH)
+    file_handler = logging.FileHandler(log_file or LOG_FILE_PATH)
     file_handler.setFormatter(file_formatter)
 
     # construct the logger
@@ -386,21 +787,33 @@ def pre_run():
     logger.addHandler(stream)
     logger.addHandler(file_handler)
 
-    logger.info(f"Output directory set to {DOWNLOAD_DIR}")
 
-    Path(DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
-    Path(SAVED_DIR).mkdir(parents=True, exist_ok=True)
-
-    # Note: Decryption keys are now handled by the GUI interface
+def pre_run():
+    global LOG_LEVEL
 
-    # Process the chapter filter
-    if args.chapter_filter_raw:
-        chapter_filter = parse_chapter_filter(args.chapter_filter_raw)
-        logger.info("Chapter filter applied: %s", sorted(chapter_filter))
+    # make sure the logs directory exists
+    if not os.path.exists(LOG_DIR_PATH):
+        os.makedirs(LOG_DIR_PATH, exist_ok=True)
 
-    if args.lecture_filter_raw:
-        lecture_filter = parse_lecture_filter(args.lecture_filter_raw)
-        logger.info("Lecture filter applied: %s", sorted(lecture_filter))
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    if args.log_level:
+        if args.log_level.upper() == "DEBUG":
+            LOG_LEVEL = logging.DEBUG
+        elif args.log_level.upper() == "INFO":
+            LOG_LEVEL = logging.INFO
+        elif args.log_level.upper() == "ERROR":
+            LOG_LEVEL = logging.ERROR
+        elif args.log_level.upper() == "WARNING":
+            LOG_LEVEL = logging.WARNING
+        elif args.log_level.upper() == "CRITICAL":
+            LOG_LEVEL = logging.CRITICAL
+        else:
+            print(f"Invalid log level: {args.log_level}; Using INFO")
+            LOG_LEVEL = logging.INFO
+    setup_logging(os.path.abspath(args.log_file) if args.log_file else None)
+    apply_args(args, parser)
+    logger.info(f"Output directory set to {DOWNLOAD_DIR}")
 
 
 class Udemy:
@@ -409,6 +822,8 @@ class Udemy:
 
         self.session = None
         self.bearer_token = None
+        # playlists/manifests saved in temp/ younger than this (seconds) are reused instead of fetched
+        self.manifest_max_age = 0
         self.auth = UdemyAuth(cache_session=False)
         if not self.session:
             self.session = self.auth.authenticate(bearer_token=bearer_token)
@@ -438,7 +853,7 @@ class Udemy:
                 cj = browser_cookie3.vivaldi()
             elif browser == "file":
                 # load netscape cookies from file
-                cj = MozillaCookieJar("cookies.txt")
+                cj = MozillaCookieJar(cookie_file or "cookies.txt")
                 cj.load()
 
     def _get_quiz(self, quiz_id):
@@ -492,151 +907,15 @@ class Udemy:
 
         return resp
 
-    def _extract_supplementary_assets(self, supp_assets, lecture_counter):
-        _temp = []
-        for entry in supp_assets:
-            title = sanitize_filename(entry.get("title"))
-            filename = entry.get("filename")
-            download_urls = entry.get("download_urls")
-            external_url = entry.get("external_url")
-            asset_type = entry.get("asset_type").lower()
-            id = entry.get("id")
-            if asset_type == "file":
-                if download_urls and isinstance(download_urls, dict):
-                    extension = filename.rsplit(".", 1)[-1] if "." in filename else ""
-                    download_url = download_urls.get("File", [])[0].get("file")
-                    _temp.append(
-                        {
-                            "type": "file",
-                            "title": title,
-                            "filename": "{0:03d} ".format(lecture_counter) + filename,
-                            "extension": extension,
-                            "download_url": download_url,
-                            "id": id,
-                        }
-                    )
-            elif asset_type == "sourcecode":
-                if download_urls and isinstance(download_urls, dict):
-                    extension = filename.rsplit(".", 1)[-1] if "." in filename else ""
-                    download_url = download_urls.get("SourceCode", [])[0].get("file")
-                    _temp.append(
-                        {
-                            "type": "source_code",
-                            "title": title,
-                            "filename": "{0:03d} ".format(lecture_counter) + filename,
-                            "extension": extension,
-                            "download_url": download_url,
-                            "id": id,
-                        }
-                    )
-            elif asset_type == "externallink":
-                _temp.append(
-                    {
-                        "type": "external_link",
-                        "title": title,
-                        "filename": "{0:03d} ".format(lecture_counter) + filename,
-                        "extension": "txt",
-                        "download_url": external_url,
-                        "id": id,
-                    }
-                )
-        return _temp
-
-    def _extract_article(self, asset, id):
-        return [
-            {
-                "type": "article",
-                "body": asset.get("body"),
-                "extension": "html",
-                "id": id,
-            }
-        ]
-
-    def _extract_ppt(self, asset, lecture_counter):
-        _temp = []
-        download_urls = asset.get("download_urls")
-        filename = asset.get("filename")
-        id = asset.get("id")
-        if download_urls and isinstance(download_urls, dict):
-            extension = filename.rsplit(".", 1)[-1] if "." in filename else ""
-            download_url = download_urls.get("Presentation", [])[0].get("file")
-            _temp.append(
-                {
-                    "type": "presentation",
-                    "filename": "{0:03d} ".format(lecture_counter) + filename,
-                    "extension": extension,
-                    "download_url": download_url,
-                    "id": id,
-                }
-            )
-        return _temp
-
-    def _extract_file(self, asset, lecture_counter):
-        _temp = []
-        download_urls = asset.get("download_urls")
-        filename = asset.get("filename")
-        id = asset.get("id")
-        if download_urls and isinstance(download_urls, dict):
-            extension = filename.rsplit(".", 1)[-1] if "." in filename else ""
-            download_url = download_urls.get("File", [])[0].get("file")
-            _temp.append(
-                {
-                    "type": "file",
-                    "filename": "{0:03d} ".format(lecture_counter) + filename,
-                    "extension": extension,
-                    "download_url": download_url,
-                    "id": id,
-                }
-            )
-        return _temp
-
-    def _extract_ebook(self, asset, lecture_counter):
-        _temp = []
-        download_urls = asset.get("download_urls")
-        filename = asset.get("filename")
-        id = asset.get("id")
-        if download_urls and isinstance(download_urls, dict):
-            extension = filename.rsplit(".", 1)[-1] if "." in filename else ""
-            download_url = download_urls.get("E-Book", [])[0].get("file")
-            _temp.append(
-                {
-                    "type": "ebook",
-                    "filename": "{0:03d} ".format(lecture_counter) + filename,
-                    "extension": extension,
-                    "download_url": download_url,
-                    "id": id,
-                }
-            )
-        return _temp
-
-    def _extract_audio(self, asset, lecture_counter):
-        _temp = []
-        download_urls = asset.get("download_urls")
-        filename = asset.get("filename")
-        id = asset.get("id")
-        if download_urls and isinstance(download_urls, dict):
-            extension = filename.rsplit(".", 1)[-1] if "." in filename else ""
-            download_url = download_urls.get("Audio", [])[0].get("file")
-            _temp.append(
-                {
-                    "type": "audio",
-                    "filename": "{0:03d} ".format(lecture_counter) + filename,
-                    "extension": extension,
-                    "download_url": download_url,
-                    "id": id,
-                }
-            )
-        return _temp
-
-    def _extract_sources(self, sources, skip_hls):
+    def _extract_sources(self, sources: list, skip_hls):
         _temp = []
         if sources and isinstance(sources, list):
             for source in sources:
-                label = source.get("label")
-                download_url = source.get("file")
+                label = source.label
+                download_url = source.url
                 if not download_url:
                     continue
-                if label.lower() == "audio":
+                if (label or "").lower() == "audio":
                     continue
                 height = label if label else None
                 if height == "2160":
@@ -655,13 +934,13 @@ class Udemy:
                     width = "426"
                 else:
                     width = "256"
-                if source.get("type") == "application/x-mpegURL" or "m3u8" in download_url:
+                if source.type == "application/x-mpegURL" or "m3u8" in download_url:
                     if not skip_hls:
                         out = self._extract_m3u8(download_url)
                         if out:
                             _temp.extend(out)
                 else:
-                    _type = source.get("type")
+                    _type = source.type or ""
                     _temp.append(
                         {
                             "type": "video",
@@ -673,12 +952,12 @@ class Udemy:
                     )
         return _temp
 
-    def _extract_media_sources(self, sources):
+    def _extract_media_sources(self, sources: list):
         _temp = []
         if sources and isinstance(sources, list):
             for source in sources:
-                _type = source.get("type")
-                src = source.get("src")
+                _type = source.type
+                src = source.url
 
                 if _type == "application/dash+xml":
                     out = self._extract_mpd(src)
@@ -686,34 +965,30 @@ class Udemy:
                         _temp.extend(out)
         return _temp
 
-    def _extract_subtitles(self, tracks):
+    def _extract_subtitles(self, captions: list):
         _temp = []
-        if tracks and isinstance(tracks, list):
-            for track in tracks:
-                if not isinstance(track, dict):
-                    continue
-                if track.get("_class") != "caption":
-                    continue
-                download_url = track.get("url")
-                if not download_url or not isinstance(download_url, str):
-                    continue
-                lang = (
-                    track.get("language")
-                    or track.get("srclang")
-                    or track.get("label")
-                    or track["locale_id"].split("_")[0]
-                )
-                ext = "vtt" if "vtt" in download_url.rsplit(".", 1)[-1] else "srt"
-                _temp.append(
-                    {
-                        "type": "subtitle",
-                        "language": lang,
-                        "extension": ext,
-                        "download_url": download_url,
-                    }
-                )
+        for caption in captions or []:
+            if not caption.url:
+                continue
+            _temp.append(
+                {
+                    "type": "subtitle",
+                    "language": caption.language,
+                    "extension": caption.extension,
+                    "download_url": caption.url,
+                }
+            )
         return _temp
 
+    def _cached_manifest(self, path: Path):
+        """
+        True when a playlist/manifest saved by an earlier extraction is recent enough to reuse
+        """
+        if not self.manifest_max_age or not path.is_file():
+            return False
+        stat = path.stat()
+        return stat.st_size > 0 and time.time() - stat.st_mtime < self.manifest_max_age
+
     def _extract_m3u8(self, url):
         """extracts m3u8 streams"""
         asset_id_re = re.compile(r"assets/(?P<id>\d+)/")
@@ -724,6 +999,7 @@ class Udemy:
 
         # ensure the folder exists
         temp_path.mkdir(parents=True, exist_ok=True)
+        record_output("temp_dir", str(temp_path))
 
         # # extract the asset id from the url
         asset_id = asset_id_re.search(url).group("id")
@@ -731,13 +1007,17 @@ class Udemy:
         m3u8_path = Path(temp_path, f"index_{asset_id}.m3u8")
 
         try:
-            r = self.session._get(url)
-            r.raise_for_status()
-            raw_data = r.text
+            if self._cached_manifest(m3u8_path):
+                with open(m3u8_path, "r") as f:
+                    raw_data = f.read()
+            else:
+                r = self.session._get(url)
+                r.raise_for_status()
+                raw_data = r.text
 
-            # write to temp file for later
-            with open(m3u8_path, "w") as f:
-                f.write(r.text)
+                # write to temp file for later
+                with open(m3u8_path, "w") as f:
+                    f.write(r.text)
 
             m3u8_object = m3u8.loads(raw_data)
             playlists = m3u8_object.playlists
@@ -758,10 +1038,11 @@ class Udemy:
                 # we need to save the individual playlists to disk also
                 playlist_path = Path(temp_path, f"index_{asset_id}_{width}x{height}.m3u8")
 
-                with open(playlist_path, "w") as f:
-                    r = self.session._get(pl.uri)
-                    r.raise_for_status()
-                    f.write(r.text)
+                if not self._cached_manifest(playlist_path):
+                    with open(playlist_path, "w") as f:
+                        r = self.session._get(pl.uri)
+                        r.raise_for_status()
+                        f.write(r.text)
 
                 seen.add(height)
                 _temp.append(
@@ -771,6 +1052,9 @@ class Udemy:
                         "width": width,
                         "extension": "mp4",
                         "download_url": playlist_path.as_uri(),
+                        "codecs": codecs,
+                        "bandwidth": pl.stream_info.average_bandwidth or pl.stream_info.bandwidth,
+                        "playlist_url": pl.absolute_uri,
                     }
                 )
         except Exception as error:
@@ -787,6 +1071,7 @@ class Udemy:
 
         # ensure the folder exists
         temp_path.mkdir(parents=True, exist_ok=True)
+        record_output("temp_dir", str(temp_path))
 
         # # extract the asset id from the url
         asset_id = asset_id_re.search(url).group("id")
@@ -795,10 +1080,11 @@ class Udemy:
         mpd_path = Path(temp_path, f"index_{asset_id}.mpd")
 
         try:
-            with open(mpd_path, "wb") as f:
-                r = self.session._get(url)
-                r.raise_for_status()
-                f.write(r.content)
+            if not self._cached_manifest(mpd_path):
+                with open(mpd_path, "wb") as f:
+                    r = self.session._get(url)
+                    r.raise_for_status()
+                    f.write(r.content)
 
             ytdl = yt_dlp.YoutubeDL(
                 {"quiet": True, "no_warnings": True, "allow_unplayable_formats": True, "enable_file_urls": True}
@@ -884,40 +1170,58 @@ class Udemy:
         else:
             return resp
 
+    def _fetch_curriculum_page(self, url, page):
+        """
+        Fetches one page of the curriculum, backing off between attempts. Exits when the page can't be
+        fetched; the pages fetched so far are kept, so the next run resumes from this one.
+        """
+        params = {**CURRICULUM_ITEMS_PARAMS, "page": page}
+        for attempt in range(CURRICULUM_PAGE_RETRIES):
+            try:
+                resp = self.session._get(url, params)
+                if resp is not None and resp.ok:
+                    return resp.json()
+                reason = f"{resp.status_code} {resp.reason}" if resp is not None else "no response"
+            except (requests.RequestException, ValueError) as error:
+                # timeouts, broken chunked responses and redirect loops are as transient as refused connections
+                reason = str(error)
+            delay = min(CURRICULUM_BACKOFF_MAX, 2**attempt)
+            logger.error(f"Failed to fetch curriculum page {page} ({reason}), retrying in {delay}s...")
+            time.sleep(delay)
+        logger.fatal(f"Couldn't fetch curriculum page {page}, run again to resume from it")
+        sys.exit(1)
+
     def _extract_course_curriculum(self, url, course_id, portal_name):
         self.session._headers.update({"Referer": url})
         url = CURRICULUM_ITEMS_URL.format(portal_name=portal_name, course_id=course_id)
+        checkpoint = CurriculumCheckpoint(SAVED_DIR, course_id)
+        page_size = int(CURRICULUM_ITEMS_PARAMS["page_size"])
+
+        data = checkpoint.load(1)
+        if data is None:
+            data = self._fetch_curriculum_page(url, 1)
+        est_page_count = checkpoint.open(data.get("count") or 0, page_size)
+        checkpoint.save(1, data)
+        saved_pages = checkpoint.saved_pages()
+        if len(saved_pages) > 1:
+            logger.info(f"> Resuming course curriculum download ({len(saved_pages)}/{est_page_count} pages saved)")
+
+        _next = data.get("next")
         page = 1
-        try:
-            data = self.session._get(url, CURRICULUM_ITEMS_PARAMS).json()
-        except conn_error as error:
-            logger.fatal(f"Connection error: {error}")
-            time.sleep(0.8)
-            sys.exit(1)
-        else:
-            _next = data.get("next")
-            _count = data.get("count")
-            est_page_count = math.ceil(_count / 100)  # 100 is the max results per page
-            while _next:
-                logger.info(f"> Downloading course curriculum.. (Page {page + 1}/{est_page_count})")
-                try:
-                    resp = self.session._get(_next)
-                    if not resp.ok:
-                        logger.error(f"Failed to fetch a page, will retry")
-                        continue
-                    resp = resp.json()
-                except conn_error as error:
-                    logger.fatal(f"Connection error: {error}")
-                    time.sleep(0.8)
-                    sys.exit(1)
-                else:
-                    _next = resp.get("next")
-                    results = resp.get("results")
-                    if results and isinstance(results, list):
-                        for d in resp["results"]:
-                            data["results"].append(d)
-                        page = page + 1
-            return data
+        while _next and page < est_page_count:
+            page = page + 1
+            resp = checkpoint.load(page)
+            if resp is None:
+                logger.info(f"> Downloading course curriculum.. (Page {page}/{est_page_count})")
+                resp = self._fetch_curriculum_page(url, page)
+                checkpoint.save(page, resp)
+            _next = resp.get("next")
+            results = resp.get("results")
+            if results and isinstance(results, list):
+                data["results"].extend(results)
+        # complete, a new fetch should see the current curriculum
+        checkpoint.clear()
+        return data
 
     def _extract_course(self, response, course_name):
         _temp = {}
@@ -1060,122 +1364,57 @@ class Udemy:
             )
             sys.exit(1)
 
-    def _parse_lecture(self, lecture: dict):
-        retVal = []
-
-        index = lecture.get("index")  # this is lecture_counter
-        lecture_data = lecture.get("data")
-        asset = lecture_data.get("asset")
-        supp_assets = lecture_data.get("supplementary_assets")
-
-        if isinstance(asset, dict):
-            asset_type = asset.get("asset_type").lower() or asset.get("assetType").lower()
-            if asset_type == "article":
-                retVal.extend(self._extract_article(asset, index))
-            elif asset_type == "video":
-                pass
-            elif asset_type == "e-book":
-                retVal.extend(self._extract_ebook(asset, index))
-            elif asset_type == "file":
-                retVal.extend(self._extract_file(asset, index))
-            elif asset_type == "presentation":
-                retVal.extend(self._extract_ppt(asset, index))
-            elif asset_type == "audio":
-                retVal.extend(self._extract_audio(asset, index))
-            else:
-                logger.warning(f"Unknown asset type: {asset_type}")
-
-            if isinstance(supp_assets, list) and len(supp_assets) > 0:
-                retVal.extend(self._extract_supplementary_assets(supp_assets, index))
-
-        if asset != None:
-            stream_urls = asset.get("stream_urls")
-            if stream_urls != None:
-                # not encrypted
-                if stream_urls and isinstance(stream_urls, dict):
-                    sources = stream_urls.get("Video")
-                    tracks = asset.get("captions")
-                    # duration = asset.get("time_estimation")
-                    sources = self._extract_sources(sources, skip_hls)
-                    subtitles = self._extract_subtitles(tracks)
-                    sources_count = len(sources)
-                    subtitle_count = len(subtitles)
-                    lecture.pop("data")  # remove the raw data object after processing
-                    lecture = {
-                        **lecture,
-                        "assets": retVal,
-                        "assets_count": len(retVal),
-                        "sources": sources,
-                        "subtitles": subtitles,
-                        "subtitle_count": subtitle_count,
-                        "sources_count": sources_count,
-                        "is_encrypted": False,
-                        "asset_id": asset.get("id"),
-                        "type": asset.get("asset_type"),
-                    }
-                else:
-                    lecture.pop("data")  # remove the raw data object after processing
-                    lecture = {
-                        **lecture,
-                        "html_content": asset.get("body"),
-                        "extension": "html",
-                        "assets": retVal,
-                        "assets_count": len(retVal),
-                        "subtitle_count": 0,
-                        "sources_count": 0,
-                        "is_encrypted": False,
-                        "asset_id": asset.get("id"),
-                        "type": asset.get("asset_type"),
-                    }
-            else:
-                # encrypted
-                media_sources = asset.get("media_sources")
-                if media_sources and isinstance(media_sources, list):
-                    sources = self._extract_media_sources(media_sources)
-                    tracks = asset.get("captions")
-                    # duration = asset.get("time_estimation")
-                    subtitles = self._extract_subtitles(tracks)
-                    sources_count = len(sources)
-                    subtitle_count = len(subtitles)
-                    lecture.pop("data")  # remove the raw data object after processing
-                    lecture = {
-                        **lecture,
-                        # "duration": duration,
-                        "assets": retVal,
-                        "assets_count": len(retVal),
-                        "video_sources": sources,
-                        "subtitles": subtitles,
-                        "subtitle_count": subtitle_count,
-                        "sources_count": sources_count,
-                        "is_encrypted": True,
-                        "asset_id": asset.get("id"),
-                        "type": asset.get("asset_type"),
-                    }
+    def _parse_lecture(self, lecture: Lecture, resolve_sources=True):
+        """
+        The lecture as download_lecture takes it. With resolve_sources False the video playlists/manifests aren't
+        fetched (for lectures already on disk), captions and assets are still listed.
+        """
+        assets = lecture.download_assets()
+        parsed_lecture = {
+            "index": lecture.index,  # this is lecture_counter
+            "lecture_index": lecture.lecture_index,
+            "lecture_title": lecture.lecture_title,
+            "_class": lecture.clazz,
+            "id": lecture.id,
+            "assets": assets,
+            "assets_count": len(assets),
+        }
 
-                else:
-                    lecture.pop("data")  # remove the raw data object after processing
-                    lecture = {
-                        **lecture,
-                        "html_content": asset.get("body"),
-                        "extension": "html",
-                        "assets": retVal,
-                        "assets_count": len(retVal),
-                        "subtitle_count": 0,
-                        "sources_count": 0,
-                        "is_encrypted": False,
-                        "asset_id": asset.get("id"),
-                        "type": asset.get("asset_type"),
-                    }
+        if lecture.media is None:
+            parsed_lecture.update({"asset_id": lecture.id, "type": lecture.type})
+        elif lecture.media == "html":
+            parsed_lecture.update(
+                {
+                    "html_content": lecture.body,
+                    "extension": "html",
+                    "subtitle_count": 0,
+                    "sources_count": 0,
+                    "is_encrypted": False,
+                    "asset_id": lecture.asset_id,
+                    "type": lecture.asset_type,
+                }
+            )
         else:
-            lecture = {
-                **lecture,
-                "assets": retVal,
-                "assets_count": len(retVal),
-                "asset_id": lecture_data.get("id"),
-                "type": lecture_data.get("type"),
-            }
-
-        return lecture
+            is_encrypted = lecture.media == "drm"
+            if not resolve_sources:
+                sources = []
+            elif is_encrypted:
+                sources = self._extract_media_sources(lecture.sources)
+            else:
+                sources = self._extract_sources(lecture.sources, skip_hls)
+            subtitles = self._extract_subtitles(lecture.captions)
+            parsed_lecture.update(
+                {
+                    "video_sources" if is_encrypted else "sources": sources,
+                    "subtitles": subtitles,
+                    "subtitle_count": len(subtitles),
+                    "sources_count": len(sources),
+                    "is_encrypted": is_encrypted,
+                    "asset_id": lecture.asset_id,
+                    "type": lecture.asset_type,
+                }
+            )
+        return parsed_lecture
 
 
 class Session(object):
@@ -1257,118 +1496,270 @@ def durationtoseconds(period):
 
 
 def mux_process(video_filepath: str, audio_filepath: str, video_title: str, output_path: str):
-    codec = "hevc_nvenc" if use_nvenc else "libx265"
-    transcode = "-hwaccel cuda -hwaccel_output_format cuda" if use_nvenc else ""
-
-    if os.name == "nt":
-        if use_h265:
-            command = f'ffmpeg {transcode} -y -i "{video_filepath}" -i "{audio_filepath}" -c:v {codec} -vtag hvc1 -crf {h265_crf} -preset {h265_preset} -c:a copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" "{output_path}"'
-        else:
-            command = f'ffmpeg -y -i "{video_filepath}" -i "{audio_filepath}" -c copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" "{output_path}"'
+    if use_h265 and transcode_queue and transcode_queue.chunk_seconds:
+        return mux_process_chunked(video_filepath, audio_filepath, video_title, output_path)
+
+    nice = ["nice", "-n", "7"] if os.name != "nt" else []
+    if use_h265:
+        hwaccel = ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"] if use_nvenc else []
+        codec = "hevc_nvenc" if use_nvenc else "libx265"
+        codec_args = ["-c:v", codec, "-vtag", "hvc1", "-crf", str(h265_crf), "-preset", h265_preset, "-c:a", "copy"]
     else:
-        if use_h265:
-            command = f'nice -n 7 ffmpeg {transcode} -y -i "{video_filepath}" -i "{audio_filepath}" -c:v {codec} -vtag hvc1 -crf {h265_crf} -preset {h265_preset} -c:a copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" "{output_path}"'
-        else:
-            command = f'nice -n 7 ffmpeg -y -i "{video_filepath}" -i "{audio_filepath}" -c copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" "{output_path}"'
+        hwaccel = []
+        codec_args = ["-c", "copy"]
+    command = [
+        *nice,
+        "ffmpeg",
+        *hwaccel,
+        "-y",
+        "-i",
+        video_filepath,
+        "-i",
+        audio_filepath,
+        *codec_args,
+        "-fflags",
+        "+bitexact",
+        "-shortest",
+        "-map_metadata",
+        "-1",
+        "-metadata",
+        f"title={video_title}",
+        output_path,
+    ]
+    result = run_with_retries(command, **watched("ffmpeg", output_path, watch_path=output_path))
+    if not result.ok:
+        raise Exception(f"Muxing failed: {result.describe()}")
 
-    process = subprocess.Popen(command, shell=True)
-    log_subprocess_output("FFMPEG-STDOUT", process.stdout)
-    log_subprocess_output("FFMPEG-STDERR", process.stderr)
-    ret_code = process.wait()
-    if ret_code != 0:
-        raise Exception("Muxing returned a non-zero exit code")
+    return result.returncode
 
-    return ret_code
 
+def mux_process_chunked(video_filepath: str, audio_filepath: str, video_title: str, output_path: str):
+    """
+    Muxes without re-encoding, then encodes the video in parallel keyframe-aligned chunks
+    """
+    muxed_path = output_path + ".muxed.mp4"
+    nice = ["nice", "-n", "7"] if os.name != "nt" else []
+    command = [
+        *nice,
+        "ffmpeg",
+        "-y",
+        "-i",
+        video_filepath,
+        "-i",
+        audio_filepath,
+        "-c",
+        "copy",
+        "-fflags",
+        "+bitexact",
+        "-shortest",
+        "-map_metadata",
+        "-1",
+        "-metadata",
+        f"title={video_title}",
+        muxed_path,
+    ]
+    result = run_with_retries(command, **watched("ffmpeg", output_path, watch_path=muxed_path))
+    if not result.ok:
+        raise Exception(f"Muxing failed: {result.describe()}")
+
+    try:
+        if transcode_queue.encode(muxed_path, output_path, video_title) is None:
+            raise Exception("Encoding returned a non-zero exit code")
+    finally:
+        if os.path.exists(muxed_path):
+            os.unlink(muxed_path)
+    return 0
 
-def handle_segments(url, format_id, lecture_id, chapter_dir):
-    os.chdir(os.path.join(chapter_dir))
 
+def encrypted_track_paths(lecture_id: str, chapter_dir: str):
+    return [os.path.join(chapter_dir, f"{lecture_id}.encrypted.{ext}") for ext in ("mp4", "m4a")]
+
+
+def record_encrypted_tracks(lecture_id: str, chapter_dir: str):
+    """
+    Records the downloaded encrypted tracks of a DRM lecture for the GUI, returns True if both are there
+    """
+    found = 0
+    for track_path in encrypted_track_paths(lecture_id, chapter_dir):
+        if os.path.isfile(track_path):
+            record_output("encrypted_track", track_path, lecture_id=lecture_id)
+            track_id = f"{lecture_id}:{track_path.rsplit('.', 1)[-1]}"
+            if job_store and not job_store.is_complete("track", track_id, track_path):
+                job_update("track", track_id, "complete", path=track_path, lecture_id=lecture_id)
+            found += 1
+    return found == 2
+
+
+def existing_lecture_output(lecture_id, lecture_title: str, asset_type: str, chapter_dir: str):
+    """
+    Checks from the curriculum alone (no network) whether a video lecture is already on disk.
+    Returns "complete" when its final video exists (under main.py's or the GUI's combine naming),
+    "tracks" when the encrypted tracks of a DRM lecture are fully downloaded but not combined yet, None otherwise.
+    The job store decides when it knows the lecture ("incomplete" for interrupted downloads, whose partial file
+    may exist); the file checks are for lectures downloaded before it existed.
+    """
+    lecture_id = str(lecture_id)
+    stored = job_store.get("lecture", lecture_id) if job_store else None
+    if stored:
+        if stored["status"] == "complete" and job_store.file_matches(stored):
+            return "complete"
+        tracks = [job_store.get("track", f"{lecture_id}:{ext}") for ext in ("mp4", "m4a")]
+        if stored["status"] in ("downloaded", "decrypted") and all(
+            track and track["status"] == "complete" and job_store.file_matches(track) for track in tracks
+        ):
+            return "tracks"
+        return "incomplete"
+
+    if (asset_type or "").lower() != "video":
+        return None
+    final_names = {deEmojify(sanitize_filename(lecture_title + ".mp4")), sanitize_filename(lecture_title) + ".mp4"}
+    if any(os.path.isfile(os.path.join(chapter_dir, name)) for name in final_names):
+        return "complete"
+    tracks = encrypted_track_paths(lecture_id, chapter_dir)
+    # yt-dlp/aria2c leave these next to a track until it's complete
+    leftovers = [track + suffix for track in tracks for suffix in (".part", ".aria2", ".ytdl")]
+    if all(os.path.isfile(track) for track in tracks) and not any(os.path.exists(path) for path in leftovers):
+        return "tracks"
+    return None
+
+
+def retire_changed_lecture(lecture_id: str, parts: set, previous: dict, course_dir: str):
+    """
+    Sync: moves the outputs of the changed parts of a lecture aside and marks them pending in the job store,
+    so they're downloaded again instead of being skipped as complete
+    """
+    kinds = {"media": ["lecture", "track"], "captions": ["caption"], "assets": ["asset"]}
+    paths = []
+    if job_store:
+        paths += job_store.reset(lecture_id, [kind for part in parts for kind in kinds[part]])
+    if "media" in parts:
+        # lectures downloaded before the job store existed, under their previous name
+        old_chapter_dir = os.path.join(course_dir, previous.get("chapter") or "")
+        old_title = previous.get("title") or ""
+        paths += [
+            os.path.join(old_chapter_dir, name)
+            for name in (deEmojify(sanitize_filename(old_title + ".mp4")), sanitize_filename(old_title) + ".mp4")
+        ]
+        paths += encrypted_track_paths(lecture_id, old_chapter_dir)
+        job_update("lecture", lecture_id, "pending", lecture_id=lecture_id)
+    for path in retire_files(sorted(set(paths)), course_dir):
+        logger.info(f"      > Moved the previous version to {path}")
+
+
+def report_sync_diff(diff, old_snapshot: dict, new_snapshot: dict):
+    old_lectures = (old_snapshot or {}).get("lectures", {})
+    new_lectures = new_snapshot.get("lectures", {})
+    if old_snapshot is None:
+        logger.info(f"> First sync of this course, all {len(diff.added)} lecture(s) are scheduled")
+        return
+    logger.info(
+        f"> Sync: {len(diff.added)} added, {len(diff.changed)} changed, {len(diff.removed)} removed, "
+        f"{len(diff.unchanged)} unchanged lecture(s) since {old_snapshot.get('synced_at')}"
+    )
+    for lecture_id in diff.added:
+        logger.info(f"  + {new_lectures[lecture_id]['title']}")
+    for lecture_id, parts in diff.changed.items():
+        logger.info(f"  ~ {new_lectures[lecture_id]['title']} ({', '.join(sorted(parts))})")
+    for lecture_id, (old_title, new_title) in diff.renamed.items():
+        if lecture_id not in diff.changed:
+            logger.info(f"  > {old_title} is now {new_title} (content unchanged, not downloaded again)")
+    for lecture_id in diff.removed:
+        entry = old_lectures[lecture_id]
+        # local copies are kept, the course just doesn't have them anymore
+        logger.warning(f"  - {entry.get('chapter')}/{entry.get('title')} was removed from the course")
+        for row in job_store.items() if job_store else []:
+            if row["lecture_id"] == lecture_id and row["path"]:
+                record_output("removed", row["path"], lecture_id=lecture_id)
+
+
+def split_fragment_budget(budget: int, tracks: int):
+    """
+    Splits the --concurrent-downloads fragment budget between the tracks of a lecture, the video track first.
+    Audio fragments are as many as the video ones but a fraction of the size, a quarter of the budget keeps up.
+    """
+    if tracks <= 1:
+        return [budget]
+    audio = max(1, budget // (4 * (tracks - 1)))
+    return [max(1, budget - audio * (tracks - 1))] + [audio] * (tracks - 1)
+
+
+def handle_segments(url, format_id, lecture_id, chapter_dir):
     video_filepath_enc = lecture_id + ".encrypted.mp4"
     audio_filepath_enc = lecture_id + ".encrypted.m4a"
 
-    logger.info("> Downloading Lecture Tracks...")
-    args = [
-        "yt-dlp",
-        "--enable-file-urls",
-        "--force-generic-extractor",
-        "--allow-unplayable-formats",
-        "--concurrent-fragments",
-        f"{concurrent_downloads}",
-        "--downloader",
-        "aria2c",
-        "--downloader-args",
-        'aria2c:"--disable-ipv6"',
-        "--fixup",
-        "never",
-        "-k",
-        "-o",
-        f"{lecture_id}.encrypted.%(ext)s",
-        "-f",
-        format_id,
-        f"{url}",
-    ]
-    process = subprocess.Popen(args)
-    log_subprocess_output("YTDLP-STDOUT", process.stdout)
-    log_subprocess_output("YTDLP-STDERR", process.stderr)
-    ret_code = process.wait()
+    # "video,audio": one yt-dlp per track so the audio doesn't wait for the video to finish
+    format_ids = [f for f in format_id.split(",") if f] or [format_id]
+    budgets = split_fragment_budget(concurrent_downloads, len(format_ids))
+    progress = CombinedProgress(log_progress("Lecture tracks"))
+
+    def download_track(track_format_id, fragments):
+        args = [
+            "yt-dlp",
+            "--enable-file-urls",
+            "--force-generic-extractor",
+            "--allow-unplayable-formats",
+            "--concurrent-fragments",
+            f"{fragments}",
+            "--downloader",
+            "aria2c",
+            "--downloader-args",
+            'aria2c:"--disable-ipv6"',
+            "--fixup",
+            "never",
+            "--newline",
+            "-k",
+            "-o",
+            f"{lecture_id}.encrypted.%(ext)s",
+            "-f",
+            track_format_id,
+            f"{url}",
+        ]
+        return run_with_retries(
+            args,
+            parser=DownloadProgressParser(),
+            on_progress=progress.track(track_format_id),
+            # the output name is relative to the chapter; the process cwd is shared by every thread
+            cwd=chapter_dir,
+            **watched("yt-dlp", os.path.join(chapter_dir, f"{lecture_id}.encrypted [{track_format_id}]")),
+        )
+
+    logger.info(f"> Downloading {len(format_ids)} Lecture Track(s)...")
+    with ThreadPoolExecutor(max_workers=len(format_ids), thread_name_prefix="track") as executor:
+        futures = [executor.submit(download_track, f, n) for f, n in zip(format_ids, budgets)]
+        results = [future.result() for future in futures]
     logger.info("> Lecture Tracks Downloaded")
 
-    if ret_code != 0:
-        logger.warning("Return code from the downloader was non-0 (error), skipping!")
-        return
+    failed = [(f, r) for f, r in zip(format_ids, results) if not r.ok]
+    if failed:
+        for track_format_id, result in failed:
+            logger.warning(f"The downloader failed for track {track_format_id} ({result.describe()}), skipping!")
+        return False
 
     # No decryption or muxing here, just download the encrypted files.
     # The KIDs and keys are no longer needed here.
     # Decryption and combining will be handled by gui.py's functions.
 
-    os.chdir(HOME_DIR)
+    record_encrypted_tracks(lecture_id, chapter_dir)
+
     # if the url is a file url, we need to remove the file after we're done with it
     if url.startswith("file://"):
         try:
             os.unlink(url[7:])
         except:
             pass
-    return # No return code needed here as we are not decrypting/muxing
+    return True  # tracks are complete and ready for decryption/muxing
 
 
 def check_for_aria():
-    try:
-        subprocess.Popen(["aria2c", "-v"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).wait()
-        return True
-    except FileNotFoundError:
-        return False
-    except Exception:
-        logger.exception(
-            "> Unexpected exception while checking for Aria2c, please tell the program author about this! "
-        )
-        return True
+    return not run(["aria2c", "-v"], timeout=30).not_found
 
 
 def check_for_ffmpeg():
-    try:
-        subprocess.Popen(["ffmpeg"], stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL).wait()
-        return True
-    except FileNotFoundError:
-        return False
-    except Exception:
-        logger.exception(
-            "> Unexpected exception while checking for FFMPEG, please tell the program author about this! "
-        )
-        return True
+    return not run(["ffmpeg"], timeout=30).not_found
 
 
 def check_for_shaka():
-    try:
-        subprocess.Popen(["shaka-packager", "-version"], stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL).wait()
-        return True
-    except FileNotFoundError:
-        return False
-    except Exception:
-        logger.exception(
-            "> Unexpected exception while checking for shaka-packager, please tell the program author about this! "
-        )
-        return True
+    return not run(["shaka-packager", "-version"], timeout=30).not_found
 
 
 def download(url, path, filename):
@@ -1415,13 +1806,15 @@ def download_aria(url, file_dir, filename):
         "--disable-ipv6",
         "--follow-torrent=false",
     ]
-    process = subprocess.Popen(args)
-    log_subprocess_output("ARIA2-STDOUT", process.stdout)
-    log_subprocess_output("ARIA2-STDERR", process.stderr)
-    ret_code = process.wait()
-    if ret_code != 0:
-        raise Exception("Return code from the downloader was non-0 (error)")
-    return ret_code
+    result = run_with_retries(
+        args,
+        parser=DownloadProgressParser("aria2c"),
+        on_progress=log_progress(filename),
+        **watched("aria2c", os.path.join(file_dir, filename)),
+    )
+    if not result.ok:
+        raise Exception(f"The downloader failed: {result.describe()}")
+    return result.returncode
 
 
 def process_caption(caption, lecture_id, lecture_title, lecture_dir, tries=0):
@@ -1430,21 +1823,33 @@ def process_caption(caption, lecture_id, lecture_title, lecture_dir, tries=0):
     filename = f"%s_%s.%s" % (sanitized_lecture_title, caption.get("language"), caption.get("extension"))
     filename_no_ext = f"%s_%s" % (sanitized_lecture_title, caption.get("language"))
     filepath = os.path.join(lecture_dir, filename)
+    caption_id = f"{lecture_id}:{caption.get('language')}"
 
-    if os.path.isfile(filepath):
+    stored = job_store.get("caption", caption_id) if job_store else None
+    if stored and job_store.is_complete("caption", caption_id):
+        # converted captions are only kept as .srt, so the .vtt check below would download them again
+        logger.info("    > Caption '%s' already downloaded." % os.path.basename(stored["path"]))
+        record_output("caption", stored["path"], lecture_id=lecture_id)
+        return
+    if os.path.isfile(filepath) and stored is None:
         logger.info("    > Caption '%s' already downloaded." % filename)
+        record_output("caption", filepath, lecture_id=lecture_id)
     else:
         logger.info(f"    >  Downloading caption: '%s'" % filename)
+        job_update("caption", caption_id, "downloading", lecture_id=lecture_id, rendition=caption.get("extension"))
         try:
             ret_code = download_aria(caption.get("download_url"), lecture_dir, filename)
             logger.debug(f"      > Download return code: {ret_code}")
+            record_output("caption", filepath, lecture_id=lecture_id)
         except Exception as e:
             error_message = str(e)
             if "status=403" in error_message or "Forbidden" in error_message:
                 logger.error(f"    > Error downloading caption: {e}. Access denied (403 Forbidden), skipping further retries.")
+                job_update("caption", caption_id, "failed", error=error_message)
                 return
             elif tries >= 3:
                 logger.error(f"    > Error downloading caption: {e}. Exceeded retries, skipping.")
+                job_update("caption", caption_id, "failed", error=error_message)
                 return
             else:
                 logger.error(f"    > Error downloading caption: {e}. Will retry {3-tries} more times.")
@@ -1454,13 +1859,54 @@ def process_caption(caption, lecture_id, lecture_title, lecture_dir, tries=0):
                 logger.info("    > Converting caption to SRT format...")
                 convert(lecture_dir, filename_no_ext)
                 logger.info("    > Caption conversion complete.")
+                srt_path = os.path.join(lecture_dir, filename_no_ext + ".srt")
+                record_output("caption", srt_path, lecture_id=lecture_id)
+                job_update("caption", caption_id, "complete", path=srt_path, checksum=True)
                 if not keep_vtt:
                     os.remove(filepath)
-            except Exception:
+            except Exception as e:
                 logger.exception(f"    > Error converting caption")
+                job_update("caption", caption_id, "failed", error=f"conversion failed: {e}")
+        elif os.path.isfile(filepath):
+            job_update("caption", caption_id, "complete", path=filepath, checksum=True)
+
+
+def stream_hls_lecture(source, lecture_path, lecture_title):
+    """
+    Downloads an HLS lecture straight into the H.265 encoder, writing only the encoded file.
+    Returns False when the lecture should be downloaded the regular way instead.
+    """
+    if not source.get("codecs") or not source.get("bandwidth"):
+        # can't tell without the file whether a re-encode is worth it
+        return False
+    if transcode_queue.skip_reason(None, source.get("codecs"), source.get("bandwidth")):
+        return False
+    try:
+        init_url, segment_urls, duration = load_media_playlist(source.get("download_url"), source.get("playlist_url"))
+    except StreamUnsupported as error:
+        logger.info(f"      > Can't stream this lecture into the encoder ({error}), downloading it first")
+        return False
+    except Exception:
+        logger.exception("      > Error reading the HLS playlist, downloading the lecture first")
+        return False
+
+    logger.info(f"      > Downloading {len(segment_urls)} segment(s) straight into the H.265 encoder")
+    if transcode_queue.encode_stream(
+        stream_chunks(init_url, segment_urls, concurrent_downloads),
+        lecture_path,
+        lecture_title,
+        input_format=input_format(init_url),
+        duration=duration,
+    ):
+        return True
+    logger.warning("      > Streaming encode failed, downloading the lecture first")
+    return False
 
 
 def process_lecture(lecture, lecture_path, chapter_dir):
+    """
+    Downloads a lecture, returns True when the encrypted tracks of a DRM lecture are ready for post-processing
+    """
     lecture_id = lecture.get("id")
     lecture_title = lecture.get("lecture_title")
     is_encrypted = lecture.get("is_encrypted")
@@ -1472,12 +1918,19 @@ def process_lecture(lecture, lecture_path, chapter_dir):
             if isinstance(quality, int):
                 source = min(lecture_sources, key=lambda x: abs(int(x.get("height")) - quality))
             logger.info(f"      > Lecture '{lecture_title}' has DRM, attempting to download")
-            handle_segments(
+            rendition = f"dash {source.get('height')}p {source.get('format_id')}"
+            job_update("lecture", lecture_id, "downloading", lecture_id=lecture_id, rendition=rendition)
+            tracks_ready = handle_segments(
                 source.get("download_url"),
                 source.get("format_id"),
                 str(lecture_id),
                 chapter_dir,
             )
+            if tracks_ready:
+                job_update("lecture", lecture_id, "downloaded")
+            else:
+                job_update("lecture", lecture_id, "failed", error="track download failed")
+            return tracks_ready
         else:
             logger.info(f"      > Lecture '{lecture_title}' is missing media links")
             logger.debug(f"Lecture source count: {len(lecture_sources)}")
@@ -1485,16 +1938,25 @@ def process_lecture(lecture, lecture_path, chapter_dir):
         sources = lecture.get("sources")
         sources = sorted(sources, key=lambda x: int(x.get("height")), reverse=True)
         if sources:
-            if not os.path.isfile(lecture_path):
+            # a file left by an interrupted download (the job store knows) isn't complete
+            if not os.path.isfile(lecture_path) or (job_store and job_store.is_complete("lecture", lecture_id) is False):
                 logger.info("      > Lecture doesn't have DRM, attempting to download...")
                 source = sources[0]  # first index is the best quality
                 if isinstance(quality, int):
                     source = min(sources, key=lambda x: abs(int(x.get("height")) - quality))
+                rendition = f"{source.get('type')} {source.get('height')}p"
+                job_update("lecture", lecture_id, "downloading", lecture_id=lecture_id, rendition=rendition)
                 try:
                     logger.info("      ====== Selected quality: %s %s", source.get("type"), source.get("height"))
                     url = source.get("download_url")
                     source_type = source.get("type")
-                    if source_type == "hls":
+                    if source_type == "hls" and use_h265 and h265_stream and stream_hls_lecture(
+                        source, lecture_path, lecture_title
+                    ):
+                        logger.info("      > HLS Download success")
+                        record_output("lecture", lecture_path, lecture_id=lecture_id)
+                        job_update("lecture", lecture_id, "complete", path=lecture_path)
+                    elif source_type == "hls":
                         temp_filepath = lecture_path.replace(".mp4", ".%(ext)s")
                         cmd = [
                             "yt-dlp",
@@ -1506,66 +1968,67 @@ def process_lecture(lecture, lecture_path, chapter_dir):
                             "aria2c",
                             "--downloader-args",
                             'aria2c:"--disable-ipv6"',
+                            "--newline",
                             "-o",
                             f"{temp_filepath}",
                             f"{url}",
                         ]
-                        process = subprocess.Popen(cmd)
-                        log_subprocess_output("YTDLP-STDOUT", process.stdout)
-                        log_subprocess_output("YTDLP-STDERR", process.stderr)
-                        ret_code = process.wait()
-                        if ret_code == 0:
-                            tmp_file_path = lecture_path + ".tmp"
+                        result = run_with_retries(
+                            cmd,
+                            parser=DownloadProgressParser(),
+                            on_progress=log_progress(lecture_title),
+                            **watched("yt-dlp", lecture_path),
+                        )
+                        if result.ok:
                             logger.info("      > HLS Download success")
+                            record_output("lecture", lecture_path, lecture_id=lecture_id)
+                            job_update("lecture", lecture_id, "complete", path=lecture_path)
                             if use_h265:
-                                codec = "hevc_nvenc" if use_nvenc else "libx265"
-                                transcode = "-hwaccel cuda -hwaccel_output_format cuda".split(" ") if use_nvenc else []
-                                cmd = [
-                                    "ffmpeg",
-                                    *transcode,
-                                    "-y",
-                                    "-i",
+                                # encoded in the background so the next download can start right away
+                                # the encode replaces the file, so its size changes. Updated from the
+                                # encode itself, with this course's store: a daemon may have moved on to the next one
+                                transcode_queue.submit(
                                     lecture_path,
-                                    "-c:v",
-                                    codec,
-                                    "-c:a",
-                                    "copy",
-                                    "-f",
-                                    "mp4",
-                                    tmp_file_path,
-                                ]
-                                process = subprocess.Popen(cmd)
-                                log_subprocess_output("FFMPEG-STDOUT", process.stdout)
-                                log_subprocess_output("FFMPEG-STDERR", process.stderr)
-                                ret_code = process.wait()
-                                if ret_code == 0:
-                                    os.unlink(lecture_path)
-                                    os.rename(tmp_file_path, lecture_path)
-                                    logger.info("      > Encoding complete")
-                                else:
-                                    logger.error("      > Encoding returned non-zero return code")
+                                    lecture_title,
+                                    source.get("codecs"),
+                                    source.get("bandwidth"),
+                                    on_done=functools.partial(
+                                        job_update,
+                                        "lecture",
+                                        lecture_id,
+                                        "complete",
+                                        store=job_store,
+                                        path=lecture_path,
+                                    ),
+                                )
+                        else:
+                            job_update("lecture", lecture_id, "failed", error=result.describe())
                     else:
                         ret_code = download_aria(url, chapter_dir, lecture_title + ".mp4")
                         logger.debug(f"      > Download return code: {ret_code}")
-                except Exception:
+                        output_path = os.path.join(chapter_dir, lecture_title + ".mp4")
+                        record_output("lecture", output_path, lecture_id=lecture_id)
+                        job_update("lecture", lecture_id, "complete", path=output_path)
+                except Exception as e:
                     logger.exception(f">        Error downloading lecture")
+                    job_update("lecture", lecture_id, "failed", error=str(e))
             else:
                 logger.info(f"      > Lecture '{lecture_title}' is already downloaded, skipping...")
         else:
             logger.error("      > Missing sources for lecture", lecture)
 
 
-def process_quiz(udemy: Udemy, lecture, chapter_dir):
-    quiz = udemy._get_quiz_with_info(lecture.get("id"))
+def process_quiz(udemy: Udemy, lecture: Lecture, chapter_dir):
+    quiz = udemy._get_quiz_with_info(lecture.id)
     if quiz["_type"] == "coding-problem":
         process_coding_assignment(quiz, lecture, chapter_dir)
     else:  # Normal quiz
         process_normal_quiz(quiz, lecture, chapter_dir)
 
 
-def process_normal_quiz(quiz, lecture, chapter_dir):
-    lecture_title = lecture.get("lecture_title")
-    lecture_index = lecture.get("lecture_index")
+def process_normal_quiz(quiz, lecture: Lecture, chapter_dir):
+    lecture_title = lecture.lecture_title
+    lecture_index = lecture.lecture_index
     lecture_file_name = sanitize_filename(lecture_title + ".html")
     lecture_path = os.path.join(chapter_dir, lecture_file_name)
 
@@ -1573,10 +2036,10 @@ def process_normal_quiz(quiz, lecture, chapter_dir):
     with open("./templates/quiz_template.html", "r") as f:
         html = f.read()
         quiz_data = {
-            "quiz_id": lecture["data"].get("id"),
-            "quiz_description": lecture["data"].get("description"),
-            "quiz_title": lecture["data"].get("title"),
-            "pass_percent": lecture.get("data").get("pass_percent"),
+            "quiz_id": lecture.id,
+            "quiz_description": lecture.description,
+            "quiz_title": lecture.title,
+            "pass_percent": lecture.pass_percent,
             "questions": quiz["contents"],
         }
         html = html.replace("__data_placeholder__", json.dumps(quiz_data))
@@ -1584,9 +2047,9 @@ def process_normal_quiz(quiz, lecture, chapter_dir):
             f.write(html)
 
 
-def process_coding_assignment(quiz, lecture, chapter_dir):
-    lecture_title = lecture.get("lecture_title")
-    lecture_index = lecture.get("lecture_index")
+def process_coding_assignment(quiz, lecture: Lecture, chapter_dir):
+    lecture_title = lecture.lecture_title
+    lecture_index = lecture.lecture_index
     lecture_file_name = sanitize_filename(lecture_title + ".html")
     lecture_path = os.path.join(chapter_dir, lecture_file_name)
 
@@ -1608,50 +2071,199 @@ def process_coding_assignment(quiz, lecture, chapter_dir):
             f.write(html)
 
 
+def download_lecture(parsed_lecture: dict, chapter_dir: str, existing, total_lectures):
+    """
+    Downloads a parsed lecture with its captions and assets, skipping what's already there (existing is the
+    answer of existing_lecture_output). Runs the lectures of a course, and the shards of a download plan.
+    """
+    index = parsed_lecture.get("index")  # this is lecture_counter
+    lecture_title = parsed_lecture.get("lecture_title")
+    tracks_ready = False
+
+    lecture_extension = parsed_lecture.get("extension")
+    extension = "mp4"  # video lectures dont have an extension property, so we assume its mp4
+    if lecture_extension != None:
+        # if the lecture extension property isnt none, set the extension to the lecture extension
+        extension = lecture_extension
+    lecture_file_name = sanitize_filename(lecture_title + "." + extension)
+    lecture_file_name = deEmojify(lecture_file_name)
+    lecture_path = os.path.join(chapter_dir, lecture_file_name)
+
+    if not skip_lectures:
+        logger.info(f"  > Processing lecture {index} of {total_lectures}")
+        # Report current lecture progress for GUI
+        gui_progress("COMPLETED_LECTURE", index)
+
+        # Check if the lecture is already downloaded
+        if existing == "tracks":
+            logger.info("      > Lecture '%s' tracks are already downloaded, skipping..." % lecture_title)
+            tracks_ready = record_encrypted_tracks(str(parsed_lecture.get("id")), chapter_dir)
+        elif existing == "complete" or (existing is None and os.path.isfile(lecture_path)):
+            logger.info("      > Lecture '%s' is already downloaded, skipping..." % lecture_title)
+        else:
+            # Check if the file is an html file
+            if extension == "html":
+                # if the html content is None or an empty string, skip it so we dont save empty html files
+                if parsed_lecture.get("html_content") != None and parsed_lecture.get("html_content") != "":
+                    html_content = parsed_lecture.get("html_content").encode("utf8", "ignore").decode("utf8")
+                    lecture_path = os.path.join(chapter_dir, "{}.html".format(sanitize_filename(lecture_title)))
+                    try:
+                        with open(lecture_path, encoding="utf8", mode="w") as f:
+                            f.write(html_content)
+                        record_output("lecture", lecture_path, lecture_id=parsed_lecture.get("id"))
+                        job_update("lecture", parsed_lecture.get("id"), "complete", path=lecture_path)
+                    except Exception:
+                        logger.exception("    > Failed to write html file")
+            else:
+                tracks_ready = process_lecture(parsed_lecture, lecture_path, chapter_dir)
+
+    # download subtitles for this lecture
+    subtitles = parsed_lecture.get("subtitles")
+    if dl_captions and subtitles != None and lecture_extension == None:
+        logger.info("Processing {} caption(s)...".format(len(subtitles)))
+        for subtitle in subtitles:
+            lang = subtitle.get("language")
+            if lang == caption_locale or caption_locale == "all":
+                process_caption(subtitle, parsed_lecture.get("id"), lecture_title, chapter_dir)
+
+    if dl_assets:
+        assets = parsed_lecture.get("assets")
+        logger.info("    > Processing {} asset(s) for lecture...".format(len(assets)))
+
+        for asset in assets:
+            asset_type = asset.get("type")
+            filename = asset.get("filename")
+            download_url = asset.get("download_url")
+
+            if asset_type == "article":
+                body = asset.get("body")
+                # stip the 03d prefix
+                lecture_path = os.path.join(chapter_dir, "{}.html".format(sanitize_filename(lecture_title)))
+                try:
+                    with open("./templates/article_template.html", "r") as f:
+                        content = f.read()
+                        content = content.replace("__title_placeholder__", lecture_title[4:])
+                        content = content.replace("__data_placeholder__", body)
+                        with open(lecture_path, encoding="utf8", mode="w") as f:
+                            f.write(content)
+                    record_output("asset", lecture_path, lecture_id=parsed_lecture.get("id"))
+                    job_update(
+                        "asset", f"{parsed_lecture.get('id')}:article", "complete",
+                        path=lecture_path, lecture_id=parsed_lecture.get("id"),
+                    )
+                except Exception as e:
+                    print("Failed to write html file: ", e)
+                    continue
+            elif asset_type == "video":
+                logger.warning(
+                    "If you're seeing this message, that means that you reached a secret area that I haven't finished! jk I haven't implemented handling for this asset type, please report this at https://github.com/Puyodead1/udemy-downloader/issues so I can add it. When reporting, please provide the following information: "
+                )
+                logger.warning("AssetType: Video; AssetData: ", asset)
+            elif (
+                asset_type == "audio"
+                or asset_type == "e-book"
+                or asset_type == "file"
+                or asset_type == "presentation"
+                or asset_type == "ebook"
+                or asset_type == "source_code"
+            ):
+                asset_id = f"{parsed_lecture.get('id')}:{filename}"
+                asset_path = os.path.join(chapter_dir, filename)
+                if job_store and job_store.is_complete("asset", asset_id, asset_path):
+                    logger.info(f"    > Asset '{filename}' already downloaded.")
+                    record_output("asset", asset_path, lecture_id=parsed_lecture.get("id"))
+                    continue
+                job_update("asset", asset_id, "downloading", lecture_id=parsed_lecture.get("id"), rendition=asset_type)
+                try:
+                    ret_code = download_aria(download_url, chapter_dir, filename)
+                    logger.debug(f"      > Download return code: {ret_code}")
+                    record_output("asset", asset_path, lecture_id=parsed_lecture.get("id"))
+                    job_update("asset", asset_id, "complete", path=asset_path, checksum=True)
+                except Exception as e:
+                    logger.exception("> Error downloading asset")
+                    job_update("asset", asset_id, "failed", error=str(e))
+            elif asset_type == "external_link":
+                # write the external link to a shortcut file
+                file_path = os.path.join(chapter_dir, f"{filename}.url")
+                file = open(file_path, "w")
+                file.write("[InternetShortcut]\n")
+                file.write(f"URL={download_url}")
+                file.close()
+                record_output("asset", file_path, lecture_id=parsed_lecture.get("id"))
+                job_update(
+                    "asset", f"{parsed_lecture.get('id')}:{filename}.url", "complete",
+                    path=file_path, lecture_id=parsed_lecture.get("id"),
+                )
+
+                # save all the external links to a single file
+                savedirs, name = os.path.split(os.path.join(chapter_dir, filename))
+                filename = "external-links.txt"
+                filename = os.path.join(savedirs, filename)
+                file_data = []
+                if os.path.isfile(filename):
+                    file_data = [
+                        i.strip().lower() for i in open(filename, encoding="utf-8", errors="ignore") if i
+                    ]
+
+                content = "\n{}\n{}\n".format(name, download_url)
+                if name.lower() not in file_data:
+                    with open(filename, "a", encoding="utf-8", errors="ignore") as f:
+                        f.write(content)
+
+    if tracks_ready:
+        # Let the GUI post-process this lecture while we move on to the next one
+        gui_progress("LECTURE_READY", parsed_lecture.get("id"), os.path.abspath(chapter_dir))
+
+
 def parse_new(udemy: Udemy, udemy_object: dict):
-    # Prepare chapters/videos structure for selection GUI
-    chapters_for_gui = []
-    for chapter in udemy_object.get("chapters", []):
-        chapter_dict = {
-            "id": chapter.get("chapter_index"),
-            "title": chapter.get("chapter_title"),
-            "videos": []
-        }
-        for lecture in chapter.get("lectures", []):
-            # Only add video lectures
-            if lecture.get("_class") == "lecture":
-                # Try to get thumbnail if available (add logic if you have thumbnail URLs)
-                thumb_url = lecture.get("data", {}).get("asset", {}).get("thumbnail_url")
-                chapter_dict["videos"].append({
-                    "id": lecture.get("id"),
-                    "title": lecture.get("lecture_title"),
-                    "thumbnail_url": thumb_url
-                })
-        chapters_for_gui.append(chapter_dict)
+    global job_manifest, job_store
+    index = course_index(udemy_object)
 
     course_name = str(udemy_object.get("course_id")) if id_as_course_name else udemy_object.get("course_title")
     course_dir = os.path.join(DOWNLOAD_DIR, sanitize_filename(course_name))
     if not os.path.exists(course_dir):
         os.mkdir(course_dir)
 
+    # only the GUI reads the manifest, and asks for one; plain runs leave nothing of it in the course
+    job_manifest = JobManifest(job_manifest_path) if job_manifest_path else None
+    record_output("course_dir", course_dir)
+    if job_manifest:
+        logger.info(f"> Recording produced files in {job_manifest_path}")
+    job_store = JobStore.for_course(course_dir)
+
     # Create and save lecture ID to title mapping
-    id_to_title_map = {}
-    for chapter in udemy_object.get("chapters", []):
-        for lecture in chapter.get("lectures", []):
-            lecture_id = str(lecture.get("id"))
-            lecture_title = lecture.get("lecture_title")
-            if lecture_id and lecture_title:
-                id_to_title_map[lecture_id] = lecture_title
-
-    # Show selection window and get user selection
-    selected_pairs = show_video_selection_window(chapters_for_gui, course_out_dir=course_dir, id_to_title_map=id_to_title_map)
-    # selected_pairs is a list of (chapter_id, video_id)
-    selected_video_ids = set(vid for chap, vid in selected_pairs)
+    id_to_title_map = index.id_to_title()
+
+    sync_diff = None
+    if sync_mode:
+        # the sync schedules lectures itself, the selection window would defeat its purpose
+        old_snapshot = load_snapshot(course_dir)
+        new_snapshot = build_snapshot(udemy_object)
+        sync_diff = diff_snapshots(old_snapshot, new_snapshot)
+        report_sync_diff(sync_diff, old_snapshot, new_snapshot)
+        scheduled_ids = set(sync_diff.added) | set(sync_diff.changed)
+        if selection_rules:
+            scheduled_ids &= {str(lecture_id) for lecture_id in selection_rules.select(udemy_object)}
+        synced_ids = set()
+        selected_video_ids = set()
+    elif selection_rules:
+        selected_video_ids = selection_rules.select(udemy_object)
+        logger.info(f"> {len(selected_video_ids)} lecture(s) selected by rules: {selection_rules.describe()}")
+    elif select_all:
+        selected_video_ids = set(index.lecture_ids())
+    else:
+        # imported here so headless runs never load tkinter
+        from gui import show_video_selection_window
+
+        # Show selection window and get user selection
+        selected_pairs = show_video_selection_window(index.selection_chapters(), course_out_dir=course_dir, id_to_title_map=id_to_title_map)
+        # selected_pairs is a list of (chapter_id, video_id)
+        selected_video_ids = set(vid for chap, vid in selected_pairs)
     total_chapters = udemy_object.get("total_chapters")
     total_lectures = udemy_object.get("total_lectures")
     logger.info(f"Chapter(s) ({total_chapters})")
     logger.info(f"Lecture(s) ({total_lectures})")
-    print(f"GUI_PROGRESS:TOTAL_LECTURES:{total_lectures}", flush=True) # Report total lectures for GUI
+    gui_progress("TOTAL_LECTURES", total_lectures)  # Report total lectures for GUI
     
     if id_to_title_map:
         map_file_path = os.path.join(course_dir, "id_to_title.json")
@@ -1659,240 +2271,390 @@ def parse_new(udemy: Udemy, udemy_object: dict):
             with open(map_file_path, "w", encoding="utf-8") as f:
                 json.dump(id_to_title_map, f, indent=2, ensure_ascii=False)
             logger.info(f"> Saved lecture ID to title mapping at {map_file_path}")
+            record_output("id_to_title", map_file_path)
         except Exception as e:
             logger.error(f"> Error saving ID to title mapping: {e}")
 
-    for chapter in udemy_object.get("chapters"):
-        current_chapter_index = int(chapter.get("chapter_index"))
-        # Skip chapters not in the filter if a filter is provided
-        if chapter_filter is not None and current_chapter_index not in chapter_filter:
-            logger.info("Skipping chapter %s as it is not in the specified filter", current_chapter_index)
+    plan_entries = []
+    skipped_quizzes = 0
+    # only the lectures of the chapter/lecture filters are visited
+    wanted = index.filtered(chapter_filter, lecture_filter)
+    if chapter_filter is not None or lecture_filter is not None:
+        logger.info(f"> {len(wanted)} lecture(s) in the chapter/lecture filter")
+    current_chapter = None
+    for chapter, lecture in wanted:
+        if chapter is not current_chapter:
+            current_chapter = chapter
+            chapter_title = chapter.title
+            chapter_index = chapter.index
+            chapter_dir = os.path.join(course_dir, chapter_title)
+            if not os.path.exists(chapter_dir):
+                os.mkdir(chapter_dir)
+            logger.info(f"======= Processing chapter {chapter_index} of {total_chapters} =======")
+
+        check_cancelled()
+        if sync_diff is not None:
+            if str(lecture.id) not in scheduled_ids:
+                continue
+        # Only process if selected by user
+        elif lecture.id not in selected_video_ids:
             continue
+        if sync_diff is not None:
+            lecture_key = str(lecture.id)
+            if lecture_key in sync_diff.changed:
+                retire_changed_lecture(
+                    lecture_key, sync_diff.changed[lecture_key], old_snapshot["lectures"][lecture_key], course_dir
+                )
+            synced_ids.add(lecture_key)
 
-        chapter_title = chapter.get("chapter_title")
-        chapter_index = chapter.get("chapter_index")
-        chapter_dir = os.path.join(course_dir, chapter_title)
-        if not os.path.exists(chapter_dir):
-            os.mkdir(chapter_dir)
-        logger.info(f"======= Processing chapter {chapter_index} of {total_chapters} =======")
-
-        for lecture in chapter.get("lectures"):
-            # Only process if selected by user
-            if lecture.get("id") not in selected_video_ids:
+        if export_plan_path:
+            if lecture.clazz == "quiz":
+                # quizzes are fetched through the API, workers run without a session
+                skipped_quizzes += dl_quizzes
                 continue
-            current_lecture_index = int(lecture.get("index"))
-            # Skip lectures not in the filter if a filter is provided
-            if lecture_filter is not None and current_lecture_index not in lecture_filter:
-                logger.info("Skipping lecture %s as it is not in the specified filter", current_lecture_index)
+            # workers check what they already have, the plan gets every selected lecture
+            plan_entries.append({"chapter": chapter_title, "lecture": embed_manifests(udemy._parse_lecture(lecture))})
+            continue
+
+        if lecture.clazz == "quiz":
+            # skip the quiz if we dont want to download it
+            if not dl_quizzes:
                 continue
+            process_quiz(udemy, lecture, chapter_dir)
+            continue
 
-            clazz = lecture.get("_class")
+        # checked before parsing, so finished lectures don't cost playlist/manifest fetches
+        existing = None if skip_lectures else existing_lecture_output(
+            lecture.id, lecture.lecture_title, lecture.asset_type, chapter_dir
+        )
+        parsed_lecture = udemy._parse_lecture(
+            lecture, resolve_sources=not skip_lectures and existing in (None, "incomplete")
+        )
+        download_lecture(parsed_lecture, chapter_dir, existing, total_lectures)
+
+    if export_plan_path:
+        plan = write_plan(
+            export_plan_path,
+            os.path.basename(course_dir),
+            {name: globals()[name] for name in PLAN_OPTIONS},
+            plan_entries,
+            total_lectures,
+            plan_shard_size,
+        )
+        logger.info(f"> Download plan of {len(plan_entries)} lecture(s) in {len(plan['shards'])} shard(s) saved to {export_plan_path}")
+        if skipped_quizzes:
+            logger.warning(f"> {skipped_quizzes} quiz(zes) left out of the plan, download them with a regular run")
+        # nothing was downloaded yet, the next sync diffs against the same snapshot
+        return
 
-            if clazz == "quiz":
-                # skip the quiz if we dont want to download it
-                if not dl_quizzes:
-                    continue
-                process_quiz(udemy, lecture, chapter_dir)
-                continue
+    if job_store:
+        for kind, counts in sorted(job_store.summary().items()):
+            logger.info(f"> {kind.capitalize()}s: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+
+    if sync_diff is not None:
+        # failed lectures keep their previous state in the snapshot, so the next sync retries them
+        if job_store:
+            synced_ids -= job_store.failed_lectures()
+        snapshot_file = save_snapshot(course_dir, merge_snapshot(old_snapshot, new_snapshot, synced_ids))
+        pending = len(scheduled_ids - synced_ids)
+        logger.info(f"> Sync snapshot saved to {snapshot_file}" + (f", {pending} lecture(s) left for the next sync" if pending else ""))
+
+
+def run_plan(path: str):
+    """
+    Worker side of a download plan: claims shards until none are left and downloads their lectures like a
+    course run would, into the plan's course directory under this worker's output directory
+    """
+    global job_manifest, job_store
+    plan = load_plan(path)
+    if time.time() - plan["created_at"] > CHECKPOINT_MAX_AGE:
+        logger.warning("> This plan is more than %d hours old, its media links may have expired" % (CHECKPOINT_MAX_AGE // 3600))
+    # the exporting run decides what is downloaded
+    globals().update({name: value for name, value in plan["options"].items() if name in PLAN_OPTIONS})
+
+    course_dir = os.path.join(DOWNLOAD_DIR, plan["course_dir"])
+    os.makedirs(course_dir, exist_ok=True)
+    claims = ShardClaims(path, worker_id)
+    job_manifest = JobManifest(job_manifest_path) if job_manifest_path else None
+    record_output("course_dir", course_dir)
+    job_store = JobStore.for_course(course_dir)
+    temp_dir = Path(Path.cwd(), "temp", f"plan-{claims.worker_id}")
+    shards = {shard["id"]: shard for shard in plan["shards"]}
+    logger.info(f"> Working on plan {path} as {claims.worker_id}: {len(shards)} shard(s), {claims.status(shards)}")
+    gui_progress("TOTAL_LECTURES", plan["total_lectures"])
+
+    current = {"shard": None}
+    stop_heartbeat = threading.Event()
+
+    def heartbeat():
+        while not stop_heartbeat.wait(HEARTBEAT_SECONDS):
+            if current["shard"] is not None:
+                claims.heartbeat(current["shard"])
+
+    threading.Thread(target=heartbeat, name="plan-heartbeat", daemon=True).start()
+    attempted = set()
+    try:
+        while True:
+            check_cancelled()
+            # a shard this worker failed is left to the others, even with --retry-failed-shards
+            shard_id = claims.claim_next([i for i in sorted(shards) if i not in attempted], retry_failed_shards)
+            if shard_id is None:
+                break
+            attempted.add(shard_id)
+            current["shard"] = shard_id
+            shard = shards[shard_id]
+            logger.info(f"======= Shard {shard_id} of {len(shards)} ({len(shard['lectures'])} lecture(s)) =======")
+            lecture_ids = set()
+            try:
+                for entry in shard["lectures"]:
+                    check_cancelled()
+                    chapter_dir = os.path.join(course_dir, entry["chapter"])
+                    os.makedirs(chapter_dir, exist_ok=True)
+                    lecture = restore_manifests(entry["lecture"], temp_dir)
+                    lecture_ids.add(str(lecture.get("id")))
+                    existing = None if skip_lectures else existing_lecture_output(
+                        lecture.get("id"), lecture.get("lecture_title"), lecture.get("type"), chapter_dir
+                    )
+                    download_lecture(lecture, chapter_dir, existing, plan["total_lectures"])
+            except DownloadCancelled:
+                # released, so another worker takes it over right away
+                claims.release(shard_id)
+                raise
+            ok = not (job_store.failed_lectures() & lecture_ids)
+            claims.finish(shard_id, ok)
+            current["shard"] = None
+            if not ok:
+                logger.warning(f"> Shard {shard_id} had failed items, it's marked failed for --retry-failed-shards")
+    finally:
+        stop_heartbeat.set()
+    logger.info(f"> Worked on {len(attempted)} shard(s), plan status: {claims.status(shards)}")
+
+
+def format_bytes(size: float):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_seconds(seconds: float):
+    return time.strftime("%H:%M:%S", time.gmtime(seconds)) if seconds < 86400 else f"{seconds / 86400:.1f} days"
+
+
+def estimate_course(udemy: Udemy, udemy_object: dict):
+    """
+    Dry run: resolves the renditions of the selected lectures (selection rules, or every lecture) a few at a time,
+    without downloading, and writes their estimated size per chapter and download time to estimate_path
+    """
+    global job_store
+    course_name = str(udemy_object.get("course_id")) if id_as_course_name else udemy_object.get("course_title")
+    course_dir = os.path.join(DOWNLOAD_DIR, sanitize_filename(course_name))
+    # lectures already on disk aren't resolved, nor counted
+    job_store = JobStore.for_course(course_dir, create=False)
+    selected_ids = selection_rules.select(udemy_object) if selection_rules else None
+
+    planned = [
+        (chapter.title, lecture)
+        for chapter, lecture in course_index(udemy_object).filtered(chapter_filter, lecture_filter)
+        # quizzes are a few KB of html
+        if lecture.clazz == "lecture" and (selected_ids is None or lecture.id in selected_ids)
+    ]
+    logger.info(f"> Estimating {len(planned)} lecture(s), {RESOLVE_WORKERS} at a time...")
+
+    def resolve(item):
+        chapter_title, lecture = item
+        check_cancelled()
+        entry = {
+            "chapter": chapter_title,
+            "lecture_id": lecture.id,
+            "title": lecture.lecture_title,
+            "duration": lecture.duration,
+        }
+        existing = existing_lecture_output(
+            lecture.id, lecture.lecture_title, lecture.asset_type, os.path.join(course_dir, chapter_title)
+        )
+        if existing in ("complete", "tracks"):
+            entry["on_disk"] = True
+            return entry
+        parsed_lecture = udemy._parse_lecture(lecture, resolve_sources=not skip_lectures)
+        entry.update(
+            estimate_lecture(
+                parsed_lecture,
+                entry["duration"],
+                quality,
+                captions=caption_locale if dl_captions else None,
+                assets=dl_assets,
+            )
+        )
+        if skip_lectures:
+            entry.update(rendition=None, method=None, media_bytes=0)
+        return entry
+
+    entries = []
+    with ThreadPoolExecutor(max_workers=RESOLVE_WORKERS, thread_name_prefix="estimate") as executor:
+        for entry in executor.map(resolve, planned):
+            entries.append(entry)
+            if len(entries) % 25 == 0:
+                logger.info(f"  > Resolved {len(entries)} of {len(planned)} lecture(s)")
+
+    measured = measured_throughput(DOWNLOAD_DIR)
+    throughput = measured[0] if measured else DEFAULT_THROUGHPUT
+    report = build_report(
+        {"id": udemy_object.get("course_id"), "title": udemy_object.get("title"), "dir": course_dir},
+        entries,
+        throughput,
+        measured[1] if measured else None,
+        shutil.disk_usage(DOWNLOAD_DIR).free,
+    )
+    for chapter in report["chapters"]:
+        logger.info(
+            f"> {chapter['chapter']}: {format_bytes(chapter['total_bytes'])} in {chapter['lectures'] - chapter['on_disk']} "
+            f"lecture(s), ~{format_seconds(chapter['estimated_seconds'])}"
+        )
+    totals = report["totals"]
+    logger.info(
+        f"> Total: {format_bytes(totals['total_bytes'])} to download ({totals['on_disk']} lecture(s) already on disk), "
+        f"~{format_seconds(totals['estimated_seconds'])} at {format_bytes(throughput)}/s "
+        + ("measured on this host" if measured else "(assumed, nothing downloaded here to measure yet)")
+    )
+    if totals["unknown_size"]:
+        logger.warning(f"> The size of {totals['unknown_size']} lecture(s) couldn't be estimated, they aren't counted")
+    if not report["disk"]["fits"]:
+        logger.warning(f"> Only {format_bytes(report['disk']['free_bytes'])} free in {DOWNLOAD_DIR}, not enough for this download")
+    logger.info(f"> Estimate saved to {write_report(estimate_path, report)}")
 
-            index = lecture.get("index")  # this is lecture_counter
-            # lecture_index = lecture.get("lecture_index")  # this is the raw object index from udemy
-
-            lecture_title = lecture.get("lecture_title")
-            parsed_lecture = udemy._parse_lecture(lecture)
-
-            lecture_extension = parsed_lecture.get("extension")
-            extension = "mp4"  # video lectures dont have an extension property, so we assume its mp4
-            if lecture_extension != None:
-                # if the lecture extension property isnt none, set the extension to the lecture extension
-                extension = lecture_extension
-            lecture_file_name = sanitize_filename(lecture_title + "." + extension)
-            lecture_file_name = deEmojify(lecture_file_name)
-            lecture_path = os.path.join(chapter_dir, lecture_file_name)
-
-            if not skip_lectures:
-                logger.info(f"  > Processing lecture {index} of {total_lectures}")
-                # Report current lecture progress for GUI
-                print(f"GUI_PROGRESS:COMPLETED_LECTURE:{index}", flush=True)
-
-                # Check if the lecture is already downloaded
-                if os.path.isfile(lecture_path):
-                    logger.info("      > Lecture '%s' is already downloaded, skipping..." % lecture_title)
-                else:
-                    # Check if the file is an html file
-                    if extension == "html":
-                        # if the html content is None or an empty string, skip it so we dont save empty html files
-                        if parsed_lecture.get("html_content") != None and parsed_lecture.get("html_content") != "":
-                            html_content = parsed_lecture.get("html_content").encode("utf8", "ignore").decode("utf8")
-                            lecture_path = os.path.join(chapter_dir, "{}.html".format(sanitize_filename(lecture_title)))
-                            try:
-                                with open(lecture_path, encoding="utf8", mode="w") as f:
-                                    f.write(html_content)
-                            except Exception:
-                                logger.exception("    > Failed to write html file")
-                    else:
-                        process_lecture(parsed_lecture, lecture_path, chapter_dir)
-
-            # download subtitles for this lecture
-            subtitles = parsed_lecture.get("subtitles")
-            if dl_captions and subtitles != None and lecture_extension == None:
-                logger.info("Processing {} caption(s)...".format(len(subtitles)))
-                for subtitle in subtitles:
-                    lang = subtitle.get("language")
-                    if lang == caption_locale or caption_locale == "all":
-                        process_caption(subtitle, parsed_lecture.get("id"), lecture_title, chapter_dir)
-
-            if dl_assets:
-                assets = parsed_lecture.get("assets")
-                logger.info("    > Processing {} asset(s) for lecture...".format(len(assets)))
-
-                for asset in assets:
-                    asset_type = asset.get("type")
-                    filename = asset.get("filename")
-                    download_url = asset.get("download_url")
-
-                    if asset_type == "article":
-                        body = asset.get("body")
-                        # stip the 03d prefix
-                        lecture_path = os.path.join(chapter_dir, "{}.html".format(sanitize_filename(lecture_title)))
-                        try:
-                            with open("./templates/article_template.html", "r") as f:
-                                content = f.read()
-                                content = content.replace("__title_placeholder__", lecture_title[4:])
-                                content = content.replace("__data_placeholder__", body)
-                                with open(lecture_path, encoding="utf8", mode="w") as f:
-                                    f.write(content)
-                        except Exception as e:
-                            print("Failed to write html file: ", e)
-                            continue
-                    elif asset_type == "video":
-                        logger.warning(
-                            "If you're seeing this message, that means that you reached a secret area that I haven't finished! jk I haven't implemented handling for this asset type, please report this at https://github.com/Puyodead1/udemy-downloader/issues so I can add it. When reporting, please provide the following information: "
-                        )
-                        logger.warning("AssetType: Video; AssetData: ", asset)
-                    elif (
-                        asset_type == "audio"
-                        or asset_type == "e-book"
-                        or asset_type == "file"
-                        or asset_type == "presentation"
-                        or asset_type == "ebook"
-                        or asset_type == "source_code"
-                    ):
-                        try:
-                            ret_code = download_aria(download_url, chapter_dir, filename)
-                            logger.debug(f"      > Download return code: {ret_code}")
-                        except Exception:
-                            logger.exception("> Error downloading asset")
-                    elif asset_type == "external_link":
-                        # write the external link to a shortcut file
-                        file_path = os.path.join(chapter_dir, f"{filename}.url")
-                        file = open(file_path, "w")
-                        file.write("[InternetShortcut]\n")
-                        file.write(f"URL={download_url}")
-                        file.close()
-
-                        # save all the external links to a single file
-                        savedirs, name = os.path.split(os.path.join(chapter_dir, filename))
-                        filename = "external-links.txt"
-                        filename = os.path.join(savedirs, filename)
-                        file_data = []
-                        if os.path.isfile(filename):
-                            file_data = [
-                                i.strip().lower() for i in open(filename, encoding="utf-8", errors="ignore") if i
-                            ]
-
-                        content = "\n{}\n{}\n".format(name, download_url)
-                        if name.lower() not in file_data:
-                            with open(filename, "a", encoding="utf-8", errors="ignore") as f:
-                                f.write(content)
+
+def _lecture_info(udemy: Udemy, lecture: Lecture):
+    """
+    What --info shows of a lecture: read from the curriculum alone at the metadata level, with its qualities
+    resolved otherwise. None for the lectures it doesn't list (articles and other html).
+    """
+    if lecture.media == "html":
+        return None
+    if lecture.media is None:
+        return {"type": lecture.type, "is_encrypted": None, "duration": None}
+    lecture_info = {
+        "type": lecture.asset_type,
+        "is_encrypted": lecture.media == "drm",
+        "assets_count": len(lecture.download_assets()),
+        "subtitles": udemy._extract_subtitles(lecture.captions),
+        "duration": lecture.duration,
+    }
+    if info == "metadata":
+        return lecture_info
+
+    parsed_lecture = udemy._parse_lecture(lecture)
+    lecture_sources = parsed_lecture.get("video_sources") if lecture_info["is_encrypted"] else parsed_lecture.get("sources")
+    lecture_qualities = []
+    if lecture_sources:
+        lecture_sources = sorted(lecture_sources, key=lambda x: int(x.get("height")), reverse=True)
+        if lecture_info["is_encrypted"]:
+            lecture_qualities = ["{}@{}x{}".format(x.get("type"), x.get("width"), x.get("height")) for x in lecture_sources]
+        else:
+            lecture_qualities = ["{}@{}x{}".format(x.get("type"), x.get("height"), x.get("width")) for x in lecture_sources]
+    lecture_info["qualities"] = lecture_qualities
+    return lecture_info
 
 
 def _print_course_info(udemy: Udemy, udemy_object: dict):
+    """
+    Prints the course, resolving the lectures RESOLVE_WORKERS at a time; each is printed, in course order,
+    as soon as it and the ones before it are resolved
+    """
     course_title = udemy_object.get("title")
     chapter_count = udemy_object.get("total_chapters")
     lecture_count = udemy_object.get("total_lectures")
 
-    if lecture_count > 100:
-        logger.warning(
-            "This course has a lot of lectures! Fetching all the information can take a long time as well as spams Udemy's servers. It is NOT recommended to continue! Are you sure you want to do this?"
-        )
-        yn = input("(y/n): ")
-        if yn.lower() != "y":
-            logger.info("Probably wise. Please remove the --info argument and try again.")
-            sys.exit(0)
-
     logger.info("> Course: {}".format(course_title))
     logger.info("> Total Chapters: {}".format(chapter_count))
     logger.info("> Total Lectures: {}".format(lecture_count))
     logger.info("\n")
 
-    chapters = udemy_object.get("chapters")
-    for chapter in chapters:
-        current_chapter_index = int(chapter.get("chapter_index"))
-        # Skip chapters not in the filter if a filter is provided
-        if chapter_filter is not None and current_chapter_index not in chapter_filter:
-            continue
-
-        chapter_title = chapter.get("chapter_title")
-        chapter_index = chapter.get("chapter_index")
-        chapter_lecture_count = chapter.get("lecture_count")
-        chapter_lectures = chapter.get("lectures")
-
-        logger.info("> Chapter: {} ({} of {})".format(chapter_title, chapter_index, chapter_count))
-
-        for lecture in chapter_lectures:
-            current_lecture_index = int(lecture.get("index"))
-            if lecture_filter is not None and current_lecture_index not in lecture_filter:
-                continue
-
-            lecture_index = lecture.get("lecture_index")  # this is the raw object index from udemy
-            lecture_title = lecture.get("lecture_title")
-            parsed_lecture = udemy._parse_lecture(lecture)
-
-            lecture_sources = parsed_lecture.get("sources")
-            lecture_is_encrypted = parsed_lecture.get("is_encrypted", None)
-            lecture_extension = parsed_lecture.get("extension")
-            lecture_asset_count = parsed_lecture.get("assets_count")
-            lecture_subtitles = parsed_lecture.get("subtitles")
-            lecture_video_sources = parsed_lecture.get("video_sources")
-            lecture_type = parsed_lecture.get("type")
-
-            lecture_qualities = []
-
-            if lecture_sources:
-                lecture_sources = sorted(lecture_sources, key=lambda x: int(x.get("height")), reverse=True)
-            if lecture_video_sources:
-                lecture_video_sources = sorted(lecture_video_sources, key=lambda x: int(x.get("height")), reverse=True)
-
-            if lecture_is_encrypted and lecture_video_sources != None:
-                lecture_qualities = [
-                    "{}@{}x{}".format(x.get("type"), x.get("width"), x.get("height")) for x in lecture_video_sources
-                ]
-            elif lecture_is_encrypted == False and lecture_sources != None:
-                lecture_qualities = [
-                    "{}@{}x{}".format(x.get("type"), x.get("height"), x.get("width")) for x in lecture_sources
-                ]
-
-            if lecture_extension:
+    listed = course_index(udemy_object).filtered(chapter_filter, lecture_filter)
+
+    current_chapter = None
+    with ThreadPoolExecutor(max_workers=RESOLVE_WORKERS, thread_name_prefix="info") as executor:
+        lecture_infos = executor.map(lambda item: _lecture_info(udemy, item[1]), listed)
+        for (chapter, lecture), lecture_info in zip(listed, lecture_infos):
+            if chapter is not current_chapter:
+                if current_chapter is not None and current_chapter.index != chapter_count:
+                    logger.info("==========================================")
+                current_chapter = chapter
+                logger.info("> Chapter: {} ({} of {})".format(chapter.title, chapter.index, chapter_count))
+            if lecture_info is None:
                 continue
 
-            logger.info("  > Lecture: {} ({} of {})".format(lecture_title, lecture_index, chapter_lecture_count))
-            logger.info("    > Type: {}".format(lecture_type))
-            if lecture_is_encrypted != None:
-                logger.info("    > DRM: {}".format(lecture_is_encrypted))
-            if lecture_asset_count:
-                logger.info("    > Asset Count: {}".format(lecture_asset_count))
-            if lecture_subtitles:
-                logger.info("    > Captions: {}".format(", ".join([x.get("language") for x in lecture_subtitles])))
-            if lecture_qualities:
-                logger.info("    > Qualities: {}".format(lecture_qualities))
-
-        if chapter_index != chapter_count:
-            logger.info("==========================================")
+            lecture_index = lecture.lecture_index  # this is the raw object index from udemy
+            logger.info("  > Lecture: {} ({} of {})".format(lecture.lecture_title, lecture_index, chapter.lecture_count))
+            logger.info("    > Type: {}".format(lecture_info["type"]))
+            if lecture_info["duration"]:
+                logger.info("    > Duration: {}".format(format_seconds(lecture_info["duration"])))
+            if lecture_info["is_encrypted"] != None:
+                logger.info("    > DRM: {}".format(lecture_info["is_encrypted"]))
+            if lecture_info.get("assets_count"):
+                logger.info("    > Asset Count: {}".format(lecture_info["assets_count"]))
+            if lecture_info.get("subtitles"):
+                logger.info("    > Captions: {}".format(", ".join([x.get("language") for x in lecture_info["subtitles"]])))
+            if lecture_info.get("qualities"):
+                logger.info("    > Qualities: {}".format(lecture_info["qualities"]))
+
+
+def resolve_h265_settings():
+    """
+    Fills in the H.265 CRF/preset not given on the command line from this host's calibration, or ffmpeg's defaults
+    """
+    global h265_crf, h265_preset
+    if h265_crf is not None and h265_preset is not None:
+        return
+    encoder = "hevc_nvenc" if use_nvenc and nvenc_available() else "libx265"
+    settings = load_calibration(SAVED_DIR, encoder)
+    if settings:
+        logger.info(f"> Using calibrated {encoder} settings for this host: preset {settings['preset']}, crf {settings['crf']}")
+        if h265_crf is None:
+            h265_crf = settings["crf"]
+        if h265_preset is None:
+            h265_preset = settings["preset"]
+    if h265_crf is None:
+        h265_crf = 28
+    if h265_preset is None:
+        h265_preset = "medium"
+
+
+def run_h265_calibration():
+    if not os.path.isdir(calibrate_dir):
+        logger.error(f"> {calibrate_dir} is not a directory")
+        return
+    calibration_queue = TranscodeQueue(
+        crf=h265_crf or 28,
+        preset=h265_preset or "medium",
+        use_nvenc=use_nvenc,
+        workers=transcode_workers,
+    )
+    try:
+        results, recommendation = calibrate(calibration_queue, calibrate_dir, min_fps=calibrate_min_fps)
+    finally:
+        calibration_queue.join()
+    if not recommendation:
+        logger.error("> Calibration produced no usable results, H.265 defaults were not changed")
+        return
+    encoder = "hevc_nvenc" if calibration_queue.use_nvenc else "libx265"
+    path = save_calibration(SAVED_DIR, recommendation, encoder)
+    logger.info(
+        f"> Recommended {encoder} settings: preset {recommendation['preset']}, crf {recommendation['crf']} "
+        f"({recommendation['host_fps']} fps with {calibration_queue.workers} worker(s), "
+        f"{recommendation['size_ratio'] * 100:.1f}% of source size, PSNR {recommendation['psnr']} dB)"
+    )
+    logger.info(f"> Saved to {path}, used whenever --h265-crf/--h265-preset aren't given")
 
 
-def main():
-    global bearer_token, portal_name
+def main(udemy: Udemy = None, keep_warm: bool = False):
+    """
+    Downloads the course of the current options. The daemon passes its authenticated Udemy object and
+    keep_warm, so the session and the transcode pool outlive the job; returns the Udemy object used.
+    """
+    global bearer_token, portal_name, transcode_queue, transcode_settings, stall_count
+    stall_count = 0
     aria_ret_val = check_for_aria()
     if not aria_ret_val:
         logger.warning("> Aria2c is missing from your system or path! Some downloads may not work.")
@@ -1908,18 +2670,51 @@ def main():
         logger.warning("> Shaka Packager is missing from your system or path! DRM decryption may not work.")
         logger.warning("> Please install shaka-packager from: https://github.com/shaka-project/shaka-packager/releases/latest")
 
+    if calibrate_dir:
+        run_h265_calibration()
+        return
+
+    if use_h265 and not info and not estimate_path and not skip_lectures:
+        resolve_h265_settings()
+        settings = (h265_crf, h265_preset, use_nvenc, transcode_workers, h265_chunk_seconds, h265_min_bitrate, stall_timeout, stall_retries)
+        # a warm pool with the same settings is reused
+        if transcode_queue is None or settings != transcode_settings:
+            if transcode_queue:
+                transcode_queue.join()
+            transcode_queue = TranscodeQueue(
+                crf=h265_crf,
+                preset=h265_preset,
+                use_nvenc=use_nvenc,
+                workers=transcode_workers,
+                chunk_seconds=h265_chunk_seconds,
+                min_bitrate=h265_min_bitrate * 1000,
+                stall_timeout=stall_timeout or None,
+                stall_retries=stall_retries,
+                on_stall=stall_recorder,
+            )
+            transcode_settings = settings
+
+    if run_plan_path:
+        # plans carry signed URLs and embedded manifests, workers don't need a session
+        run_plan(run_plan_path)
+        finish_run(keep_warm)
+        return udemy
+
     if load_from_file:
-        logger.info("> 'load_from_file' was specified, data will be loaded from json files instead of fetched")
+        logger.info("> 'load_from_file' was specified, data will be loaded from the saved course instead of fetched")
     if save_to_file:
-        logger.info("> 'save_to_file' was specified, data will be saved to json files")
+        logger.info("> 'save_to_file' was specified, data will be saved to a file per course in saved/courses")
 
-    load_dotenv()
-    if bearer_token:
-        bearer_token = bearer_token
-    else:
-        bearer_token = os.getenv("UDEMY_BEARER")
+    if udemy is None:
+        load_dotenv()
+        if bearer_token:
+            bearer_token = bearer_token
+        else:
+            bearer_token = os.getenv("UDEMY_BEARER")
 
-    udemy = Udemy(bearer_token)
+        udemy = Udemy(bearer_token)
+    # only looked at, not downloaded: recently fetched playlists/manifests are good enough
+    udemy.manifest_max_age = MANIFEST_CACHE_MAX_AGE if info or estimate_path else 0
 
     logger.info("> Fetching course information, this may take a minute...")
     if not load_from_file:
@@ -1929,31 +2724,46 @@ def main():
             title = sanitize_filename(course_info.get("title"))
             course_title = course_info.get("published_title")
 
+    # saved courses are named after the course in the URL, which is known before anything is fetched
+    saved_course_key = sanitize_filename("_".join(udemy.extract_course_name(course_url) or ("", "")).strip("_"))
     logger.info("> Fetching course curriculum, this may take a minute...")
+    udemy_object = None
     if load_from_file:
-        course_json = json.loads(
-            open(os.path.join(os.getcwd(), "saved", "course_content.json"), encoding="utf8", mode="r").read()
-        )
-        title = course_json.get("title")
-        course_title = course_json.get("published_title")
+        try:
+            saved_course = SavedCourse.open(SAVED_DIR, saved_course_key)
+        except (ValueError, sqlite3.DatabaseError) as error:
+            logger.fatal(f"> Can't load the saved course ({error}), save it again with --save-to-file")
+            sys.exit(1)
+        if saved_course:
+            try:
+                # chapters outside the filter aren't read, unless a sync needs the whole course to diff
+                udemy_object = saved_course.load(None if sync_mode else chapter_filter)
+            finally:
+                saved_course.close()
+            course_json = {"portal_name": udemy_object.get("portal_name")}
+        else:
+            # saved by a version that kept one course in saved/*.json
+            legacy = load_legacy(SAVED_DIR)
+            if legacy is None:
+                saved_path = SavedCourse.path_for(SAVED_DIR, saved_course_key)
+                logger.fatal(f"> No saved course at {saved_path}, save it with --save-to-file first")
+                sys.exit(1)
+            course_json, udemy_object = legacy
+        title = udemy_object.get("title")
+        course_title = udemy_object.get("course_title")
         portal_name = course_json.get("portal_name")
     else:
         course_json = udemy._extract_course_curriculum(course_url, course_id, portal_name)
         course_json["portal_name"] = portal_name
 
-    if save_to_file:
-        with open(os.path.join(os.getcwd(), "saved", "course_content.json"), encoding="utf8", mode="w") as f:
-            f.write(json.dumps(course_json))
-
     logger.info("> Course curriculum retrieved!")
     course = course_json.get("results")
     resource = course_json.get("detail")
 
     if load_from_file:
-        udemy_object = json.loads(
-            open(os.path.join(os.getcwd(), "saved", "_udemy.json"), encoding="utf8", mode="r").read()
-        )
-        if info:
+        if estimate_path:
+            estimate_course(udemy, udemy_object)
+        elif info:
             _print_course_info(udemy, udemy_object)
         else:
             parse_new(udemy, udemy_object)
@@ -1976,7 +2786,7 @@ def main():
             lecture_counter = 0
             lectures = []
 
-            for entry in course:
+            for position, entry in enumerate(course, 1):
                 clazz = entry.get("_class")
 
                 if clazz == "chapter":
@@ -1990,12 +2800,7 @@ def main():
 
                     if chapter_title not in udemy_object["chapters"]:
                         udemy_object["chapters"].append(
-                            {
-                                "chapter_title": chapter_title,
-                                "chapter_id": entry.get("id"),
-                                "chapter_index": chapter_index,
-                                "lectures": [],
-                            }
+                            Chapter(id=entry.get("id"), index=chapter_index, title=chapter_title, lectures=[])
                         )
                         chapter_index_counter += 1
                 elif clazz == "lecture":
@@ -2007,30 +2812,16 @@ def main():
                         chapter_title = "{0:02d} - ".format(chapter_index) + sanitize_filename(entry.get("title"))
                         if chapter_title not in udemy_object["chapters"]:
                             udemy_object["chapters"].append(
-                                {
-                                    "chapter_title": chapter_title,
-                                    "chapter_id": lecture_id,
-                                    "chapter_index": chapter_index,
-                                    "lectures": [],
-                                }
+                                Chapter(id=lecture_id, index=chapter_index, title=chapter_title, lectures=[])
                             )
                             chapter_index_counter += 1
                     if lecture_id:
-                        logger.info(f"Processing {course.index(entry) + 1} of {len(course)}")
+                        logger.info(f"Processing {position} of {len(course)}")
 
-                        lecture_index = entry.get("object_index")
                         lecture_title = "{0:03d} ".format(lecture_counter) + sanitize_filename(entry.get("title"))
 
-                        lectures.append(
-                            {
-                                "index": lecture_counter,
-                                "lecture_index": lecture_index,
-                                "lecture_title": lecture_title,
-                                "_class": entry.get("_class"),
-                                "id": lecture_id,
-                                "data": entry,
-                            }
-                        )
+                        # only what the run needs is kept of the entry
+                        lectures.append(Lecture.from_entry(entry, lecture_counter, lecture_title))
                     else:
                         logger.debug("Lecture: ID is None, skipping")
                 elif clazz == "quiz":
@@ -2042,55 +2833,73 @@ def main():
                         chapter_title = "{0:02d} - ".format(chapter_index) + sanitize_filename(entry.get("title"))
                         if chapter_title not in udemy_object["chapters"]:
                             udemy_object["chapters"].append(
-                                {
-                                    "chapter_title": chapter_title,
-                                    "chapter_id": lecture_id,
-                                    "chapter_index": chapter_index,
-                                    "lectures": [],
-                                }
+                                Chapter(id=lecture_id, index=chapter_index, title=chapter_title, lectures=[])
                             )
                             chapter_index_counter += 1
 
                     if lecture_id:
-                        logger.info(f"Processing {course.index(entry) + 1} of {len(course)}")
+                        logger.info(f"Processing {position} of {len(course)}")
 
-                        lecture_index = entry.get("object_index")
                         lecture_title = "{0:03d} ".format(lecture_counter) + sanitize_filename(entry.get("title"))
 
-                        lectures.append(
-                            {
-                                "index": lecture_counter,
-                                "lecture_index": lecture_index,
-                                "lecture_title": lecture_title,
-                                "_class": entry.get("_class"),
-                                "id": lecture_id,
-                                "data": entry,
-                            }
-                        )
+                        # only what the run needs is kept of the entry
+                        lectures.append(Lecture.from_entry(entry, lecture_counter, lecture_title))
                     else:
                         logger.debug("Quiz: ID is None, skipping")
 
-                udemy_object["chapters"][chapter_index_counter]["lectures"] = lectures
-                udemy_object["chapters"][chapter_index_counter]["lecture_count"] = len(lectures)
+                udemy_object["chapters"][chapter_index_counter].lectures = lectures
 
             udemy_object["total_chapters"] = len(udemy_object["chapters"])
-            udemy_object["total_lectures"] = sum(
-                [entry.get("lecture_count", 0) for entry in udemy_object["chapters"] if entry]
-            )
+            udemy_object["total_lectures"] = sum([chapter.lecture_count for chapter in udemy_object["chapters"]])
+            udemy_object["index"] = CurriculumIndex(udemy_object["chapters"])
+        # the raw curriculum isn't needed anymore, the run holds only the records
+        course_json = course = None
 
         if save_to_file:
-            with open(os.path.join(os.getcwd(), "saved", "_udemy.json"), encoding="utf8", mode="w") as f:
-                # remove "bearer_token" from the object before writing
-                udemy_object.pop("bearer_token")
-                udemy_object["portal_name"] = portal_name
-                f.write(json.dumps(udemy_object))
-            logger.info("> Saved parsed data to json")
-
-        if info:
+            # remove "bearer_token" from the object before writing
+            udemy_object.pop("bearer_token")
+            udemy_object["portal_name"] = portal_name
+            saved_path = SavedCourse.save(SAVED_DIR, saved_course_key, udemy_object)
+            logger.info(f"> Saved parsed data to {saved_path}")
+
+        if estimate_path:
+            estimate_course(udemy, udemy_object)
+        elif info:
             _print_course_info(udemy, udemy_object)
         else:
             parse_new(udemy, udemy_object)
 
+    finish_run(keep_warm)
+    return udemy
+
+
+def finish_run(keep_warm: bool = False):
+    """
+    Waits for the queued encodes of the run
+    """
+    global transcode_queue
+    if transcode_queue:
+        logger.info(f"> Waiting for {transcode_queue.depth} queued encode(s) to finish...")
+        transcode_queue.join(shutdown=not keep_warm)
+        if not keep_warm:
+            transcode_queue = None
+    if stall_count:
+        logger.warning(f"> {stall_count} stalled process(es) were killed and restarted during this run")
+    close_job_store()
+
+
+def close_job_store():
+    """
+    Closes the job store of the run once the queued encodes have recorded their results in it. The daemon runs
+    course after course in one process, each opening a store of its own.
+    """
+    global job_store
+    if transcode_queue:
+        transcode_queue.wait()
+    if job_store:
+        job_store.close()
+        job_store = None
+
 
 if __name__ == "__main__":
     # pre run parses arguments, sets up logging, and creates directories
@@ -0,0 +1,68 @@
+import json
+import os
+import threading
+import time
+
+
+class JobManifest(object):
+    """
+    Append-only JSON Lines record of the files a download run produced.
+    Post-processing reads this back instead of walking the output directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._seen = set()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def add(self, kind, path, unique=True, **fields):
+        """
+        Appends a record, once per (kind, path) unless unique is False (for events like stalls)
+        """
+        path = os.path.abspath(path)
+        key = (kind, path)
+        with self._lock:
+            if unique and key in self._seen:
+                return
+            self._seen.add(key)
+            record = {"kind": kind, "path": path, "time": time.time(), **fields}
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class ManifestReader(object):
+    """
+    Follows a manifest that may still be written to, returning only the records added since the last read
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._offset = 0
+
+    def read_new(self):
+        records = []
+        if not self.path or not os.path.isfile(self.path):
+            return records
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # the writer hasn't finished this line yet (or was killed mid-write)
+                    break
+                self._offset += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line.decode("utf-8")))
+                except ValueError:
+                    continue
+        return records
+
+
+def read_manifest(path):
+    """
+    Returns the records of a manifest, an empty list if the run didn't produce one
+    """
+    return ManifestReader(path).read_new()
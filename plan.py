@@ -0,0 +1,186 @@
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+PLAN_VERSION = 1
+# a claimed shard whose lock hasn't been touched for this long belongs to a worker that died
+CLAIM_STALE_SECONDS = 10 * 60
+HEARTBEAT_SECONDS = 60
+# the options of the exporting run that decide what a worker downloads
+PLAN_OPTIONS = ("dl_assets", "dl_captions", "caption_locale", "keep_vtt", "quality", "skip_lectures")
+
+
+def embed_manifests(lecture: dict):
+    """
+    Copy of a parsed lecture whose playlists/manifests (file:// URLs into this host's temp folder) are embedded,
+    so a worker on another host can download it
+    """
+    lecture = dict(lecture)
+    for key in ("sources", "video_sources"):
+        if key not in lecture:
+            continue
+        sources = []
+        for source in lecture[key] or []:
+            source = dict(source)
+            url = source.get("download_url") or ""
+            if url.startswith("file:"):
+                path = url2pathname(urlparse(url).path)
+                with open(path, "r", encoding="utf-8") as f:
+                    source["download_content"] = f.read()
+                source["download_name"] = os.path.basename(path)
+                source["download_url"] = None
+            sources.append(source)
+        lecture[key] = sources
+    return lecture
+
+
+def restore_manifests(lecture: dict, temp_dir):
+    """
+    Writes the embedded playlists/manifests of a planned lecture to temp_dir and points the sources at them
+    """
+    lecture = dict(lecture)
+    for key in ("sources", "video_sources"):
+        if key not in lecture:
+            continue
+        sources = []
+        for source in lecture[key] or []:
+            source = dict(source)
+            if "download_content" in source:
+                path = Path(temp_dir, source.pop("download_name"))
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(source.pop("download_content"))
+                source["download_url"] = path.as_uri()
+            sources.append(source)
+        lecture[key] = sources
+    return lecture
+
+
+def write_plan(path, course_dir_name, options, entries, total_lectures, shard_size=1):
+    """
+    Writes a download plan: the planned lectures (each {"chapter": chapter_title, "lecture": parsed lecture})
+    in shards of shard_size lectures, in course order
+    """
+    shard_size = max(1, shard_size)
+    shards = [
+        {"id": i + 1, "lectures": entries[start : start + shard_size]}
+        for i, start in enumerate(range(0, len(entries), shard_size))
+    ]
+    plan = {
+        "version": PLAN_VERSION,
+        "created_at": time.time(),
+        "course_dir": course_dir_name,
+        "total_lectures": total_lectures,
+        "options": options,
+        "shards": shards,
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return plan
+
+
+def load_plan(path):
+    with open(path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"unsupported plan version {plan.get('version')}")
+    return plan
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardClaims(object):
+    """
+    Claims on the shards of a plan, as files in <plan>.claims/ next to it on shared storage: a shard is claimed by
+    creating its .lock file (O_EXCL, so only one worker wins) and finished with a .done or .failed file.
+    Claimed workers touch their lock every HEARTBEAT_SECONDS; locks left stale by a dead worker are taken over.
+    """
+
+    def __init__(self, plan_path, worker_id=None, stale_seconds=CLAIM_STALE_SECONDS):
+        self.dir = os.path.abspath(plan_path) + ".claims"
+        self.worker_id = worker_id or default_worker_id()
+        self.stale_seconds = stale_seconds
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _path(self, shard_id, state):
+        return os.path.join(self.dir, f"shard-{shard_id:05d}.{state}")
+
+    def _write(self, path, flags):
+        fd = os.open(path, flags, 0o644)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"worker": self.worker_id, "time": time.time()}, f)
+
+    def claim(self, shard_id, retry_failed=False):
+        if os.path.exists(self._path(shard_id, "done")):
+            return False
+        if os.path.exists(self._path(shard_id, "failed")) and not retry_failed:
+            return False
+        lock_path = self._path(shard_id, "lock")
+        try:
+            self._write(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) < self.stale_seconds:
+                    return False
+                # only one of the workers renaming the stale lock succeeds
+                stale_path = f"{lock_path}.stale-{self.worker_id}"
+                os.rename(lock_path, stale_path)
+                os.remove(stale_path)
+            except OSError:
+                return False
+            return self.claim(shard_id, retry_failed)
+        return True
+
+    def claim_next(self, shard_ids, retry_failed=False):
+        """
+        Claims the first free shard, None when every shard is done, failed or claimed by a live worker
+        """
+        for shard_id in shard_ids:
+            if self.claim(shard_id, retry_failed):
+                return shard_id
+        return None
+
+    def heartbeat(self, shard_id):
+        try:
+            os.utime(self._path(shard_id, "lock"))
+        except OSError:
+            pass
+
+    def release(self, shard_id):
+        """
+        Gives up a claim without finishing the shard, so another worker can take it
+        """
+        try:
+            os.remove(self._path(shard_id, "lock"))
+        except OSError:
+            pass
+
+    def finish(self, shard_id, ok):
+        if ok:
+            failed_path = self._path(shard_id, "failed")
+            if os.path.exists(failed_path):
+                os.remove(failed_path)
+        self._write(self._path(shard_id, "done" if ok else "failed"), os.O_CREAT | os.O_TRUNC | os.O_WRONLY)
+        self.release(shard_id)
+
+    def status(self, shard_ids):
+        """
+        {"done": n, "failed": n, "claimed": n, "pending": n}
+        """
+        counts = {"done": 0, "failed": 0, "claimed": 0, "pending": 0}
+        for shard_id in shard_ids:
+            for state, key in (("done", "done"), ("failed", "failed"), ("lock", "claimed")):
+                if os.path.exists(self._path(shard_id, state)):
+                    counts[key] += 1
+                    break
+            else:
+                counts["pending"] += 1
+        return counts
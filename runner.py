@@ -0,0 +1,459 @@
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger("udemy-downloader.runner")
+
+# lines of output kept for error messages
+OUTPUT_TAIL_LINES = 50
+# progress bars redraw with \r, so both \r and \n end a line
+LINE_END_RE = re.compile(rb"\r\n|\r|\n")
+SIZE_UNITS = {"": 1, "B": 1, "K": 1000, "M": 1000**2, "G": 1000**3, "T": 1000**4}
+
+ProgressEvent = namedtuple(
+    "ProgressEvent",
+    ["tool", "percent", "done", "total", "speed", "eta", "fragment", "fragments"],
+    defaults=(None, None, None, None, None, None, None),
+)
+ProgressEvent.__doc__ = """
+Progress reported by a tool: percent (0-100), done/total (bytes, or frames for ffmpeg), speed (bytes/s,
+or realtime factor for ffmpeg), eta (seconds). Fields the tool didn't report are None.
+"""
+
+
+def parse_size(text):
+    """
+    Converts sizes like '33.2MiB', '400.0KiB' or '1.5G' to bytes
+    """
+    match = re.match(r"~?\s*([\d.]+)\s*([KMGT]?)(i?)B?", text or "")
+    if not match:
+        return None
+    number, unit, binary = match.groups()
+    factor = 1024 ** ("KMGT".index(unit) + 1) if unit and binary else SIZE_UNITS[unit]
+    try:
+        return int(float(number) * factor)
+    except ValueError:
+        return None
+
+
+def parse_eta(text):
+    """
+    Converts ETAs like '00:30', '1:02:03' (yt-dlp) or '4m51s' (aria2c) to seconds
+    """
+    if not text or text.lower() in ("unknown", "n/a"):
+        return None
+    if ":" in text:
+        seconds = 0
+        for part in text.split(":"):
+            if not part.isdigit():
+                return None
+            seconds = seconds * 60 + int(part)
+        return seconds
+    parts = re.findall(r"(\d+)([hms])", text)
+    if not parts:
+        return None
+    return sum(int(value) * {"h": 3600, "m": 60, "s": 1}[unit] for value, unit in parts)
+
+
+class FfmpegProgressParser(object):
+    """
+    Parses the key=value blocks of `ffmpeg -progress pipe:1`. Pass the input duration to get percentages.
+    """
+
+    def __init__(self, duration=None):
+        self.duration = duration
+        self.frames = 0
+        self._block = {}
+
+    def feed(self, line):
+        key, sep, value = line.partition("=")
+        if not sep:
+            return None
+        key = key.strip()
+        value = value.strip()
+        if key != "progress":
+            self._block[key] = value
+            return None
+        block, self._block = self._block, {}
+        if block.get("frame", "").isdigit():
+            self.frames = int(block["frame"])
+        percent = None
+        out_time = block.get("out_time_us") or block.get("out_time_ms")
+        if self.duration and out_time and out_time.isdigit():
+            percent = min(100.0, int(out_time) / 1000000 / self.duration * 100)
+        speed = block.get("speed", "").rstrip("x").strip()
+        try:
+            speed = float(speed)
+        except ValueError:
+            speed = None
+        return ProgressEvent("ffmpeg", percent=percent, done=self.frames, speed=speed)
+
+
+class DownloadProgressParser(object):
+    """
+    Parses yt-dlp `[download]` lines and aria2c readout lines, yt-dlp shows either depending on the downloader
+    """
+
+    YTDLP_RE = re.compile(
+        r"\[download\]\s+(?P<percent>[\d.]+)%\s+of\s+(?P<total>~?\s*[\d.]+\s*\w+)"
+        r"(?:\s+at\s+(?P<speed>\S+))?(?:\s+ETA\s+(?P<eta>\S+))?(?:\s+\(frag\s+(?P<frag>\d+)/(?P<frags>\d+)\))?"
+    )
+    ARIA2_RE = re.compile(
+        r"\[#\w+\s+(?P<done>[\d.]+\w+)/(?P<total>[\d.]+\w+)\((?P<percent>\d+)%\)"
+        r"(?:.*?DL:(?P<speed>[\d.]+\w+))?(?:.*?ETA:(?P<eta>\w+))?"
+    )
+
+    def __init__(self, tool="yt-dlp"):
+        self.tool = tool
+
+    def feed(self, line):
+        match = self.YTDLP_RE.search(line)
+        if match:
+            total = parse_size(match.group("total"))
+            percent = float(match.group("percent"))
+            return ProgressEvent(
+                self.tool,
+                percent=percent,
+                done=int(total * percent / 100) if total else None,
+                total=total,
+                speed=parse_size(match.group("speed")),
+                eta=parse_eta(match.group("eta")),
+                fragment=int(match.group("frag")) if match.group("frag") else None,
+                fragments=int(match.group("frags")) if match.group("frags") else None,
+            )
+        match = self.ARIA2_RE.search(line)
+        if match:
+            return ProgressEvent(
+                self.tool,
+                percent=float(match.group("percent")),
+                done=parse_size(match.group("done")),
+                total=parse_size(match.group("total")),
+                speed=parse_size(match.group("speed")),
+                eta=parse_eta(match.group("eta")),
+            )
+        return None
+
+
+class CombinedProgress(object):
+    """
+    Merges the progress of several processes working on one job (e.g. the video and audio track of a lecture)
+    into a single ProgressEvent stream: bytes and speeds are summed, the ETA is the slowest one's.
+    """
+
+    def __init__(self, on_progress, tool="yt-dlp"):
+        self.on_progress = on_progress
+        self.tool = tool
+        self._lock = threading.Lock()
+        self._events = {}
+
+    def track(self, key):
+        """
+        on_progress callback for one of the processes
+        """
+
+        def on_progress(event):
+            with self._lock:
+                self._events[key] = event
+                events = list(self._events.values())
+            self.on_progress(self.combine(events))
+
+        return on_progress
+
+    def combine(self, events):
+        done = sum(e.done or 0 for e in events)
+        total = sum(e.total or 0 for e in events)
+        etas = [e.eta for e in events if e.eta is not None]
+        return ProgressEvent(
+            self.tool,
+            percent=done / total * 100 if total else None,
+            done=done,
+            total=total or None,
+            speed=sum(e.speed or 0 for e in events) or None,
+            eta=max(etas) if etas else None,
+        )
+
+
+class ProcessResult(object):
+    """
+    Outcome of run(), the same shape for every tool
+    """
+
+    def __init__(
+        self,
+        argv,
+        returncode,
+        elapsed,
+        output=None,
+        stdout="",
+        progress=None,
+        timed_out=False,
+        cancelled=False,
+        stalled=False,
+        error=None,
+    ):
+        self.argv = argv
+        self.returncode = returncode
+        self.elapsed = elapsed
+        # last lines of stdout and stderr (stdout is left out when captured)
+        self.output = list(output or [])
+        self.stdout = stdout
+        self.progress = progress
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+        self.stalled = stalled
+        self.error = error
+
+    @property
+    def ok(self):
+        return (
+            self.returncode == 0 and not self.timed_out and not self.cancelled and not self.stalled and self.error is None
+        )
+
+    @property
+    def not_found(self):
+        return isinstance(self.error, FileNotFoundError)
+
+    def describe(self):
+        """
+        One line explaining why the process failed, for log messages
+        """
+        if self.error is not None:
+            return f"couldn't run {self.argv[0]}: {self.error}"
+        if self.stalled:
+            return f"stalled, no progress for {self.stalled:.0f}s"
+        if self.timed_out:
+            return f"timed out after {self.elapsed:.0f}s"
+        if self.cancelled:
+            return "cancelled"
+        last_line = next((line for line in reversed(self.output) if line.strip()), "")
+        return f"exit code {self.returncode}" + (f": {last_line.strip()}" if last_line else "")
+
+
+def kill_tree(process):
+    """
+    Kills a process started by run() together with any children it spawned
+    """
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == "nt":
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    if process.poll() is None:
+        process.kill()
+
+
+def run(
+    argv,
+    name=None,
+    timeout=None,
+    parser=None,
+    on_progress=None,
+    on_start=None,
+    stop_event=None,
+    cwd=None,
+    capture_stdout=False,
+    stdin_chunks=None,
+    stall_timeout=None,
+    watch_path=None,
+    env=None,
+):
+    """
+    Runs an external tool (ffmpeg, yt-dlp, aria2c, shaka-packager) from an argv list.
+    stdout and stderr are read line by line on background threads: every line is logged at debug level
+    and fed to `parser`, whose ProgressEvents go to `on_progress`. The process is killed when `timeout`
+    seconds pass or `stop_event` is set. With capture_stdout, stdout is returned whole in result.stdout
+    instead (for ffprobe). stdin_chunks (an iterable of bytes) is written to stdin from the calling thread.
+    With stall_timeout, a watchdog kills the process once it makes no progress for that many seconds
+    (result.stalled): progress is a moving ProgressEvent, any output line when there's no parser, or
+    growth of watch_path for tools that stay quiet while writing a file.
+    Never raises for process failures, check result.ok.
+    """
+    name = name or argv[0]
+    start = time.time()
+    try:
+        process = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE if stdin_chunks is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            # own process group, so killing yt-dlp also takes down the aria2c it started
+            start_new_session=os.name != "nt",
+        )
+    except OSError as error:
+        return ProcessResult(argv, None, 0.0, error=error)
+    if on_start:
+        on_start(process)
+
+    lock = threading.Lock()
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    stdout_chunks = []
+    state = {"progress": None, "activity": start, "progress_key": None}
+
+    def handle_line(line):
+        text = line.decode("utf-8", "replace").rstrip()
+        if not text:
+            return
+        logger.debug("[%s]: %s", name, text)
+        event = parser.feed(text) if parser else None
+        with lock:
+            tail.append(text)
+            if event:
+                state["progress"] = event
+                progress_key = (event.done, event.percent, event.fragment)
+                if progress_key != state["progress_key"]:
+                    state["progress_key"] = progress_key
+                    state["activity"] = time.time()
+            elif not parser:
+                state["activity"] = time.time()
+        if event and on_progress:
+            try:
+                on_progress(event)
+            except Exception:
+                logger.exception("Progress callback for %s failed", name)
+
+    def read_lines(pipe):
+        buffer = b""
+        while True:
+            data = pipe.read1(65536) if hasattr(pipe, "read1") else pipe.read(65536)
+            if not data:
+                break
+            buffer += data
+            *lines, buffer = LINE_END_RE.split(buffer)
+            for line in lines:
+                handle_line(line)
+        if buffer:
+            handle_line(buffer)
+        pipe.close()
+
+    def read_all(pipe):
+        stdout_chunks.append(pipe.read())
+        pipe.close()
+
+    readers = [
+        threading.Thread(target=read_all if capture_stdout else read_lines, args=(process.stdout,), daemon=True),
+        threading.Thread(target=read_lines, args=(process.stderr,), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    deadline = start + timeout if timeout else None
+    flags = {"timed_out": False, "cancelled": False, "stalled": 0.0}
+    finished = threading.Event()
+    error = None
+
+    def watchdog():
+        watched_size = None
+        while not finished.wait(0.2):
+            now = time.time()
+            if watch_path:
+                try:
+                    size = os.path.getsize(watch_path)
+                except OSError:
+                    size = None
+                if size != watched_size:
+                    watched_size = size
+                    with lock:
+                        state["activity"] = now
+            with lock:
+                idle = now - state["activity"]
+            if deadline and now > deadline:
+                flags["timed_out"] = True
+            elif stop_event is not None and stop_event.is_set():
+                flags["cancelled"] = True
+            elif stall_timeout and idle > stall_timeout:
+                flags["stalled"] = idle
+                logger.warning("%s made no progress for %.0fs, killing it", name, idle)
+            else:
+                continue
+            kill_tree(process)
+            return
+
+    watchdog_thread = threading.Thread(target=watchdog, daemon=True)
+    watchdog_thread.start()
+
+    if stdin_chunks is not None:
+        try:
+            for chunk in stdin_chunks:
+                if process.poll() is not None:
+                    break
+                process.stdin.write(chunk)
+                with lock:
+                    # bytes going in count as progress even before the first frame comes out
+                    state["activity"] = time.time()
+        except BrokenPipeError:
+            # the process exited early, its exit code tells why
+            pass
+        except Exception as e:
+            error = e
+            kill_tree(process)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    try:
+        process.wait()
+    except BaseException:
+        # Ctrl+C doesn't reach a separate process group
+        kill_tree(process)
+        raise
+    finally:
+        finished.set()
+    watchdog_thread.join()
+    timed_out, cancelled, stalled = flags["timed_out"], flags["cancelled"], flags["stalled"]
+    if process.returncode != 0 and stop_event is not None and stop_event.is_set():
+        # killed by whoever set the event before we got to it
+        cancelled = True
+    for reader in readers:
+        reader.join()
+    elapsed = time.time() - start
+    result = ProcessResult(
+        argv,
+        process.returncode,
+        elapsed,
+        output=tail,
+        stdout=b"".join(stdout_chunks).decode("utf-8", "replace"),
+        progress=state["progress"],
+        timed_out=timed_out,
+        cancelled=cancelled,
+        stalled=stalled,
+        error=error,
+    )
+    if not result.ok:
+        logger.debug("%s failed after %.1fs: %s", name, elapsed, result.describe())
+    return result
+
+
+def run_with_retries(argv, retries=2, retry_delay=5, on_stall=None, **kwargs):
+    """
+    run() that starts the tool again when it stalls, up to `retries` times. Regular failures aren't retried,
+    aria2c (-c) and yt-dlp pick up their partial downloads. on_stall(result, attempt) records each stall.
+    """
+    for attempt in range(retries + 1):
+        result = run(argv, **kwargs)
+        if not result.stalled:
+            return result
+        if on_stall:
+            on_stall(result, attempt)
+        if attempt < retries:
+            logger.warning(
+                "Restarting %s after a stall (retry %d of %d)", kwargs.get("name") or argv[0], attempt + 1, retries
+            )
+            time.sleep(retry_delay)
+    return result
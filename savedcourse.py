@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+import zlib
+
+from curriculum import Chapter, CurriculumIndex, Lecture, course_index, load_course
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+SAVED_COURSE_VERSION = 2
+SAVED_COURSES_DIR = "courses"
+# what --save-to-file wrote before, one course for every course
+LEGACY_FILES = ("course_content.json", "_udemy.json")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    position INTEGER PRIMARY KEY,
+    id,
+    chapter_index INTEGER,
+    title TEXT,
+    lecture_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lectures (
+    chapter_position INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT,
+    -- id_to_title.json of the whole course, without unpacking the lectures
+    file_name TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (chapter_position, position)
+);
+CREATE INDEX IF NOT EXISTS lectures_id ON lectures (id);
+"""
+
+
+def _pack(lecture):
+    return zlib.compress(json.dumps(lecture.to_dict(), separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(blob):
+    return Lecture.from_dict(json.loads(zlib.decompress(blob)))
+
+
+class SavedCourse(object):
+    """
+    A parsed course saved by --save-to-file, one SQLite file per course (saved/courses/<portal>_<course>.sqlite3):
+    the course fields, the chapters, and every lecture as compressed json in its own row, so chapters and
+    lectures are read only when asked for. The file is written next to its final name and moved there
+    once complete, a run loading it never sees half a course.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SAVED_COURSE_VERSION:
+            self._conn.close()
+            raise ValueError(f"unsupported saved course version {version} in {path}")
+
+    @staticmethod
+    def path_for(saved_dir, course_key):
+        return os.path.join(saved_dir, SAVED_COURSES_DIR, f"{course_key}.sqlite3")
+
+    @classmethod
+    def open(cls, saved_dir, course_key):
+        """
+        The saved course, None if it hasn't been saved
+        """
+        path = cls.path_for(saved_dir, course_key)
+        if not os.path.isfile(path):
+            return None
+        return cls(path)
+
+    @classmethod
+    def save(cls, saved_dir, course_key, udemy_object):
+        """
+        Saves a parsed course (udemy_object), replacing an earlier save of it. Returns the path.
+        """
+        path = cls.path_for(saved_dir, course_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            with conn:
+                conn.executescript(SCHEMA)
+                fields = {key: value for key, value in udemy_object.items() if key not in ("chapters", "index")}
+                fields["saved_at"] = time.time()
+                conn.executemany(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(value)) for key, value in fields.items()],
+                )
+                file_names = course_index(udemy_object).id_to_title()
+                for position, chapter in enumerate(udemy_object.get("chapters", [])):
+                    conn.execute(
+                        "INSERT INTO chapters (position, id, chapter_index, title, lecture_count) VALUES (?, ?, ?, ?, ?)",
+                        (position, chapter.id, chapter.index, chapter.title, chapter.lecture_count),
+                    )
+                    conn.executemany(
+                        "INSERT INTO lectures (chapter_position, position, id, file_name, data) VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (
+                                position,
+                                lecture_position,
+                                str(lecture.id),
+                                file_names.get(str(lecture.id)),
+                                _pack(lecture),
+                            )
+                            for lecture_position, lecture in enumerate(chapter.lectures)
+                        ],
+                    )
+            # written last: a file without it is rejected as unfinished
+            conn.execute(f"PRAGMA user_version = {SAVED_COURSE_VERSION}")
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        return path
+
+    def meta(self):
+        """
+        The course fields (course_id, title, course_title, portal_name, total_chapters, total_lectures, ...)
+        """
+        return {key: json.loads(value) for key, value in self._conn.execute("SELECT key, value FROM meta")}
+
+    def chapter_indexes(self):
+        return [row[0] for row in self._conn.execute("SELECT chapter_index FROM chapters ORDER BY position")]
+
+    def chapters(self, chapter_filter=None):
+        """
+        The chapters, with their lectures, in course order. Only the chapters whose index is in chapter_filter
+        are read when it's set.
+        """
+        chapters = []
+        for position, chapter_id, chapter_index, title, _ in self._conn.execute(
+            "SELECT * FROM chapters ORDER BY position"
+        ):
+            if chapter_filter is not None and chapter_index not in chapter_filter:
+                continue
+            lectures = [
+                _unpack(row[0])
+                for row in self._conn.execute(
+                    "SELECT data FROM lectures WHERE chapter_position = ? ORDER BY position", (position,)
+                )
+            ]
+            chapters.append(Chapter(id=chapter_id, index=chapter_index, title=title, lectures=lectures))
+        return chapters
+
+    def file_names(self):
+        """
+        {lecture id: base file name} of every lecture of the course
+        """
+        return dict(self._conn.execute("SELECT id, file_name FROM lectures WHERE file_name IS NOT NULL"))
+
+    def lecture(self, lecture_id):
+        row = self._conn.execute("SELECT data FROM lectures WHERE id = ?", (str(lecture_id),)).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def load(self, chapter_filter=None):
+        """
+        The parsed course as --save-to-file saved it, with only the chapters in chapter_filter when it's set.
+        Its index still names every lecture of the course.
+        """
+        chapters = self.chapters(chapter_filter)
+        file_names = self.file_names() if chapter_filter is not None else None
+        return {**self.meta(), "chapters": chapters, "index": CurriculumIndex(chapters, file_names)}
+
+    def close(self):
+        self._conn.close()
+
+
+def load_legacy(saved_dir):
+    """
+    (course_content, parsed course) from the single-course files of older versions, None if there aren't any
+    """
+    paths = [os.path.join(saved_dir, name) for name in LEGACY_FILES]
+    if not all(os.path.isfile(path) for path in paths):
+        return None
+    with open(paths[0], "r", encoding="utf8") as f:
+        course_json = json.load(f)
+    with open(paths[1], "r", encoding="utf8") as f:
+        udemy_object = load_course(json.load(f))
+    return course_json, udemy_object
+
+
+def _peak_rss():
+    """
+    Peak resident set size of this process in bytes, None where the platform doesn't report it
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _measure(mode, path):
+    """
+    Loads a course the way `mode` says, in this process; prints {"seconds", "rss_bytes", "lectures"} as json
+    """
+    rss_before = _peak_rss()
+    started = time.perf_counter()
+    if mode == "legacy":
+        _, udemy_object = load_legacy(path)
+        lectures = len(udemy_object["index"])
+    else:
+        saved = SavedCourse(path)
+        if mode == "full":
+            lectures = len(saved.load()["index"])
+        else:
+            # what a run filtered to one chapter reads
+            lectures = len(saved.load(set(saved.chapter_indexes()[:1]))["index"])
+        saved.close()
+    seconds = time.perf_counter() - started
+    rss_after = _peak_rss()
+    rss = rss_after - rss_before if rss_before is not None else None
+    print(json.dumps({"seconds": seconds, "rss_bytes": rss, "lectures": lectures}))
+
+
+def benchmark(saved_dir, course_key, runs=3):
+    """
+    Load time and peak RSS growth of the saved course against the legacy files in saved_dir, every load in a
+    fresh interpreter so they don't share caches or memory. Returns {mode: [measurement per run]}.
+    """
+    targets = {
+        "legacy": saved_dir,
+        "full": SavedCourse.path_for(saved_dir, course_key),
+        "one_chapter": SavedCourse.path_for(saved_dir, course_key),
+    }
+    results = {}
+    for mode, path in targets.items():
+        results[mode] = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "measure", mode, path],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            results[mode].append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Saved courses of --save-to-file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Saves the course of the legacy saved/*.json files per course")
+    convert.add_argument("course_key", help="Name to save it under, <portal>_<course slug> as main.py names them")
+    convert.add_argument("--saved-dir", default="saved")
+    bench = commands.add_parser("benchmark", help="Compares loading a saved course with loading the legacy files")
+    bench.add_argument("course_key")
+    bench.add_argument("--saved-dir", default="saved")
+    bench.add_argument("--runs", type=int, default=3)
+    measure = commands.add_parser("measure")
+    measure.add_argument("mode", choices=("legacy", "full", "one_chapter"))
+    measure.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "measure":
+        _measure(args.mode, args.path)
+    elif args.command == "convert":
+        legacy = load_legacy(args.saved_dir)
+        if legacy is None:
+            sys.exit(f"No {' and '.join(LEGACY_FILES)} in {args.saved_dir}")
+        print(SavedCourse.save(args.saved_dir, args.course_key, legacy[1]))
+    else:
+        sizes = {
+            "legacy": sum(os.path.getsize(os.path.join(args.saved_dir, name)) for name in LEGACY_FILES),
+            "full": os.path.getsize(SavedCourse.path_for(args.saved_dir, args.course_key)),
+        }
+        sizes["one_chapter"] = sizes["full"]
+        results = benchmark(args.saved_dir, args.course_key, args.runs)
+        print(f"{'format':<12} {'file size':>12} {'lectures':>9} {'best load':>10} {'peak RSS growth':>16}")
+        for mode, runs in results.items():
+            rss = [run["rss_bytes"] for run in runs if run["rss_bytes"] is not None]
+            print(
+                f"{mode:<12} {sizes[mode] / 1024 / 1024:>10.1f}MB {runs[0]['lectures']:>9} "
+                f"{min(run['seconds'] for run in runs) * 1000:>8.0f}ms "
+                + (f"{min(rss) / 1024 / 1024:>14.1f}MB" if rss else f"{'n/a':>16}")
+            )
+
+
+if __name__ == "__main__":
+    main()
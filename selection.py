@@ -0,0 +1,135 @@
+import json
+import re
+
+from curriculum import course_index
+
+# keys of a rules file, the CLI options override them
+RULE_KEYS = ("chapters", "lectures", "title", "exclude_title", "types", "max_duration")
+
+
+def parse_ranges(text):
+    """
+    Given a string like "1,3-5,7,9-11", return a set of numbers. Raises ValueError for anything else.
+    """
+    numbers = set()
+    for part in str(text).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            numbers.update(range(int(start), int(end) + 1))
+        else:
+            numbers.add(int(part))
+    return numbers
+
+
+def normalize_type(value):
+    """
+    "E-Book" -> "ebook", "ExternalLink" -> "externallink"
+    """
+    return re.sub(r"[^a-z0-9]", "", str(value).lower())
+
+
+def lecture_type(lecture):
+    """
+    The asset type of a lecture (video, article, file, ebook, ...), or its class for quizzes and practice tests
+    """
+    if lecture.clazz != "lecture":
+        return normalize_type(lecture.clazz)
+    return normalize_type(lecture.asset_type or "")
+
+
+class SelectionRules(object):
+    """
+    Non-interactive lecture selection: every rule that is set must match.
+    chapters/lectures are sets of numbers (the lecture number is the one in the file names), title and
+    exclude_title are regular expressions searched in the lecture title, types are asset types (see lecture_type)
+    and max_duration is in seconds; lectures without a known duration aren't filtered by it.
+    """
+
+    def __init__(self, chapters=None, lectures=None, title=None, exclude_title=None, types=None, max_duration=None):
+        self.chapters = chapters
+        self.lectures = lectures
+        self.title = re.compile(title, re.IGNORECASE) if title else None
+        self.exclude_title = re.compile(exclude_title, re.IGNORECASE) if exclude_title else None
+        self.types = {normalize_type(t) for t in types} if types else None
+        self.max_duration = max_duration
+
+    @classmethod
+    def from_dict(cls, rules):
+        """
+        Rules as written in a rules file or given on the command line: ranges as strings ("1,3-5") or lists,
+        types as a comma separated string or a list, max_duration in minutes
+        """
+        unknown = set(rules) - set(RULE_KEYS)
+        if unknown:
+            raise ValueError(f"unknown selection rule(s): {', '.join(sorted(unknown))}")
+
+        def numbers(value):
+            if value is None or value == "":
+                return None
+            if isinstance(value, (list, tuple)):
+                return set().union(*(parse_ranges(v) for v in value))
+            return parse_ranges(value)
+
+        types = rules.get("types")
+        if isinstance(types, str):
+            types = [t for t in types.split(",") if t.strip()]
+        max_duration = rules.get("max_duration")
+        return cls(
+            chapters=numbers(rules.get("chapters")),
+            lectures=numbers(rules.get("lectures")),
+            title=rules.get("title"),
+            exclude_title=rules.get("exclude_title"),
+            types=types,
+            max_duration=float(max_duration) * 60 if max_duration not in (None, "") else None,
+        )
+
+    @classmethod
+    def from_file(cls, path, overrides=None):
+        with open(path, "r", encoding="utf-8") as f:
+            rules = json.load(f)
+        rules.update({key: value for key, value in (overrides or {}).items() if value is not None})
+        return cls.from_dict(rules)
+
+    def matches(self, chapter, lecture):
+        if self.chapters is not None and int(chapter.index) not in self.chapters:
+            return False
+        if self.lectures is not None and int(lecture.index) not in self.lectures:
+            return False
+        title = lecture.title or lecture.lecture_title or ""
+        if self.title and not self.title.search(title):
+            return False
+        if self.exclude_title and self.exclude_title.search(title):
+            return False
+        if self.types is not None and lecture_type(lecture) not in self.types:
+            return False
+        if self.max_duration is not None:
+            duration = lecture.duration
+            if duration is not None and duration > self.max_duration:
+                return False
+        return True
+
+    def select(self, udemy_object):
+        """
+        Ids of the lectures of a parsed course that match every rule
+        """
+        candidates = course_index(udemy_object).filtered(self.chapters, self.lectures)
+        return {lecture.id for chapter, lecture in candidates if self.matches(chapter, lecture)}
+
+    def describe(self):
+        rules = []
+        if self.chapters is not None:
+            rules.append(f"chapters {sorted(self.chapters)}")
+        if self.lectures is not None:
+            rules.append(f"lectures {sorted(self.lectures)}")
+        if self.title:
+            rules.append(f"title ~ /{self.title.pattern}/")
+        if self.exclude_title:
+            rules.append(f"title !~ /{self.exclude_title.pattern}/")
+        if self.types is not None:
+            rules.append(f"type in {sorted(self.types)}")
+        if self.max_duration is not None:
+            rules.append(f"at most {self.max_duration / 60:g} min")
+        return ", ".join(rules) or "no rules (everything)"
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from collections import namedtuple
+
+logger = logging.getLogger("udemy-downloader.sync")
+
+SNAPSHOT_NAME = ".sync_snapshot.json"
+SNAPSHOT_VERSION = 1
+RETIRED_DIR_NAME = ".sync_replaced"
+
+# the parts of a lecture that are compared, and re-downloaded on their own when they change
+PARTS = ("media", "captions", "assets")
+
+# changed: {lecture_id: set of changed parts}, renamed: {lecture_id: (old title, new title)}
+SyncDiff = namedtuple("SyncDiff", ["added", "changed", "removed", "renamed", "unchanged"])
+
+
+def _digest(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def lecture_fingerprint(lecture):
+    """
+    Digests of a curriculum lecture by part. Only ids, types and created dates are used: media URLs are signed
+    and change on every fetch, and titles/positions only change the numbering, not the content.
+    """
+    media = [
+        lecture.clazz,
+        lecture.created,
+        lecture.type,
+        lecture.asset_id,
+        lecture.asset_type,
+        lecture.asset_created,
+        lecture.asset_filename,
+    ]
+    captions = sorted([str(c.id), c.locale, c.created] for c in lecture.captions)
+    assets = sorted(
+        [str(a.id), a.asset_type, a.filename, a.created] for a in lecture.assets if a.supplementary
+    )
+    return {"media": _digest(media), "captions": _digest(captions), "assets": _digest(assets)}
+
+
+def build_snapshot(udemy_object: dict):
+    """
+    Snapshot of a parsed course: every lecture and quiz by id, with its chapter, title and fingerprint
+    """
+    lectures = {}
+    for chapter in udemy_object.get("chapters", []):
+        for lecture in chapter.lectures:
+            lectures[str(lecture.id)] = {
+                "chapter": chapter.title,
+                "title": lecture.lecture_title,
+                "class": lecture.clazz,
+                **lecture_fingerprint(lecture),
+            }
+    return {
+        "version": SNAPSHOT_VERSION,
+        "course_id": udemy_object.get("course_id"),
+        "synced_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "lectures": lectures,
+    }
+
+
+def snapshot_path(course_dir):
+    return os.path.join(course_dir, SNAPSHOT_NAME)
+
+
+def load_snapshot(course_dir):
+    """
+    Returns the snapshot of the last sync of a course, None if it was never synced (or by an older version)
+    """
+    path = snapshot_path(course_dir)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except ValueError:
+        logger.warning(f"> Sync snapshot {path} is unreadable, syncing the whole course")
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def save_snapshot(course_dir, snapshot):
+    path = snapshot_path(course_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def diff_snapshots(old, new):
+    """
+    Compares two snapshots lecture by lecture. Without an old snapshot every lecture is added.
+    """
+    old_lectures = (old or {}).get("lectures", {})
+    new_lectures = new.get("lectures", {})
+    added, removed, unchanged = [], [], []
+    changed, renamed = {}, {}
+    for lecture_id, entry in new_lectures.items():
+        previous = old_lectures.get(lecture_id)
+        if previous is None:
+            added.append(lecture_id)
+            continue
+        parts = {part for part in PARTS if previous.get(part) != entry.get(part)}
+        if parts:
+            changed[lecture_id] = parts
+        else:
+            unchanged.append(lecture_id)
+        if previous.get("title") != entry.get("title") or previous.get("chapter") != entry.get("chapter"):
+            renamed[lecture_id] = (previous.get("title"), entry.get("title"))
+    removed = [lecture_id for lecture_id in old_lectures if lecture_id not in new_lectures]
+    return SyncDiff(added, changed, removed, renamed, unchanged)
+
+
+def merge_snapshot(old, new, synced_ids):
+    """
+    The snapshot to store after a sync: the new entry of every lecture that is now up to date, the old one of
+    changed lectures that weren't synced (skipped by a filter or failed), so the next sync picks them up again.
+    Added lectures that weren't synced are left out for the same reason, removed ones are dropped.
+    """
+    old_lectures = (old or {}).get("lectures", {})
+    new_lectures = new.get("lectures", {})
+    diff = diff_snapshots(old, new)
+    lectures = {}
+    for lecture_id, entry in new_lectures.items():
+        if lecture_id in synced_ids or lecture_id in diff.unchanged:
+            lectures[lecture_id] = entry
+        elif lecture_id in old_lectures:
+            lectures[lecture_id] = old_lectures[lecture_id]
+    return {**new, "lectures": lectures}
+
+
+def retire_files(paths, course_dir):
+    """
+    Moves the outputs of a changed lecture out of the way (into <course>/.sync_replaced/<time>/), so the
+    downloaders don't mistake them for the new version. Nothing is deleted. Returns the new paths.
+    """
+    retired_dir = os.path.join(course_dir, RETIRED_DIR_NAME, time.strftime("%Y-%m-%d-%H-%M-%S"))
+    moved = []
+    for path in paths:
+        if not path or not os.path.isfile(path):
+            continue
+        relative = os.path.relpath(path, course_dir)
+        if relative.startswith(os.pardir):
+            relative = os.path.basename(path)
+        target = os.path.join(retired_dir, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+        moved.append(target)
+    return moved
@@ -0,0 +1,577 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from runner import FfmpegProgressParser, run, run_with_retries
+
+logger = logging.getLogger("udemy-downloader.transcode")
+
+# libx265 doesn't scale much past this many threads per encode, extra cores are better spent on more encodes
+X265_THREADS_PER_ENCODE = 4
+# consumer NVIDIA cards only allow a handful of concurrent NVENC sessions
+NVENC_MAX_WORKERS = 2
+# chunked encodes accept an output duration this far off the source (seconds, or fraction of the duration)
+CHUNK_DURATION_TOLERANCE = 0.5
+CHUNK_DURATION_TOLERANCE_RATIO = 0.01
+# codec tags that are already H.265, as found in HLS CODECS attributes and ffprobe codec names
+HEVC_CODECS = ("hvc1", "hev1", "hevc")
+# ffprobe only reads headers (or packet headers with count_packets), anything slower is stuck
+PROBE_TIMEOUT = 120
+
+_nvenc_available = None
+
+
+def nvenc_available(ffmpeg="ffmpeg"):
+    """
+    Checks whether this ffmpeg build can actually encode with hevc_nvenc on this host (result is cached)
+    """
+    global _nvenc_available
+    if _nvenc_available is None:
+        cmd = [
+            ffmpeg,
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "color=c=black:s=256x256:d=0.1",
+            "-c:v",
+            "hevc_nvenc",
+            "-f",
+            "null",
+            "-",
+        ]
+        _nvenc_available = run(cmd, name="nvenc-check", timeout=30).ok
+    return _nvenc_available
+
+
+def probe_media(path, count_packets=False, ffprobe="ffprobe"):
+    """
+    Returns the container duration and the video packet count (if count_packets) of a file
+    """
+    cmd = [ffprobe, "-v", "error", "-show_entries", "format=duration:stream=nb_read_packets", "-of", "json"]
+    if count_packets:
+        cmd += ["-count_packets", "-select_streams", "v:0"]
+    result = run(cmd + [path], timeout=PROBE_TIMEOUT, capture_stdout=True)
+    if not result.ok:
+        return None, None
+    data = json.loads(result.stdout or "{}")
+    duration = data.get("format", {}).get("duration")
+    packets = None
+    if count_packets and data.get("streams"):
+        packets = data["streams"][0].get("nb_read_packets")
+    return (float(duration) if duration else None), (int(packets) if packets else None)
+
+
+def probe_video(path, ffprobe="ffprobe"):
+    """
+    Reads the video codec name, overall bitrate (bits/s) and duration from the file headers
+    """
+    cmd = [
+        ffprobe,
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=codec_name:format=bit_rate,duration",
+        "-of",
+        "json",
+        path,
+    ]
+    result = run(cmd, timeout=PROBE_TIMEOUT, capture_stdout=True)
+    if not result.ok:
+        return None, None, None
+    data = json.loads(result.stdout or "{}")
+    streams = data.get("streams") or [{}]
+    fmt = data.get("format", {})
+    bit_rate = fmt.get("bit_rate")
+    duration = fmt.get("duration")
+    return (
+        streams[0].get("codec_name"),
+        int(bit_rate) if bit_rate else None,
+        float(duration) if duration else None,
+    )
+
+
+class TranscodeQueue(object):
+    """
+    Runs H.265 encodes in a bounded worker pool so downloads don't wait on ffmpeg.
+    Uses hevc_nvenc when requested and usable, libx265 with an explicit thread budget otherwise.
+    With chunk_seconds set, sources longer than two chunks are split at keyframes and the chunks are
+    encoded in parallel, so a single long lecture can keep every core busy.
+    """
+
+    def __init__(
+        self,
+        crf=28,
+        preset="medium",
+        use_nvenc=False,
+        workers=None,
+        chunk_seconds=None,
+        min_bitrate=None,
+        ffmpeg="ffmpeg",
+        stall_timeout=None,
+        stall_retries=0,
+        on_stall=None,
+    ):
+        self.crf = crf
+        self.preset = preset
+        self.min_bitrate = min_bitrate
+        self.ffmpeg = ffmpeg
+        self.ffprobe = os.path.join(os.path.dirname(ffmpeg), "ffprobe") if os.path.dirname(ffmpeg) else "ffprobe"
+        self.chunk_seconds = chunk_seconds
+        # encodes that stop producing frames for stall_timeout seconds are killed and restarted,
+        # on_stall(tool, path) returns the callback that records it
+        self.stall_timeout = stall_timeout
+        self.stall_retries = stall_retries
+        self.on_stall = on_stall
+        cores = os.cpu_count() or 1
+
+        self.use_nvenc = use_nvenc and nvenc_available(ffmpeg)
+        if use_nvenc and not self.use_nvenc:
+            logger.warning("> NVENC was requested but isn't usable on this host, falling back to libx265")
+
+        if self.use_nvenc:
+            self.workers = workers or NVENC_MAX_WORKERS
+            self.threads = None
+        else:
+            self.workers = workers or max(1, cores // X265_THREADS_PER_ENCODE)
+            self.threads = max(1, cores // self.workers)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcode")
+        # separate pool so a worker waiting on its chunks can never starve them
+        self._chunk_executor = None
+        if self.chunk_seconds:
+            self._chunk_executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcode-chunk")
+        # one slot per encoder process, shared by whole-file, chunk and streaming encodes so together they never
+        # run more than `workers` encodes of `threads` threads. Held only while ffmpeg encodes: a worker waiting
+        # on its chunks doesn't keep one.
+        self._encode_slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self._futures = []
+        self._pending = 0
+        self.encoded = 0
+        self.failed = 0
+        self.frames = 0
+        self.encode_seconds = 0.0
+        self.media_seconds = 0.0
+        self.skipped = 0
+        self.skipped_media_seconds = 0.0
+
+        logger.info(
+            "> Transcode queue: %d worker(s) using %s%s",
+            self.workers,
+            "hevc_nvenc" if self.use_nvenc else "libx265",
+            "" if self.threads is None else f" ({self.threads} threads each)",
+        )
+
+    @property
+    def depth(self):
+        """
+        Number of encodes queued or running
+        """
+        with self._lock:
+            return self._pending
+
+    @property
+    def fps(self):
+        """
+        Average encode speed in frames per second of encoder time
+        """
+        with self._lock:
+            return self.frames / self.encode_seconds if self.encode_seconds else 0.0
+
+    def encoder_args(self, crf=None, preset=None):
+        crf = self.crf if crf is None else crf
+        preset = preset or self.preset
+        if self.use_nvenc:
+            return ["-c:v", "hevc_nvenc", "-vtag", "hvc1", "-rc", "vbr", "-cq", str(crf), "-preset", preset]
+        return [
+            "-c:v",
+            "libx265",
+            "-vtag",
+            "hvc1",
+            "-crf",
+            str(crf),
+            "-preset",
+            preset,
+            "-threads",
+            str(self.threads),
+            "-x265-params",
+            f"pools={self.threads}:log-level=error",
+        ]
+
+    def skip_reason(self, source_path, codecs=None, bitrate=None, probe=None):
+        """
+        Returns why re-encoding source_path would waste CPU, or None if it should be encoded.
+        codecs/bitrate come from the HLS playlist when known, otherwise from probe (what probe_video returned
+        for source_path) or the file headers.
+        """
+        codec_names = [c.strip().lower() for c in codecs.split(",")] if codecs else []
+        if not codec_names or not bitrate:
+            codec_name, probed_bitrate, _ = probe or probe_video(source_path, ffprobe=self.ffprobe)
+            if codec_name:
+                codec_names.append(codec_name.lower())
+            bitrate = bitrate or probed_bitrate
+        if any(name.startswith(HEVC_CODECS) for name in codec_names):
+            return "source is already H.265"
+        if self.min_bitrate and bitrate and bitrate < self.min_bitrate:
+            return f"source bitrate {bitrate // 1000} kbps is below {self.min_bitrate // 1000} kbps"
+        return None
+
+    def submit(self, source_path, title=None, codecs=None, bitrate=None, on_done=None):
+        """
+        Queues source_path to be re-encoded in place, unless that wouldn't make it any smaller.
+        on_done() runs in the encode's worker once the file is replaced, so join() waits for it too.
+        """
+        title = title or os.path.basename(source_path)
+        # the one probe of the file, its duration is counted whether it's encoded or kept
+        probe = probe_video(source_path, ffprobe=self.ffprobe)
+        duration = probe[2]
+        reason = self.skip_reason(source_path, codecs, bitrate, probe)
+        if reason:
+            with self._lock:
+                self.skipped += 1
+                self.skipped_media_seconds += duration or 0.0
+            logger.info("      > Keeping the downloaded video as is, %s", reason)
+            return None
+
+        with self._lock:
+            self._pending += 1
+            depth = self._pending
+        future = self._executor.submit(self._run, source_path, title, duration, on_done)
+        with self._lock:
+            self._futures.append(future)
+        logger.info("      > Queued for H.265 encoding (queue depth: %d)", depth)
+        return future
+
+    def _run(self, source_path, title, duration, on_done=None):
+        try:
+            encoded = self._encode(source_path, title, duration)
+            if encoded and on_done:
+                on_done()
+            return encoded
+        except Exception:
+            logger.exception("      > Error encoding '%s'", title)
+            if os.path.exists(source_path + ".tmp"):
+                os.unlink(source_path + ".tmp")
+            with self._lock:
+                self.failed += 1
+            return False
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _encode(self, source_path, title, duration):
+        tmp_file_path = source_path + ".tmp"
+        start = time.time()
+        frames = self.encode(source_path, tmp_file_path, title, duration)
+        elapsed = time.time() - start
+
+        if frames is None:
+            if os.path.exists(tmp_file_path):
+                os.unlink(tmp_file_path)
+            with self._lock:
+                self.failed += 1
+            return False
+
+        os.unlink(source_path)
+        os.rename(tmp_file_path, source_path)
+        with self._lock:
+            self.encoded += 1
+            self.frames += frames
+            self.encode_seconds += elapsed
+            self.media_seconds += duration or 0.0
+            remaining = self._pending - 1
+        logger.info(
+            "      > Encoded '%s' in %.1fs (%.1f fps), %d left in queue",
+            title,
+            elapsed,
+            frames / elapsed if elapsed else 0.0,
+            remaining,
+        )
+        return True
+
+    def encode(self, source_path, output_path, title, duration=None):
+        """
+        Encodes source_path into output_path, in parallel chunks when enabled and the source is long enough.
+        duration is the source's when the caller already probed it. Returns the frame count or None on failure.
+        """
+        if self.chunk_seconds:
+            if duration is None:
+                duration, _ = probe_media(source_path, ffprobe=self.ffprobe)
+            if duration and duration > 2 * self.chunk_seconds:
+                frames = self.encode_chunked(source_path, output_path, title)
+                if frames is not None:
+                    return frames
+        return self.encode_file(source_path, output_path, title)
+
+    def encode_file(self, source_path, output_path, title, audio=True, crf=None, preset=None):
+        """
+        Encodes source_path into output_path with a single ffmpeg process, returns the frame count or None on failure
+        """
+        hwaccel = ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"] if self.use_nvenc else []
+        audio_args = ["-c:a", "copy"] if audio else ["-an"]
+        cmd = [
+            self.ffmpeg,
+            "-nostdin",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            *hwaccel,
+            "-y",
+            "-i",
+            source_path,
+            *self.encoder_args(crf, preset),
+            *audio_args,
+            "-f",
+            "mp4",
+            "-progress",
+            "pipe:1",
+            "-nostats",
+            output_path,
+        ]
+        parser = FfmpegProgressParser()
+        with self._encode_slots:
+            result = run_with_retries(
+                cmd,
+                name="ffmpeg",
+                parser=parser,
+                stall_timeout=self.stall_timeout,
+                retries=self.stall_retries if self.stall_timeout else 0,
+                on_stall=self.on_stall("ffmpeg", output_path) if self.on_stall else None,
+            )
+        if not result.ok:
+            logger.error("      > Encoding '%s' failed: %s", title, result.describe())
+            return None
+        return parser.frames
+
+    def encode_stream(self, chunks, output_path, title, input_format=None, duration=None):
+        """
+        Encodes a source fed through ffmpeg's stdin as it downloads, so only the encoded file touches the disk.
+        Runs on the calling thread. Returns True on success; output_path is left untouched on failure.
+        """
+        tmp_file_path = output_path + ".tmp"
+        format_args = ["-f", input_format] if input_format else []
+        cmd = [
+            self.ffmpeg,
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            *format_args,
+            "-i",
+            "pipe:0",
+            *self.encoder_args(),
+            "-c:a",
+            "copy",
+            "-f",
+            "mp4",
+            "-progress",
+            "pipe:1",
+            "-nostats",
+            tmp_file_path,
+        ]
+        parser = FfmpegProgressParser(duration)
+        # can't be restarted, the segments already fed to it are gone; a stall falls back to a regular download
+        with self._encode_slots:
+            result = run(cmd, name="ffmpeg", parser=parser, stdin_chunks=chunks, stall_timeout=self.stall_timeout)
+        if result.stalled and self.on_stall:
+            self.on_stall("ffmpeg", output_path)(result, 0)
+        elapsed = result.elapsed
+
+        if not result.ok:
+            if result.error is not None and not result.not_found:
+                logger.error("      > Downloading '%s' for the streaming encode failed: %s", title, result.error)
+            else:
+                logger.error("      > Streaming encode of '%s' failed: %s", title, result.describe())
+            if os.path.exists(tmp_file_path):
+                os.unlink(tmp_file_path)
+            with self._lock:
+                self.failed += 1
+            return False
+
+        os.replace(tmp_file_path, output_path)
+        frames = parser.frames
+        with self._lock:
+            self.encoded += 1
+            self.frames += frames
+            self.encode_seconds += elapsed
+            self.media_seconds += duration or 0.0
+        logger.info(
+            "      > Downloaded and encoded '%s' in %.1fs (%.1f fps)",
+            title,
+            elapsed,
+            frames / elapsed if elapsed else 0.0,
+        )
+        return True
+
+    def encode_chunked(self, source_path, output_path, title):
+        """
+        Splits the video of source_path at keyframes into chunk_seconds pieces, encodes them in parallel and
+        concatenates them losslessly with the original audio. Returns the frame count, or None if anything
+        (including output validation) fails so the caller can fall back to a single-process encode.
+        """
+        chunk_dir = source_path + ".chunks"
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        os.makedirs(chunk_dir)
+        try:
+            # stream copy can only cut on keyframes, so every chunk starts a new GOP
+            split_cmd = [
+                self.ffmpeg,
+                "-nostdin",
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-i",
+                source_path,
+                "-map",
+                "0:v:0",
+                "-c",
+                "copy",
+                "-f",
+                "segment",
+                "-segment_time",
+                str(self.chunk_seconds),
+                "-reset_timestamps",
+                "1",
+                os.path.join(chunk_dir, "source_%05d.mp4"),
+            ]
+            result = run(split_cmd, name="ffmpeg")
+            if not result.ok:
+                logger.warning("      > Couldn't split '%s' into chunks: %s", title, result.describe())
+                return None
+
+            sources = sorted(f for f in os.listdir(chunk_dir) if f.startswith("source_"))
+            logger.info("      > Encoding '%s' as %d parallel chunks", title, len(sources))
+            futures = [
+                self._chunk_executor.submit(
+                    self.encode_file,
+                    os.path.join(chunk_dir, name),
+                    os.path.join(chunk_dir, name.replace("source_", "encoded_")),
+                    f"{title} [{i + 1}/{len(sources)}]",
+                    False,
+                )
+                for i, name in enumerate(sources)
+            ]
+            chunk_frames = [future.result() for future in futures]
+            if any(frames is None for frames in chunk_frames):
+                return None
+
+            list_path = os.path.join(chunk_dir, "chunks.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                for name in sources:
+                    encoded_path = os.path.join(chunk_dir, name.replace("source_", "encoded_"))
+                    f.write("file '{}'\n".format(encoded_path.replace("'", "'\\''")))
+            concat_cmd = [
+                self.ffmpeg,
+                "-nostdin",
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-y",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                list_path,
+                "-i",
+                source_path,
+                "-map",
+                "0:v:0",
+                "-map",
+                "1:a?",
+                "-map_metadata",
+                "1",
+                "-c",
+                "copy",
+                "-f",
+                "mp4",
+                output_path,
+            ]
+            result = run(concat_cmd, name="ffmpeg")
+            if not result.ok:
+                logger.warning("      > Couldn't join the chunks of '%s': %s", title, result.describe())
+                return None
+
+            if not self.validate_chunked(source_path, output_path, title):
+                return None
+            return sum(chunk_frames)
+        finally:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    def validate_chunked(self, source_path, output_path, title):
+        """
+        A chunked encode must match the source's duration and carry exactly its video frames (no gaps or overlaps)
+        """
+        source_duration, source_packets = probe_media(source_path, count_packets=True, ffprobe=self.ffprobe)
+        output_duration, output_packets = probe_media(output_path, count_packets=True, ffprobe=self.ffprobe)
+        if source_duration is None or output_duration is None:
+            logger.warning("      > Couldn't probe the chunked encode of '%s'", title)
+            return False
+        tolerance = max(CHUNK_DURATION_TOLERANCE, source_duration * CHUNK_DURATION_TOLERANCE_RATIO)
+        if abs(source_duration - output_duration) > tolerance:
+            logger.warning(
+                "      > Chunked encode of '%s' is %.2fs long, source is %.2fs", title, output_duration, source_duration
+            )
+            return False
+        if source_packets != output_packets:
+            logger.warning(
+                "      > Chunked encode of '%s' has %s video frames, source has %s", title, output_packets, source_packets
+            )
+            return False
+        return True
+
+    def wait(self):
+        """
+        Waits for every queued encode to finish
+        """
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.result()
+        with self._lock:
+            self._futures = [future for future in self._futures if not future.done()]
+
+    def join(self, shutdown=True):
+        """
+        Waits for every queued encode to finish and shuts the pool down, unless it's kept for more work (daemon)
+        """
+        self.wait()
+        if shutdown:
+            self._executor.shutdown(wait=True)
+            if self._chunk_executor:
+                self._chunk_executor.shutdown(wait=True)
+        logger.info(
+            "> Transcode queue finished: %d encoded, %d failed, average %.1f fps",
+            self.encoded,
+            self.failed,
+            self.fps,
+        )
+        if self.skipped:
+            logger.info(
+                "> Skipped %d re-encode(s) covering %.1f min of video%s",
+                self.skipped,
+                self.skipped_media_seconds / 60,
+                self.saved_time_estimate(),
+            )
+
+    def saved_time_estimate(self):
+        """
+        Estimates the encoder time the skipped re-encodes would have cost, from this run's encode speed
+        """
+        if not self.media_seconds or not self.skipped_media_seconds:
+            return ""
+        # wall seconds of encoding per second of video, times the threads each libx265 encode kept busy
+        encode_cost = self.encode_seconds / self.media_seconds
+        saved = self.skipped_media_seconds * encode_cost
+        if self.use_nvenc:
+            return ", saving about %.1f min of GPU encode time" % (saved / 60)
+        return ", saving about %.1f CPU-min" % (saved * self.threads / 60)